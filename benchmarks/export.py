@@ -0,0 +1,110 @@
+"""
+Throughput and memory of exporting transactions to CSV.
+
+    - before: model instances, data JSON read in python for every row
+    - after: vpos.export.export, values() + iterator() and JSON keys
+      extracted by the database
+
+Usage:
+    python benchmarks/export.py [--rows 100000]
+"""
+import os
+import csv
+import sys
+import time
+import uuid
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django() -> None:
+    import django
+    from django.conf import settings
+    settings.configure(
+        INSTALLED_APPS=['vpos'],
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:'}},
+        USE_TZ=True,
+        VPOS={
+            'TOKEN': 'benchmark',
+            'POS_ID': 1,
+            'URL': 'http://127.0.0.1/confirm'})
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def populate(rows: int) -> None:
+    from vpos.models import Transaction
+    Transaction.objects.bulk_create((
+        Transaction(
+            id=uuid.uuid4(),
+            key=uuid.uuid4().hex,
+            type=Transaction.Type.PAYMENT,
+            mobile='923000000',
+            amount='1500.00',
+            requested=True,
+            status='accepted',
+            data={
+                'location': '/api/v1/requests/benchmark',
+                'transaction': {
+                    'status': 'accepted',
+                    'status_datetime': '2021-01-01T00:00:00Z',
+                    'clearing_period': '2021-01-01'}})
+        for _ in range(rows)), batch_size=5000)
+
+
+def before(stream) -> int:
+    from vpos.models import Transaction
+    writer = csv.writer(stream)
+    count = 0
+    for t in Transaction.objects.all().order_by('created_at', 'id'):
+        payment: dict = t.payment or {}
+        writer.writerow([t.id, t.key, t.type, t.status, t.status_code, t.mobile,
+            t.amount, t.vpos_fee, t.bank_fee, t.parent and t.parent.key,
+            t.created_at.isoformat(), t.requested_at, t.completed_at, t.location,
+            payment.get('status_datetime'), payment.get('clearing_period')])
+        count += 1
+    return count
+
+
+def after(stream) -> int:
+    from vpos.export import export
+    return export(stream, 'csv')
+
+
+def measure(label: str, call, rows: int) -> None:
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = call(NullStream())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-8s %8.0f rows/s  %8.0f KiB peak' % (
+        label, count / elapsed, peak / 1024))
+
+
+class NullStream:
+
+    """Discards the output, only the export itself is measured"""
+
+    def write(self, data: str) -> int:
+        return len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    setup_django()
+    populate(args.rows)
+    measure('before', before, args.rows)
+    measure('after', after, args.rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Latency of VposAPI calls with and without the shared keep-alive session.
+
+Starts a local stub of the vPOS API and times N sequential GET requests:
+    - before: a new connection per call (module level requests.get)
+    - after: VposAPI.get through the pooled session
+
+Usage:
+    python benchmarks/http_session.py [--requests 500] [--delay 0]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import statistics
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    delay: float = 0
+
+    def do_GET(self):
+        if self.delay:
+            time.sleep(self.delay)
+        body = b'{"eta": 1.5}'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(delay: float) -> ThreadingHTTPServer:
+    StubHandler.delay = delay
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def setup_django(base_url: str) -> None:
+    import django
+    from django.conf import settings
+    settings.configure(VPOS={
+        'TOKEN': 'benchmark',
+        'POS_ID': 1,
+        'URL': 'http://127.0.0.1/confirm',
+        'VPOS_BASE_URL': base_url})
+    django.setup()
+
+
+def measure(label: str, call, n: int) -> None:
+    timings = []
+    for _ in range(n):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    print('%-8s mean %.3fms  p50 %.3fms  p99 %.3fms' % (
+        label,
+        statistics.mean(timings),
+        timings[len(timings) // 2],
+        timings[min(len(timings) - 1, int(len(timings) * 0.99))]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=500)
+    parser.add_argument('--delay', type=float, default=0,
+        help='server side delay in seconds')
+    args = parser.parse_args()
+
+    server = start_server(args.delay)
+    base_url = 'http://127.0.0.1:%d/api/v1' % server.server_address[1]
+    setup_django(base_url)
+
+    import requests
+    from vpos.api import VposAPI
+
+    api = VposAPI(idempotency_key='benchmark')
+    url = f'{base_url}/requests/benchmark'
+
+    def before():
+        with requests.get(url, headers={'Authorization': 'Bearer benchmark'}) as r:
+            return r
+
+    def after():
+        return api.get('/requests/benchmark')
+
+    measure('before', before, args.requests)
+    measure('after', after, args.requests)
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+Load test of the package against the local vPOS simulator (vpos.simulator).
+
+Scenarios, each driven open loop at --rps for --duration seconds:
+    - create: Transaction.objects.create_payment + request
+    - poll: check_payment of requested transactions (eta already elapsed)
+    - webhook: request with callbacks, the simulator POSTs them to the
+      confirmation view served locally, latency is request to completed_at
+
+Reports throughput and p50/p99 latency per scenario.
+A scratch sqlite database is used unless --settings points to a project.
+
+Usage:
+    python benchmarks/load.py [--rps 50] [--duration 10] [--latency 0.01]
+        [--scenario create poll webhook] [--settings myproject.settings]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from wsgiref.simple_server import WSGIRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(settings_module: str, base_url: str, callback_url: str) -> None:
+    import django
+    from django.conf import settings
+    vpos = {
+        'TOKEN': 'benchmark',
+        'POS_ID': 1,
+        'MODE': 'sandbox',
+        'URL': callback_url,
+        'VPOS_BASE_URL': base_url}
+    if settings_module:
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+        django.setup()
+        settings.VPOS = {**getattr(settings, 'VPOS', {}), **vpos}
+        from vpos.configs import conf
+        conf.reload()
+    else:
+        settings.configure(
+            SECRET_KEY='benchmark',
+            INSTALLED_APPS=['vpos'],
+            DATABASES={'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': os.path.join(tempfile.mkdtemp(), 'load.sqlite3'),
+                'OPTIONS': {'timeout': 60}}},
+            ROOT_URLCONF='vpos.urls',
+            ALLOWED_HOSTS=['*'],
+            USE_TZ=True,
+            VPOS=vpos)
+        django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def start_webhook_server():
+    """Serves the vPOS confirmation view on a background thread"""
+    from django.core.handlers.wsgi import WSGIHandler
+    from django.core.servers.basehttp import ThreadedWSGIServer
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_message(self, *args):
+            pass
+
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietHandler)
+    server.set_app(WSGIHandler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def drive(call, items: list, rps: float, workers: int):
+    """
+    Calls call(item) at rps (open loop: late calls are not skipped),
+    returns the elapsed seconds and the latencies of successful calls
+    """
+    from django.db import close_old_connections
+
+    latencies: list = []
+    errors: list = []
+
+    def run(item, due: float):
+        try:
+            call(item)
+        except Exception as e:
+            errors.append(e)
+        else:
+            # measured from the scheduled time, includes queueing
+            latencies.append(time.perf_counter() - due)
+        finally:
+            close_old_connections()
+
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(workers) as executor:
+        for index, item in enumerate(items):
+            due = begin + index / rps
+            if (delay := due - time.perf_counter()) > 0:
+                time.sleep(delay)
+            executor.submit(run, item, due)
+    return time.perf_counter() - begin, latencies, errors
+
+
+def report(name: str, count: int, elapsed: float, latencies: list, errors: list) -> None:
+    latencies = sorted(latencies)
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return float('nan')
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+
+    print('%-8s %6d ops  %8.1f ops/s  p50 %8.2fms  p99 %8.2fms  errors %d' % (
+        name, count, len(latencies) / elapsed if elapsed else 0,
+        percentile(0.5), percentile(0.99), len(errors)))
+    if errors:
+        print('         first error: %r' % errors[0])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rps', type=float, default=50)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--eta', type=float, default=1.0,
+        help='seconds until the simulator completes a transaction')
+    parser.add_argument('--latency', type=float, default=0.0,
+        help='simulator latency per response, in seconds')
+    parser.add_argument('--reject-ratio', type=float, default=0.1)
+    parser.add_argument('--scenario', nargs='+', default=['create', 'poll', 'webhook'],
+        choices=['create', 'poll', 'webhook'])
+    parser.add_argument('--settings', default=None,
+        help='Django settings module of a project (e.g. to load test PostgreSQL)')
+    args = parser.parse_args()
+
+    from vpos.simulator import Simulator
+
+    simulator = Simulator(eta=args.eta,
+        latency=args.latency,
+        reject_ratio=args.reject_ratio).start()
+    # the callback url is only known once the webhook server is started
+    setup_django(args.settings, simulator.base_url, 'http://127.0.0.1')
+    server = start_webhook_server()
+    from django.conf import settings
+    from vpos.configs import conf
+    settings.VPOS = {**settings.VPOS,
+        'URL': 'http://127.0.0.1:%d' % server.server_address[1]}
+    conf.reload()
+
+    from vpos.models import Transaction
+
+    count = int(args.rps * args.duration)
+    mobiles = ['9%08d' % i for i in range(count)]
+    print('%d ops per scenario at %.0f rps, eta %.2fs, latency %.3fs' % (
+        count, args.rps, args.eta, args.latency))
+
+    def create(mobile: str, polling: bool = True) -> Transaction:
+        transaction = Transaction.objects.create_payment(mobile, '100.00')
+        transaction.request(polling=polling)
+        return transaction
+
+    if 'create' in args.scenario or 'poll' in args.scenario:
+        created = drive(create, mobiles, args.rps, args.workers)
+        if 'create' in args.scenario:
+            report('create', count, *created)
+
+    if 'poll' in args.scenario:
+        transactions = list(Transaction.objects.pending().filter(key__isnull=False))
+        # only completed transactions are measured, not the eta
+        time.sleep(args.eta)
+        report('poll', len(transactions), *drive(
+            lambda t: t.check_payment(), transactions, args.rps, args.workers))
+
+    if 'webhook' in args.scenario:
+        ids: list = []
+        start = time.perf_counter()
+        _elapsed, _latencies, errors = drive(
+            lambda m: ids.append(create(m, polling=False).pk),
+            mobiles, args.rps, args.workers)
+        # wait for the callbacks
+        pending = Transaction.objects.filter(pk__in=ids, completed_at__isnull=True)
+        deadline = time.perf_counter() + args.eta + 30
+        while pending.exists() and time.perf_counter() < deadline:
+            time.sleep(0.1)
+        # time from the request to the confirmation, minus the simulated eta
+        latencies = [
+            (completed_at - requested_at).total_seconds() - args.eta
+            for requested_at, completed_at in Transaction.objects.filter(
+                pk__in=ids, completed_at__isnull=False).values_list(
+                'requested_at', 'completed_at')]
+        report('webhook', count, time.perf_counter() - start, latencies, errors)
+
+    server.shutdown()
+    simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
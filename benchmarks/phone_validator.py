@@ -0,0 +1,63 @@
+"""
+Phone number normalisation, single and bulk paths.
+
+    - before: re.match / re.sub with the raw pattern string on every call
+    - after: PhoneValidator.clean_number (compiled, memoised)
+    - bulk: PhoneValidator.clean_numbers on the whole list
+
+Usage:
+    python benchmarks/phone_validator.py [--numbers 100000] [--distinct 5000]
+"""
+import os
+import re
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def get_numbers(count: int, distinct: int) -> list:
+    prefixes = ('', '+244', '00244')
+    pool = [
+        '%s9%d%07d' % (random.choice(prefixes), random.choice((1, 2, 3, 4, 9)),
+            random.randrange(10 ** 7))
+        for _ in range(distinct)]
+    return [random.choice(pool) for _ in range(count)]
+
+
+def measure(label: str, call, numbers: list) -> None:
+    start = time.perf_counter()
+    call(numbers)
+    elapsed = time.perf_counter() - start
+    print('%-8s %10.0f numbers/s' % (label, len(numbers) / elapsed))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--numbers', type=int, default=100000)
+    parser.add_argument('--distinct', type=int, default=5000)
+    args = parser.parse_args()
+
+    from vpos.validators import PhoneValidator
+
+    regex, replace = PhoneValidator.regex, PhoneValidator.default_replace
+    numbers = get_numbers(args.numbers, args.distinct)
+
+    def before(numbers):
+        return [re.sub(regex, replace, n) for n in numbers if re.match(regex, n)]
+
+    def after(numbers):
+        return [PhoneValidator.clean_number(n) for n in numbers if PhoneValidator.match(n)]
+
+    def bulk(numbers):
+        return PhoneValidator.clean_numbers(numbers)
+
+    measure('before', before, numbers)
+    measure('after', after, numbers)
+    measure('bulk', bulk, numbers)
+
+
+if __name__ == '__main__':
+    main()
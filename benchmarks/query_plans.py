@@ -0,0 +1,136 @@
+"""
+Query plans and query counts of the common Transaction access patterns.
+
+Prints the EXPLAIN of every TransactionQuerySet pattern with the number of
+queries it makes, and exits with 1 if one of them scans the whole table,
+so a missing or unused index is caught (for ex. in CI).
+
+Usage:
+    python benchmarks/query_plans.py [--rows 20000] [--settings myproject.settings]
+"""
+import os
+import sys
+import uuid
+import datetime
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django(settings_module: str) -> None:
+    import django
+    from django.conf import settings
+    if settings_module:
+        os.environ['DJANGO_SETTINGS_MODULE'] = settings_module
+        django.setup()
+    else:
+        settings.configure(
+            INSTALLED_APPS=['vpos'],
+            DATABASES={'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:'}},
+            USE_TZ=True,
+            VPOS={
+                'TOKEN': 'benchmark',
+                'POS_ID': 1,
+                'URL': 'http://127.0.0.1/confirm'})
+        django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def populate(rows: int) -> None:
+    from django.db import connection
+    from django.utils import timezone
+    from vpos.models import Transaction
+    now = timezone.now()
+    payments: list = []
+    for i in range(rows):
+        status = random.choice([None, 'accepted', 'accepted', 'rejected'])
+        payments.append(Transaction(
+            id=uuid.uuid4(),
+            key=uuid.uuid4().hex if status or i % 10 else None,
+            type=Transaction.Type.PAYMENT,
+            mobile='9%08d' % random.randrange(rows // 10 or 1),
+            amount='1500.00',
+            requested=bool(status) or i % 10 != 0,
+            requested_at=now,
+            status=status,
+            completed_at=now if status else None,
+            data={}))
+    Transaction.objects.bulk_create(payments, batch_size=5000)
+    Transaction.objects.bulk_create((
+        Transaction(
+            id=uuid.uuid4(),
+            key=uuid.uuid4().hex,
+            type=Transaction.Type.REFUND,
+            mobile=parent.mobile,
+            amount=parent.amount,
+            parent=parent,
+            requested=True,
+            data={})
+        for parent in payments[:rows // 20] if parent.status == 'accepted'),
+        batch_size=5000)
+    if connection.vendor in ('postgresql', 'sqlite'):
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+
+def is_full_scan(plan: str, vendor: str) -> bool:
+    table = 'vpos_transaction'
+    if vendor == 'sqlite':
+        return any(line.strip().endswith('SCAN %s' % table) for line in plan.splitlines())
+    if vendor == 'postgresql':
+        return 'Seq Scan on %s' % table in plan
+    return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--settings', default=None,
+        help='Django settings module of a project (e.g. to check PostgreSQL plans)')
+    args = parser.parse_args()
+
+    setup_django(args.settings)
+    populate(args.rows)
+
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.utils import timezone
+    from vpos.models import Transaction
+
+    some = Transaction.objects.filter(key__isnull=False).values_list(
+        'id', 'key', 'mobile').first()
+    objects = Transaction.objects
+    patterns: dict = {
+        'by key (webhook, reconciliation)': lambda: objects.filter(key=some[1]),
+        'by id': lambda: objects.filter(id=some[0]),
+        'pending (poller)': lambda: objects.pending().filter(
+            key__isnull=False).values_list('id', 'key'),
+        'unrequested': lambda: objects.unrequested().order_by('created_at'),
+        'payments of a mobile': lambda: objects.payments().for_mobile(some[2])[:20],
+        'refunds pending': lambda: objects.refunds().filter(status__isnull=True),
+        'refundable of a mobile': lambda: objects.for_mobile(some[2]).refundable()[:20],
+        'rejected since': lambda: objects.rejected().filter(
+            completed_at__gte=timezone.now() - datetime.timedelta(days=1)),
+    }
+
+    failed = False
+    vendor = connection.vendor
+    for name, build in patterns.items():
+        queryset = build()
+        with CaptureQueriesContext(connection) as queries:
+            list(queryset)
+        plan: str = queryset.explain()
+        scan = is_full_scan(plan, vendor)
+        failed |= scan
+        print('%-36s queries %d  %s' % (name, len(queries), 'FULL SCAN' if scan else 'ok'))
+        for line in plan.splitlines():
+            print('    ' + line)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
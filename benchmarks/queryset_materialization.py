@@ -0,0 +1,87 @@
+"""
+Throughput and memory of loading Transaction rows from the database.
+
+    - before: a VposAPI built for every loaded instance (old Transaction.__init__)
+    - after: the API client is only built when Transaction.api is used
+
+Usage:
+    python benchmarks/queryset_materialization.py [--rows 100000]
+"""
+import os
+import sys
+import time
+import uuid
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def setup_django() -> None:
+    import django
+    from django.conf import settings
+    settings.configure(
+        INSTALLED_APPS=['vpos'],
+        DATABASES={'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': ':memory:'}},
+        USE_TZ=True,
+        VPOS={
+            'TOKEN': 'benchmark',
+            'POS_ID': 1,
+            'URL': 'http://127.0.0.1/confirm'})
+    django.setup()
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def populate(rows: int) -> None:
+    from vpos.models import Transaction
+    Transaction.objects.bulk_create((
+        Transaction(
+            id=uuid.uuid4(),
+            key=uuid.uuid4().hex,
+            type=Transaction.Type.PAYMENT,
+            mobile='923000000',
+            amount='1500.00',
+            requested=True,
+            data={'location': '/api/v1/requests/benchmark'})
+        for _ in range(rows)), batch_size=5000)
+
+
+def measure(label: str, rows: int) -> None:
+    from vpos.models import Transaction
+    tracemalloc.start()
+    start = time.perf_counter()
+    instances = list(Transaction.objects.all())
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print('%-8s %8.0f rows/s  %6.0f bytes/row (peak)' % (
+        label, len(instances) / elapsed, peak / rows))
+    del instances
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    setup_django()
+    populate(args.rows)
+
+    from django.db.models.signals import post_init
+    from vpos.api import VposAPI
+    from vpos.models import Transaction
+
+    def build_api(sender, instance, **kwargs):
+        instance.api = VposAPI(idempotency_key=instance.idempotency_key)
+
+    post_init.connect(build_api, sender=Transaction)
+    measure('before', args.rows)
+    post_init.disconnect(build_api, sender=Transaction)
+    measure('after', args.rows)
+
+
+if __name__ == '__main__':
+    main()
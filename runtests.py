@@ -0,0 +1,32 @@
+#!/usr/bin/env python
+"""
+Runs the test suite, with the tests.settings or the --settings module
+(e.g. a project on PostgreSQL to check its query plans).
+
+Usage:
+    python runtests.py [tests.test_query_plans ...] [--settings myproject.settings]
+"""
+import os
+import sys
+import argparse
+
+import django
+from django.conf import settings
+from django.test.utils import get_runner
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('labels', nargs='*', default=['tests'])
+    parser.add_argument('--settings', default='tests.settings')
+    parser.add_argument('-v', '--verbosity', type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = args.settings
+    django.setup()
+    runner = get_runner(settings)(verbosity=args.verbosity)
+    sys.exit(bool(runner.run_tests(args.labels)))
+
+
+if __name__ == '__main__':
+    main()
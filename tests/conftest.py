@@ -0,0 +1,22 @@
+"""Runs the Django test cases with pytest too, see runtests.py"""
+import os
+
+import django
+import pytest
+
+
+def pytest_configure(config):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'tests.settings')
+    django.setup()
+
+
+@pytest.fixture(scope='session', autouse=True)
+def django_test_environment():
+    from django.test.utils import (
+        setup_databases, setup_test_environment,
+        teardown_databases, teardown_test_environment)
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False)
+    yield
+    teardown_databases(databases, verbosity=0)
+    teardown_test_environment()
@@ -0,0 +1,18 @@
+SECRET_KEY = 'vpos-tests'
+
+INSTALLED_APPS = [
+    'vpos']
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:'}}
+
+USE_TZ = True
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+VPOS = {
+    'TOKEN': 'tests',
+    'POS_ID': 1,
+    'URL': 'http://127.0.0.1/confirm'}
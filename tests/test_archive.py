@@ -0,0 +1,124 @@
+import io
+import os
+import gzip
+import json
+import datetime
+import tempfile
+
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import DatabaseError
+from django.test import TestCase
+from django.utils import timezone
+
+from vpos import archive
+from vpos.models import ArchivedTransaction, Transaction
+
+from tests.utils import create_requested_payment, get_payment_data
+
+
+def create_completed_payment(days: int, **kwargs) -> Transaction:
+    """Accepted payment completed days ago"""
+    transaction = create_requested_payment(**kwargs)
+    transaction.confirm(get_payment_data(transaction))
+    set_completed_at(transaction, days)
+    return transaction
+
+
+def create_refund(parent: Transaction, days: int = None) -> Transaction:
+    """Refund of parent, completed days ago if given, else open"""
+    refund = Transaction.objects.create_refund(parent)
+    refund.save_location('/api/v1/requests/%s' % refund.pk.hex)
+    if days is not None:
+        refund.confirm(get_payment_data(refund))
+        set_completed_at(refund, days)
+    return refund
+
+
+def set_completed_at(transaction: Transaction, days: int) -> None:
+    transaction.completed_at = timezone.now() - datetime.timedelta(days=days)
+    Transaction.objects.filter(pk=transaction.pk).update(completed_at=transaction.completed_at)
+
+
+class ArchiveTests(TestCase):
+
+    def test_payment_moved_with_its_refund(self):
+        payment = create_completed_payment(100)
+        refund = create_refund(payment, 95)
+        recent = create_completed_payment(1)
+        pending = create_requested_payment()
+        result = archive.Archiver(days=90).run()
+        self.assertEqual((result.batches, result.payments, result.refunds), (1, 1, 1))
+        self.assertEqual(set(Transaction.objects.values_list('pk', flat=True)),
+            {recent.pk, pending.pk})
+        archived = ArchivedTransaction.objects.get(pk=refund.pk)
+        self.assertEqual(archived.parent_id, payment.pk)
+        self.assertEqual(ArchivedTransaction.objects.get(pk=payment.pk).key, payment.key)
+        self.assertEqual(ArchivedTransaction.objects.count(), 2)
+
+    def test_open_or_recent_refund_keeps_its_parent(self):
+        open_parent = create_completed_payment(100)
+        create_refund(open_parent)
+        recent_parent = create_completed_payment(100)
+        create_refund(recent_parent, 10)
+        result = archive.Archiver(days=90).run()
+        self.assertEqual(result.payments, 0)
+        self.assertEqual(Transaction.objects.count(), 4)
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+    def test_batches(self):
+        for _ in range(5):
+            create_completed_payment(100)
+        archiver = archive.Archiver(days=90, batch_size=2)
+        self.assertEqual(archiver.run(max_batches=2).payments, 4)
+        self.assertEqual(Transaction.objects.count(), 1)
+        result = archiver.run()
+        self.assertEqual((result.batches, result.payments), (1, 1))
+
+    def test_jsonl_store(self):
+        payment = create_completed_payment(100)
+        refund = create_refund(payment, 95)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.jsonl')
+            with archive.open_store(path) as stream, \
+                    mock.patch('vpos.archive.os.fsync') as fsync:
+                archive.Archiver(days=90, stream=stream).run()
+                # synced to disk before the rows are deleted
+                fsync.assert_called_once_with(stream.fileno())
+            with open(path, encoding='utf-8') as stream:
+                rows = [json.loads(line) for line in stream]
+        self.assertEqual([row['id'] for row in rows], [str(payment.pk), str(refund.pk)])
+        self.assertEqual(set(rows[0]), set(ArchivedTransaction.FIELDS))
+        self.assertEqual(rows[1]['parent_id'], str(payment.pk))
+        self.assertFalse(Transaction.objects.exists())
+        self.assertFalse(ArchivedTransaction.objects.exists())
+
+    def test_gzip_store_appended(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'archive.jsonl.gz')
+            for _ in range(2):
+                create_completed_payment(100)
+                with archive.open_store(path) as stream:
+                    archive.Archiver(days=90, stream=stream).run()
+            with gzip.open(path, 'rt', encoding='utf-8') as stream:
+                self.assertEqual(len(stream.readlines()), 2)
+
+    def test_rows_kept_if_delete_fails(self):
+        payment = create_completed_payment(100)
+        stream = io.StringIO()
+        with mock.patch('django.db.models.query.QuerySet.delete', side_effect=DatabaseError):
+            with self.assertRaises(DatabaseError):
+                archive.Archiver(days=90, stream=stream).run()
+        self.assertTrue(Transaction.objects.filter(pk=payment.pk).exists())
+        # written again by the next run
+        archive.Archiver(days=90, stream=stream).run()
+        self.assertEqual(len(stream.getvalue().splitlines()), 2)
+        self.assertFalse(Transaction.objects.exists())
+
+    def test_command(self):
+        create_completed_payment(100)
+        stdout = io.StringIO()
+        call_command('vpos_archive', days=90, stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(), 'batches: 1, payments: 1, refunds: 0')
+        self.assertEqual(ArchivedTransaction.objects.count(), 1)
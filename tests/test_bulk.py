@@ -0,0 +1,151 @@
+import time
+import decimal
+import threading
+
+from unittest import mock
+
+from django.conf import settings
+from django.db import IntegrityError, connection
+from django.test import TransactionTestCase
+
+from vpos import leases
+from vpos.bulk import BulkResult, submit_requests
+from vpos.models import OutboxEntry, Transaction
+from vpos.models.transaction import TransactionQuerySet
+
+from tests.utils import SimulatorMixin
+
+
+class BulkCreateTests(TransactionTestCase):
+
+    def test_invalid_items_fail_alone(self):
+        results = Transaction.objects.bulk_create_payments([
+            ('923456789', '1000'),
+            ('123', '1000'),
+            {'mobile': '923456780', 'amount': 'abc'},
+            {'mobile': '923456781', 'amount': '250.50'}])
+        self.assertEqual([r.ok for r in results], [True, False, False, True])
+        self.assertEqual([r.index for r in results], [0, 1, 2, 3])
+        self.assertIsNone(results[1].transaction)
+        self.assertEqual(Transaction.objects.count(), 2)
+
+    def test_database_error_fails_the_offending_rows_only(self):
+        bulk_create = TransactionQuerySet.bulk_create
+
+        def failing_bulk_create(queryset, objs, *args, **kwargs):
+            objs = list(objs)
+            if any(t.amount == decimal.Decimal('13') for t in objs):
+                raise IntegrityError('rejected row')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        items = [('923456789', '13' if i == 3 else '1000') for i in range(5)]
+        with mock.patch.object(TransactionQuerySet, 'bulk_create', failing_bulk_create):
+            results = Transaction.objects.bulk_create_payments(items, batch_size=10)
+        self.assertEqual([r.ok for r in results], [True, True, True, False, True])
+        self.assertIsInstance(results[3].error, IntegrityError)
+        self.assertIsNone(results[3].transaction)
+        self.assertEqual(Transaction.objects.count(), 4)
+
+    def test_outbox_entries_inserted_with_their_rows(self):
+        with self.settings(VPOS={**settings.VPOS, 'OUTBOX': True}):
+            results = Transaction.objects.bulk_create_payments(
+                [('923456789', '1000')] * 3, polling=True)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(OutboxEntry.objects.filter(polling=True).count(), 3)
+
+    def test_refund_of_a_refunded_parent_fails(self):
+        parents = [Transaction.objects.create_payment('923456789', '1000') for _ in range(2)]
+        Transaction.objects.filter(pk__in=[p.pk for p in parents]).update(
+            status='accepted', requested=True)
+        parents = list(Transaction.objects.filter(pk__in=[p.pk for p in parents]))
+        Transaction.objects.create_refund(parents[0])
+        results = Transaction.objects.bulk_create_refunds(parents + parents[1:])
+        self.assertEqual([r.ok for r in results], [False, True, False])
+        self.assertEqual(Transaction.objects.refunds().count(), 2)
+
+
+class BulkRequestTests(SimulatorMixin, TransactionTestCase):
+
+    def create(self, count: int) -> list:
+        return [
+            BulkResult(index, Transaction.objects.create_payment('923456789', '1000'))
+            for index in range(count)]
+
+    def test_request_saves_each_location(self):
+        results = Transaction.objects.bulk_create_payments(
+            [('923456789', '1000')] * 4, request=True, polling=True)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(self.simulator.posts, 4)
+        self.assertEqual(Transaction.objects.filter(
+            requested=True, key__isnull=False, requesting_until__isnull=True).count(), 4)
+
+    def test_per_item_request_errors(self):
+        results = self.create(3)
+        original = type(results[1].transaction.api).create
+        failing: str = str(results[1].transaction.pk)
+
+        def create(api, **kwargs):
+            if api._idempotency_key == failing:
+                raise ValueError('vPOS refused it')
+            return original(api, **kwargs)
+
+        with mock.patch.object(type(results[1].transaction.api), 'create', create), \
+                self.assertLogs('vpos.bulk', 'WARNING'):
+            submit_requests(results, polling=True)
+        self.assertEqual([r.ok for r in results], [True, False, True])
+        self.assertFalse(Transaction.objects.get(pk=failing).requested)
+
+    def hold_lease(self, transaction, location: str = None) -> threading.Thread:
+        lease = leases.RowLease(Transaction, transaction.pk)
+        self.assertTrue(lease.acquire())
+
+        def finish():
+            time.sleep(0.3)
+            if location:
+                Transaction.objects.get(pk=transaction.pk).save_location(location)
+            lease.release()
+            connection.close()
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        return thread
+
+    def test_transaction_being_requested_is_not_requested_again(self):
+        results = self.create(3)
+        thread = self.hold_lease(results[0].transaction, '/api/v1/requests/other')
+        submit_requests(results, polling=True)
+        thread.join()
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(self.simulator.posts, 2)
+        self.assertEqual(results[0].transaction.key, 'other')
+
+    def test_failed_concurrent_request_is_an_error(self):
+        results = self.create(2)
+        thread = self.hold_lease(results[0].transaction)
+        submit_requests(results, polling=True)
+        thread.join()
+        self.assertEqual([r.ok for r in results], [False, True])
+        self.assertEqual(self.simulator.posts, 1)
+
+    def test_transaction_requested_meanwhile_is_skipped(self):
+        self.override_vpos(LEASE_CACHE='default')
+        results = self.create(2)
+        Transaction.objects.get(pk=results[0].transaction.pk).save_location(
+            '/api/v1/requests/other')
+        submit_requests(results, polling=True)
+        self.assertTrue(all(r.ok for r in results))
+        self.assertEqual(self.simulator.posts, 1)
+        self.assertEqual(results[0].transaction.key, 'other')
+
+    def test_concurrent_request_call_makes_no_second_call(self):
+        results = self.create(1)
+        transaction = Transaction.objects.get(pk=results[0].transaction.pk)
+        thread = threading.Thread(target=lambda: (
+            transaction.request(polling=True), connection.close()))
+        thread.start()
+        time.sleep(0.05)
+        submit_requests(results, polling=True)
+        thread.join()
+        self.assertTrue(results[0].ok)
+        self.assertEqual(self.simulator.posts, 1)
+        self.assertEqual(results[0].transaction.key, transaction.key)
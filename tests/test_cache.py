@@ -0,0 +1,101 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction as db_transaction
+from django.test import TransactionTestCase, override_settings
+
+from vpos import cache
+from vpos.models import Transaction
+
+from tests.utils import create_requested_payment, get_payment_data
+
+
+class StatusCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        override = override_settings(VPOS={**settings.VPOS,
+            'STATUS_CACHE': 'default', 'STATUS_CACHE_PENDING_TIMEOUT': 0.2})
+        override.enable()
+        self.addCleanup(override.disable)
+        caches['default'].clear()
+        self.addCleanup(caches['default'].clear)
+
+    def create_accepted_payment(self) -> Transaction:
+        transaction = create_requested_payment()
+        transaction.confirm(get_payment_data(transaction))
+        return transaction
+
+    def test_read_through(self):
+        accepted = self.create_accepted_payment()
+        caches['default'].clear()
+        pending = create_requested_payment()
+        unknown = '00000000-0000-0000-0000-000000000000'
+        with self.assertNumQueries(1):
+            entries = cache.get_many([accepted.pk, pending.pk, unknown])
+        self.assertEqual(set(entries), {str(accepted.pk), str(pending.pk)})
+        self.assertEqual(entries[str(accepted.pk)]['status'], 'accepted')
+        self.assertIsNone(entries[str(pending.pk)]['status'])
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(accepted.pk), entries[str(accepted.pk)])
+
+    def test_pending_entries_expire_soon(self):
+        pending = create_requested_payment()
+        cache.get(pending.pk)
+        with self.assertNumQueries(0):
+            cache.get(pending.pk)
+        time.sleep(0.3)
+        with self.assertNumQueries(1):
+            cache.get(pending.pk)
+
+    def test_confirm_updates_the_entry_once_committed(self):
+        transaction = create_requested_payment()
+        self.assertIsNone(cache.get(transaction.pk)['status'])
+        with db_transaction.atomic():
+            transaction.confirm(get_payment_data(transaction))
+            self.assertIsNone(caches['default'].get(cache.get_cache_key(transaction.pk))['status'])
+        with self.assertNumQueries(0):
+            entry = cache.get(transaction.pk)
+        self.assertEqual(entry['status'], 'accepted')
+        self.assertEqual(entry['payment'], transaction.payment)
+
+    def test_rolled_back_confirmation_not_cached(self):
+        transaction = create_requested_payment()
+        with self.assertRaises(RuntimeError), db_transaction.atomic():
+            transaction.confirm(get_payment_data(transaction))
+            raise RuntimeError
+        self.assertIsNone(caches['default'].get(cache.get_cache_key(transaction.pk)))
+
+    def test_confirm_many_updates_the_entries(self):
+        transactions = [create_requested_payment() for _ in range(2)]
+        cache.get_many([t.pk for t in transactions])
+        Transaction.objects.confirm_many([
+            (t, get_payment_data(t, 'rejected')) for t in transactions])
+        with self.assertNumQueries(0):
+            entries = cache.get_many([t.pk for t in transactions])
+        self.assertEqual([e['status'] for e in entries.values()], ['rejected', 'rejected'])
+
+    def test_refund_updates_the_parent_entry(self):
+        payment = self.create_accepted_payment()
+        self.assertIsNone(cache.get(payment.pk)['refund'])
+        with db_transaction.atomic():
+            refund = Transaction.objects.create_refund(payment)
+            self.assertIsNone(caches['default'].get(cache.get_cache_key(payment.pk))['refund'])
+        with self.assertNumQueries(0):
+            self.assertEqual(cache.get(payment.pk)['refund'], str(refund.pk))
+        self.assertEqual(cache.get(refund.pk)['parent'], str(payment.pk))
+
+    def test_reads_do_not_overwrite_confirmations(self):
+        transaction = create_requested_payment()
+        stale = cache.get_entry(transaction)
+        transaction.confirm(get_payment_data(transaction))
+        # a read that started before the confirmation
+        caches['default'].add(cache.get_cache_key(transaction.pk), stale)
+        self.assertEqual(cache.get(transaction.pk)['status'], 'accepted')
+
+    def test_without_status_cache(self):
+        transaction = self.create_accepted_payment()
+        with override_settings(VPOS={**settings.VPOS, 'STATUS_CACHE': None}):
+            with self.assertNumQueries(2):
+                cache.get(transaction.pk)
+                cache.get(transaction.pk)
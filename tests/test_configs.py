@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from vpos.configs import DEFAULTS, VposSettings, conf
+from vpos.exceptions import VposConfigurationError
+
+
+class ReloadTests(SimpleTestCase):
+
+    def test_invalid_reload_keeps_the_snapshot(self):
+        values: dict = {**settings.VPOS}
+        vpos_settings = VposSettings(DEFAULTS, values)
+        snapshot = vpos_settings.load()
+        values['MODE'] = 'staging'
+        with self.assertRaises(VposConfigurationError):
+            vpos_settings.reload()
+        self.assertIs(vpos_settings.snapshot, snapshot)
+        self.assertEqual(vpos_settings.MODE, snapshot.values['MODE'])
+
+    def test_invalid_tenant_keeps_the_snapshot(self):
+        values: dict = {**settings.VPOS}
+        vpos_settings = VposSettings(DEFAULTS, values)
+        snapshot = vpos_settings.load()
+        values['TENANTS'] = {'shop': {'MODE': 'staging'}}
+        with self.assertRaises(VposConfigurationError):
+            vpos_settings.reload()
+        self.assertIs(vpos_settings.snapshot, snapshot)
+
+    def test_reload_on_setting_changed(self):
+        with override_settings(VPOS={**settings.VPOS, 'POS_ID': 99}):
+            self.assertEqual(conf.POS_ID, 99)
+        self.assertEqual(conf.POS_ID, settings.VPOS['POS_ID'])
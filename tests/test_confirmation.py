@@ -0,0 +1,135 @@
+import json
+import time
+
+from django.db import OperationalError
+from django.test import RequestFactory, TransactionTestCase
+
+from vpos.models import Transaction
+from vpos.signals import transaction_completed
+from vpos.views import watch_transaction_confirmation
+
+from tests.utils import (
+    SimulatorMixin, create_requested_payment, get_payment_data, run_threads)
+
+
+def retried(fn):
+    """
+    fn retried while the database is locked: sqlite (in memory) fails concurrent
+    writers at once, vPOS retries the webhook and the poller checks again
+    """
+    def call():
+        for _attempt in range(20):
+            try:
+                return fn()
+            except OperationalError:
+                time.sleep(0.01)
+        return fn()
+    return call
+
+
+class ConfirmationTests(TransactionTestCase):
+
+    def setUp(self):
+        self.completed: list = []
+
+        def receiver(transaction, **kwargs):
+            self.completed.append((transaction.pk, transaction.status))
+
+        transaction_completed.connect(receiver)
+        self.addCleanup(transaction_completed.disconnect, receiver)
+        self.transaction = create_requested_payment()
+
+    def get_copy(self) -> Transaction:
+        return Transaction.objects.get(pk=self.transaction.pk)
+
+    def test_stale_instance_not_confirmed_again(self):
+        stale = self.get_copy()
+        self.assertTrue(self.transaction.confirm(get_payment_data(self.transaction)))
+        self.assertFalse(stale.confirm(get_payment_data(stale, 'rejected')))
+        # the losing instance is refreshed with the saved confirmation
+        self.assertTrue(stale.accepted)
+        self.assertEqual(stale.completed_at, self.transaction.completed_at)
+        self.assertEqual(len(self.completed), 1)
+
+    def test_confirm_many_skips_confirmed_rows(self):
+        other = create_requested_payment()
+        items = [(self.get_copy(), get_payment_data(self.transaction, 'rejected')),
+            (Transaction.objects.get(pk=other.pk), get_payment_data(other, 'rejected'))]
+        self.assertTrue(self.transaction.confirm(get_payment_data(self.transaction)))
+        confirmed = Transaction.objects.confirm_many(items)
+        self.assertEqual([t.pk for t in confirmed], [other.pk])
+        self.assertTrue(Transaction.objects.get(pk=self.transaction.pk).accepted)
+        self.assertTrue(Transaction.objects.get(pk=other.pk).rejected)
+        self.assertEqual(len(self.completed), 2)
+        self.assertEqual(Transaction.objects.confirm_many(items), [])
+        self.assertEqual(len(self.completed), 2)
+
+
+class WebhookTests(TransactionTestCase):
+
+    def setUp(self):
+        self.transaction = create_requested_payment()
+
+    def post(self, data: dict, transaction_id=None):
+        request = RequestFactory().post('/', json.dumps(data),
+            content_type='application/json')
+        return watch_transaction_confirmation(request, transaction_id or self.transaction.pk)
+
+    def test_confirmed_once(self):
+        data = get_payment_data(self.transaction)
+        self.assertEqual(self.post(data).status_code, 200)
+        # retries of the webhook
+        self.assertEqual(self.post(data).status_code, 403)
+        self.assertEqual(self.post(get_payment_data(self.transaction, 'rejected')).status_code, 403)
+        self.transaction.refresh_from_db()
+        self.assertTrue(self.transaction.accepted)
+
+    def test_concurrent_calls(self):
+        data = get_payment_data(self.transaction)
+        codes = run_threads(retried(lambda: self.post(data).status_code), 4)
+        self.assertEqual(codes.count(200), 1)
+        # 409 if the row was loaded before the other confirmation
+        self.assertTrue(set(codes) <= {200, 403, 409}, codes)
+
+    def test_wrong_key_or_transaction(self):
+        data = {**get_payment_data(self.transaction), 'id': 'other'}
+        self.assertEqual(self.post(data).status_code, 403)
+        other = Transaction.objects.create_payment('923456789', '1000')
+        self.assertEqual(self.post(get_payment_data(self.transaction), other.pk).status_code, 403)
+        self.assertEqual(self.post(get_payment_data(self.transaction),
+            '00000000-0000-0000-0000-000000000000').status_code, 404)
+        self.assertEqual(self.post({'id': self.transaction.key}).status_code, 400)
+        self.transaction.refresh_from_db()
+        self.assertIsNone(self.transaction.payment)
+
+
+class RaceTests(SimulatorMixin, TransactionTestCase):
+
+    simulator_options: dict = {'eta': 0}
+
+    def test_webhook_and_polling_race(self):
+        completed: list = []
+
+        def receiver(transaction, **kwargs):
+            completed.append(transaction.pk)
+
+        transaction_completed.connect(receiver)
+        self.addCleanup(transaction_completed.disconnect, receiver)
+        transaction = Transaction.objects.create_payment('923456789', '1000')
+        self.assertTrue(transaction.request(polling=True))
+        data = get_payment_data(transaction)
+        # instances loaded before any confirmation, as the webhook and the poller would
+        stale = [Transaction.objects.get(pk=transaction.pk) for _ in range(3)]
+
+        def webhook():
+            request = RequestFactory().post('/', json.dumps(data),
+                content_type='application/json')
+            return watch_transaction_confirmation(request, transaction.pk).status_code
+
+        calls = [retried(webhook) for _ in range(3)] + [
+            retried(lambda copy=copy: copy.check_payment()['status']) for copy in stale]
+        results = run_threads(lambda: calls.pop()(), 6)
+        self.assertEqual(completed, [transaction.pk])
+        self.assertTrue(set(results) <= {200, 403, 409, 'accepted'}, results)
+        transaction.refresh_from_db()
+        self.assertTrue(transaction.accepted)
@@ -0,0 +1,179 @@
+import gc
+import time
+import asyncio
+import threading
+
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from vpos import dispatch
+from vpos.models import Transaction
+from vpos.signals import transaction_completed
+
+from tests.utils import SimulatorMixin, create_requested_payment, get_payment_data
+
+
+class Receivers:
+
+    """Connects receivers for a test, they are disconnected on cleanup"""
+
+    def connect(self, receiver, **kwargs):
+        transaction_completed.connect(receiver, **kwargs)
+        self.addCleanup(transaction_completed.disconnect, receiver, **kwargs)
+        return receiver
+
+
+class SendTests(Receivers, SimpleTestCase):
+
+    transaction = Transaction(pk='00000000-0000-0000-0000-000000000001')
+
+    def test_receivers_timed(self):
+        def slow_receiver(transaction, **kwargs):
+            time.sleep(0.05)
+            return transaction.pk
+
+        self.connect(slow_receiver)
+        responses = dispatch.send_completed(self.transaction)
+        self.assertIn((slow_receiver, self.transaction.pk), responses)
+        stats = dispatch.stats[dispatch.get_receiver_name(slow_receiver)]
+        self.assertGreaterEqual(stats.max, 0.05)
+
+    def test_errors_raised_or_returned_if_robust(self):
+        def failing_receiver(**kwargs):
+            raise ValueError('failed')
+
+        self.connect(failing_receiver)
+        with self.assertRaises(ValueError):
+            dispatch.send_completed(self.transaction)
+        with self.assertLogs('vpos.dispatch', 'ERROR'):
+            responses = dispatch.send_completed(self.transaction, robust=True)
+        self.assertIsInstance(dict(responses)[failing_receiver], ValueError)
+        self.assertEqual(dispatch.stats[
+            dispatch.get_receiver_name(failing_receiver)].errors, 2)
+
+    def test_async_receivers(self):
+        loops: list = []
+
+        async def async_receiver(transaction, **kwargs):
+            loops.append(asyncio.get_running_loop())
+            return 'async'
+
+        self.connect(async_receiver)
+        self.assertIn((async_receiver, 'async'), dispatch.send_completed(self.transaction))
+
+        async def main():
+            responses = await dispatch.asend_completed(self.transaction)
+            return responses, asyncio.get_running_loop()
+
+        responses, loop = asyncio.run(main())
+        self.assertIn((async_receiver, 'async'), responses)
+        # awaited in the caller's event loop
+        self.assertIs(loops[-1], loop)
+        self.assertEqual(dispatch.stats[
+            dispatch.get_receiver_name(async_receiver)].calls, 2)
+
+    def test_weak_receiver_disconnected_when_collected(self):
+        calls: list = []
+
+        def receiver(**kwargs):
+            calls.append(1)
+
+        transaction_completed.connect(receiver)
+        count = len(transaction_completed.receivers)
+        del receiver
+        gc.collect()
+        self.assertEqual(len(transaction_completed.receivers), count - 1)
+        dispatch.send_completed(self.transaction)
+        self.assertEqual(calls, [])
+
+    def test_bound_method_receiver(self):
+        class Handler:
+            def receive(self, **kwargs):
+                return 'handled'
+
+        handler = Handler()
+        transaction_completed.connect(handler.receive)
+        self.assertIn('handled', dict(dispatch.send_completed(self.transaction)).values())
+        self.assertTrue(transaction_completed.disconnect(handler.receive))
+        self.assertNotIn('handled', dict(dispatch.send_completed(self.transaction)).values())
+
+
+class DispatcherTests(Receivers, TransactionTestCase):
+
+    def setUp(self):
+        self.received: list = []
+        self.event = threading.Event()
+
+        def receiver(transaction, **kwargs):
+            self.received.append((transaction.pk, threading.current_thread().name))
+            self.event.set()
+
+        self.connect(receiver)
+
+    def test_sync_dispatcher_runs_in_the_caller(self):
+        transaction = create_requested_payment()
+        self.assertTrue(transaction.confirm(get_payment_data(transaction)))
+        self.assertEqual(self.received, [(transaction.pk, threading.current_thread().name)])
+
+    def test_thread_pool_dispatcher_runs_after_commit(self):
+        transaction = create_requested_payment()
+        with override_settings(VPOS={**settings.VPOS,
+                'DISPATCHER': 'vpos.dispatch.ThreadPoolDispatcher'}):
+            with db_transaction.atomic():
+                transaction.confirm(get_payment_data(transaction))
+                self.assertFalse(self.event.wait(0.2))
+            self.assertTrue(self.event.wait(5))
+        self.assertEqual(self.received[0][0], transaction.pk)
+        self.assertTrue(self.received[0][1].startswith('vpos-dispatch-'))
+
+    def test_thread_pool_dispatcher_skips_rollback(self):
+        transaction = create_requested_payment()
+        with override_settings(VPOS={**settings.VPOS,
+                'DISPATCHER': 'vpos.dispatch.ThreadPoolDispatcher'}):
+            with self.assertRaises(RuntimeError), db_transaction.atomic():
+                transaction.confirm(get_payment_data(transaction))
+                raise RuntimeError
+            self.assertFalse(self.event.wait(0.3))
+
+    def test_aconfirm_awaits_async_receivers(self):
+        loops: list = []
+
+        async def async_receiver(**kwargs):
+            loops.append(asyncio.get_running_loop())
+
+        self.connect(async_receiver)
+        transaction = create_requested_payment()
+
+        async def main():
+            confirmed = await transaction.aconfirm(get_payment_data(transaction))
+            return confirmed, asyncio.get_running_loop()
+
+        confirmed, loop = asyncio.run(main())
+        self.assertTrue(confirmed)
+        self.assertEqual(loops, [loop])
+        self.assertEqual(len(self.received), 1)
+        self.assertFalse(asyncio.run(transaction.aconfirm(get_payment_data(transaction))))
+        self.assertEqual(len(self.received), 1)
+
+
+class AsyncCheckTests(SimulatorMixin, Receivers, TransactionTestCase):
+
+    simulator_options: dict = {'eta': 0}
+
+    def test_acheck_payment_awaits_async_receivers(self):
+        loops: list = []
+
+        async def async_receiver(**kwargs):
+            loops.append(asyncio.get_running_loop())
+
+        self.connect(async_receiver)
+        transaction = Transaction.objects.create_payment('923456789', '1000')
+        self.assertTrue(transaction.request(polling=True))
+
+        async def main():
+            return await transaction.acheck_payment(), asyncio.get_running_loop()
+
+        payment, loop = asyncio.run(main())
+        self.assertEqual(payment['status'], 'accepted')
+        self.assertEqual(loops, [loop])
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.test import TransactionTestCase, override_settings
+
+from vpos import fees
+from vpos.models import FeeVersion, Transaction
+
+
+@override_settings(VPOS={**settings.VPOS, 'VPOS_FEE': (2.5, 10, 500, 0)})
+class FeeVersionTests(TransactionTestCase):
+
+    def setUp(self):
+        fees._saved.clear()
+        fees._versions.clear()
+
+    def test_version_saved_again_after_rollback(self):
+        with self.assertRaises(RuntimeError), db_transaction.atomic():
+            version = Transaction.objects.create_payment('923456789', '1000').fee_version_id
+            self.assertTrue(FeeVersion.objects.filter(id=version).exists())
+            raise RuntimeError
+        self.assertFalse(FeeVersion.objects.filter(id=version).exists())
+        self.assertNotIn(version, fees._saved)
+
+        payment = Transaction.objects.create_payment('923456789', '1000')
+        self.assertEqual(payment.fee_version_id, version)
+        self.assertTrue(FeeVersion.objects.filter(id=version).exists())
+        self.assertIn(version, fees._saved)
+        payment = Transaction.objects.get(pk=payment.pk)
+        self.assertEqual(payment.vpos_fee_data['expense'], 25.0)
+
+    def test_saved_version_not_created_again(self):
+        fees.get_current_version()
+        with self.assertNumQueries(0):
+            fees.get_current_version()
@@ -0,0 +1,72 @@
+import time
+import threading
+
+from unittest import skipIf
+
+from django.test import SimpleTestCase, override_settings
+from django.conf import settings
+
+from vpos.instrumentation import Instrument, PrometheusInstrument, get_instrument
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+
+PROMETHEUS: str = 'vpos.instrumentation.PrometheusInstrument'
+
+
+class SlowInstrument(PrometheusInstrument):
+
+    built: int = 0
+
+    def __init__(self) -> None:
+        time.sleep(0.05)
+        type(self).built += 1
+        super().__init__()
+
+
+@skipIf(prometheus_client is None, 'requires prometheus_client')
+class PrometheusInstrumentTests(SimpleTestCase):
+
+    def test_instrument_built_once_per_path(self):
+        instruments: list = []
+        for path in (PROMETHEUS, 'vpos.instrumentation.Instrument', PROMETHEUS):
+            with override_settings(VPOS={**settings.VPOS, 'INSTRUMENT': path}):
+                instruments.append(get_instrument())
+        self.assertIs(instruments[0], instruments[2])
+        self.assertIs(type(instruments[1]), Instrument)
+
+    def test_instances_share_the_collectors(self):
+        first, second = PrometheusInstrument(), PrometheusInstrument()
+        self.assertIs(first.http_requests, second.http_requests)
+        registry = prometheus_client.CollectorRegistry()
+        third = PrometheusInstrument(registry=registry)
+        self.assertIsNot(third.http_requests, first.http_requests)
+        third.concurrency_limit(3, 'shop')
+        self.assertEqual(registry.get_sample_value(
+            'vpos_concurrency_limit', {'tenant': 'shop'}), 3)
+
+    def test_concurrent_first_calls(self):
+        instruments: list = []
+        errors: list = []
+        barrier = threading.Barrier(8)
+
+        def build():
+            barrier.wait()
+            try:
+                instruments.append(get_instrument())
+            except Exception as e:
+                errors.append(e)
+
+        with override_settings(VPOS={**settings.VPOS,
+                'INSTRUMENT': 'tests.test_instrumentation.SlowInstrument'}):
+            threads = [threading.Thread(target=build) for _ in range(8)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(len({id(i) for i in instruments}), 1)
+        self.assertEqual(SlowInstrument.built, 1)
@@ -0,0 +1,177 @@
+import time
+import asyncio
+import threading
+
+from django.db import connection
+from django.test import SimpleTestCase, TransactionTestCase
+
+from vpos import leases
+from vpos.models import Transaction
+
+from tests.utils import SimulatorMixin, run_threads
+
+
+class SingleFlightTests(SimpleTestCase):
+
+    def test_concurrent_calls_share_the_result(self):
+        flight = leases.SingleFlight()
+        calls: list = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'result'
+
+        results = run_threads(lambda: flight.do('key', fn), 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sorted(leader for _result, leader in results), [False] * 4 + [True])
+        self.assertTrue(all(result == 'result' for result, _leader in results))
+
+    def test_followers_get_the_error(self):
+        flight = leases.SingleFlight()
+
+        def fn():
+            time.sleep(0.2)
+            raise ValueError('failed')
+
+        results = run_threads(lambda: flight.do('key', fn), 3)
+        self.assertTrue(all(isinstance(result, ValueError) for result in results))
+
+    def test_async_calls_share_the_result(self):
+        flight = leases.SingleFlight()
+        calls: list = []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.1)
+            return 'result'
+
+        async def main():
+            return await asyncio.gather(*[flight.ado('key', fn) for _ in range(4)])
+
+        results = asyncio.run(main())
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([leader for _result, leader in results], [True, False, False, False])
+
+
+class RowLeaseTests(TransactionTestCase):
+
+    def setUp(self):
+        self.transaction = Transaction.objects.create_payment('923456789', '1000')
+
+    def test_single_holder(self):
+        lease = leases.RowLease(Transaction, self.transaction.pk)
+        self.assertTrue(lease.acquire())
+        self.assertTrue(lease.held())
+        self.assertFalse(leases.RowLease(Transaction, self.transaction.pk).acquire())
+        lease.release()
+        self.assertFalse(lease.held())
+        self.assertTrue(leases.RowLease(Transaction, self.transaction.pk).acquire())
+
+    def test_expired_lease_taken_again(self):
+        lease = leases.RowLease(Transaction, self.transaction.pk, timeout=0.1)
+        self.assertTrue(lease.acquire())
+        time.sleep(0.2)
+        other = leases.RowLease(Transaction, self.transaction.pk)
+        self.assertTrue(other.acquire())
+        # the expired holder does not release the new one
+        lease.release()
+        self.assertTrue(other.held())
+
+    def test_requested_transaction_not_leased(self):
+        Transaction.objects.filter(pk=self.transaction.pk).update(requested=True)
+        self.assertFalse(leases.RowLease(Transaction, self.transaction.pk).acquire())
+
+
+class RequestDeduplicationTests(SimulatorMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.transaction = Transaction.objects.create_payment('923456789', '1000')
+
+    def get_copy(self) -> Transaction:
+        return Transaction.objects.get(pk=self.transaction.pk)
+
+    def test_concurrent_requests_make_one_call(self):
+        copies = [self.get_copy() for _ in range(6)]
+        results = run_threads(lambda: copies.pop().request(polling=True), 6)
+        self.assertEqual(results, [True] * 6)
+        self.assertEqual(self.simulator.posts, 1)
+        self.transaction.refresh_from_db()
+        self.assertTrue(self.transaction.requested)
+        self.assertIsNone(self.transaction.requesting_until)
+
+    def test_concurrent_requests_with_lease_cache(self):
+        self.override_vpos(LEASE_CACHE='default')
+        copies = [self.get_copy() for _ in range(4)]
+        results = run_threads(lambda: copies.pop().request(polling=True), 4)
+        self.assertEqual(results, [True] * 4)
+        self.assertEqual(self.simulator.posts, 1)
+
+    def test_already_requested(self):
+        self.assertTrue(self.transaction.request(polling=True))
+        self.assertFalse(self.transaction.request(polling=True))
+        # an instance loaded before the request
+        stale = Transaction.objects.get(pk=self.transaction.pk)
+        stale.requested = False
+        self.assertFalse(stale.request(polling=True))
+        self.assertEqual(self.simulator.posts, 1)
+
+    def hold_lease(self, location: str = None) -> threading.Thread:
+        """Holds the request lease as another process would, saves location if given"""
+        lease = leases.RowLease(Transaction, self.transaction.pk)
+        self.assertTrue(lease.acquire())
+
+        def finish():
+            time.sleep(0.3)
+            if location:
+                self.get_copy().save_location(location)
+            lease.release()
+            connection.close()
+
+        thread = threading.Thread(target=finish)
+        thread.start()
+        return thread
+
+    def test_waits_for_another_process(self):
+        thread = self.hold_lease('/api/v1/requests/other')
+        self.assertTrue(self.transaction.request(polling=True))
+        thread.join()
+        self.assertEqual(self.transaction.key, 'other')
+        self.assertEqual(self.simulator.posts, 0)
+
+    def test_failed_request_of_another_process(self):
+        thread = self.hold_lease()
+        self.assertFalse(self.transaction.request(polling=True))
+        thread.join()
+        self.assertFalse(self.transaction.requested)
+        self.assertEqual(self.simulator.posts, 0)
+
+    def test_async_waits_for_another_process(self):
+        thread = self.hold_lease('/api/v1/requests/other')
+        self.assertTrue(asyncio.run(self.transaction.arequest(polling=True)))
+        thread.join()
+        self.assertEqual(self.transaction.key, 'other')
+
+    def test_async_failed_request_of_another_process(self):
+        thread = self.hold_lease()
+        self.assertFalse(asyncio.run(self.transaction.arequest(polling=True)))
+        thread.join()
+        self.assertFalse(self.transaction.requested)
+
+    def test_concurrent_async_requests_make_one_call(self):
+        async def main():
+            copies = [await Transaction.objects.aget(pk=self.transaction.pk) for _ in range(4)]
+            return await asyncio.gather(*[t.arequest(polling=True) for t in copies])
+
+        self.assertEqual(asyncio.run(main()), [True] * 4)
+        self.assertEqual(self.simulator.posts, 1)
+
+    def test_failed_call_releases_the_lease(self):
+        self.override_vpos(VPOS_BASE_URL='http://127.0.0.1:1/api/v1', HTTP_MAX_RETRIES=0)
+        copies = [self.get_copy() for _ in range(3)]
+        results = run_threads(lambda: copies.pop().request(polling=True), 3)
+        self.assertTrue(all(isinstance(result, Exception) for result in results), results)
+        self.transaction.refresh_from_db()
+        self.assertFalse(self.transaction.requested)
+        self.assertIsNone(self.transaction.requesting_until)
@@ -0,0 +1,133 @@
+import io
+import datetime
+
+from django.core.management import call_command
+from django.db import transaction as db_transaction
+from django.test import TransactionTestCase
+from django.utils import timezone
+
+from vpos.models import OutboxEntry, Transaction
+from vpos.outbox import OutboxDispatcher
+
+from tests.utils import SimulatorMixin
+
+
+class OutboxTests(SimulatorMixin, TransactionTestCase):
+
+    vpos_settings: dict = {'OUTBOX': True}
+
+    def fail_calls(self, **values) -> None:
+        self.override_vpos(OUTBOX=True, VPOS_BASE_URL='http://127.0.0.1:1/api/v1',
+            HTTP_MAX_RETRIES=0, **values)
+
+    def make_available(self) -> None:
+        OutboxEntry.objects.update(available_at=timezone.now())
+
+    def test_entry_saved_with_the_transaction(self):
+        transaction = Transaction.objects.create_payment('923456789', '1000')
+        self.assertTrue(OutboxEntry.objects.filter(transaction=transaction).exists())
+        self.assertFalse(transaction.requested)
+        with self.assertRaises(RuntimeError), db_transaction.atomic():
+            Transaction.objects.create_payment('923456780', '1000')
+            raise RuntimeError
+        self.assertEqual(OutboxEntry.objects.count(), 1)
+        self.assertEqual(self.simulator.posts, 0)
+
+    def test_requests_sent_and_entries_deleted(self):
+        transactions = [Transaction.objects.create_payment('92345678%d' % i, '1000')
+            for i in range(3)]
+        result = OutboxDispatcher(batch_size=2).run()
+        self.assertEqual((result.claimed, result.requested, result.retried, result.failed),
+            (3, 3, 0, 0))
+        self.assertEqual(self.simulator.posts, 3)
+        self.assertFalse(OutboxEntry.objects.exists())
+        for transaction in transactions:
+            transaction.refresh_from_db()
+            self.assertTrue(transaction.requested)
+            self.assertIn(transaction.key, self.simulator.transactions)
+
+    def test_claimed_entries_hidden(self):
+        Transaction.objects.create_payment('923456789', '1000')
+        dispatcher = OutboxDispatcher()
+        start = timezone.now()
+        entries = dispatcher.claim()
+        self.assertEqual([entry.attempts for entry in entries], [1])
+        # another dispatcher does not get them until the claim expires
+        self.assertEqual(OutboxDispatcher().claim(), [])
+        entry = OutboxEntry.objects.get()
+        self.assertEqual(entry.attempts, 1)
+        self.assertGreaterEqual(entry.available_at, start + datetime.timedelta(seconds=60))
+        self.make_available()
+        self.assertEqual(len(OutboxDispatcher().claim()), 1)
+
+    def test_requested_transaction_not_sent_again(self):
+        transaction = Transaction.objects.create_payment('923456789', '1000')
+        Transaction.objects.get(pk=transaction.pk).save_location('/api/v1/requests/other')
+        result = OutboxDispatcher().run()
+        self.assertEqual((result.claimed, result.requested), (1, 0))
+        self.assertEqual(self.simulator.posts, 0)
+        self.assertFalse(OutboxEntry.objects.exists())
+
+    def test_failed_calls_retried_with_backoff(self):
+        transaction = Transaction.objects.create_payment('923456789', '1000')
+        self.fail_calls(OUTBOX_RETRY_BACKOFF=2)
+        delays: list = []
+        for attempts in (1, 2, 3):
+            start = timezone.now()
+            with self.assertLogs('vpos.outbox', 'WARNING'):
+                result = OutboxDispatcher().run()
+            self.assertEqual((result.claimed, result.retried, result.failed), (1, 1, 0))
+            entry = OutboxEntry.objects.get()
+            self.assertEqual(entry.attempts, attempts)
+            self.assertFalse(entry.failed)
+            self.assertTrue(entry.last_error)
+            delays.append((entry.available_at - start).total_seconds())
+            # not available before its delay
+            self.assertEqual(OutboxDispatcher().run().claimed, 0)
+            self.make_available()
+        self.assertEqual([round(delay) for delay in delays], [2, 4, 8])
+        transaction.refresh_from_db()
+        self.assertFalse(transaction.requested)
+
+    def test_failed_after_max_attempts(self):
+        Transaction.objects.create_payment('923456789', '1000')
+        self.fail_calls(OUTBOX_MAX_ATTEMPTS=2)
+        with self.assertLogs('vpos.outbox', 'WARNING'):
+            self.assertEqual(OutboxDispatcher().run().retried, 1)
+        self.make_available()
+        with self.assertLogs('vpos.outbox', 'ERROR') as logs:
+            self.assertEqual(OutboxDispatcher().run().failed, 1)
+        self.assertIn('failed', logs.output[-1])
+        entry = OutboxEntry.objects.get()
+        self.assertTrue(entry.failed)
+        self.assertEqual(entry.attempts, 2)
+        self.assertTrue(entry.last_error)
+        # failed entries are never claimed again
+        self.make_available()
+        self.assertEqual(OutboxDispatcher().run().claimed, 0)
+
+    def test_polling_flag(self):
+        polling = Transaction.objects.create_payment('923456789', '1000')
+        callback = Transaction.objects.create_payment('923456780', '1000')
+        self.assertTrue(polling.request(polling=True))
+        self.assertTrue(OutboxEntry.objects.get(transaction=polling).polling)
+        self.assertFalse(OutboxEntry.objects.get(transaction=callback).polling)
+        OutboxDispatcher().run()
+        polling.refresh_from_db()
+        callback.refresh_from_db()
+        self.assertIsNone(self.simulator.transactions[polling.key].callback_url)
+        self.assertIsNotNone(self.simulator.transactions[callback.key].callback_url)
+        self.assertFalse(polling.request(polling=True))
+
+    def test_claimed_entry_keeps_its_flag(self):
+        transaction = Transaction.objects.create_payment('923456789', '1000')
+        OutboxDispatcher().claim()
+        self.assertFalse(transaction.request(polling=True))
+        self.assertFalse(OutboxEntry.objects.get().polling)
+
+    def test_command(self):
+        Transaction.objects.create_payment('923456789', '1000')
+        stdout = io.StringIO()
+        call_command('vpos_outbox', stdout=stdout)
+        self.assertEqual(stdout.getvalue().strip(),
+            'claimed: 1, requested: 1, retried: 0, failed: 0')
@@ -0,0 +1,58 @@
+from django.test import TransactionTestCase
+
+from vpos import poller
+from vpos.models import Transaction
+
+from tests.utils import SimulatorMixin
+
+
+class PollerTests(SimulatorMixin, TransactionTestCase):
+
+    simulator_options: dict = {'eta': 0.3, 'outcomes': {'923456780': 2001}}
+
+    def request(self, mobile: str = '923456789') -> Transaction:
+        transaction = Transaction.objects.create_payment(mobile, '1000')
+        self.assertTrue(transaction.request(polling=True))
+        return transaction
+
+    def test_running_transactions_checked_again_when_due(self):
+        accepted, rejected = self.request(), self.request('923456780')
+        result = poller.poll(max_wait=5)
+        self.assertEqual((result.checked, result.completed, result.pending, result.errors),
+            (4, 2, 0, 0))
+        accepted.refresh_from_db()
+        rejected.refresh_from_db()
+        self.assertTrue(accepted.accepted)
+        self.assertTrue(rejected.rejected)
+        self.assertEqual(rejected.status_code, 2001)
+
+    def test_running_transactions_left_pending(self):
+        self.request()
+        result = poller.poll(max_wait=0)
+        self.assertEqual((result.checked, result.completed, result.pending), (1, 0, 1))
+
+    def test_unknown_tenant_is_an_error(self):
+        gone, other = self.request(), self.request()
+        Transaction.objects.filter(pk=gone.pk).update(tenant='gone')
+        with self.assertLogs('vpos.poller', 'ERROR'):
+            result = poller.poll(max_wait=5)
+        self.assertEqual((result.completed, result.errors), (1, 1))
+        other.refresh_from_db()
+        self.assertTrue(other.accepted)
+        self.assertIsNone(Transaction.objects.get(pk=gone.pk).completed_at)
+
+    def test_unreachable_vpos_is_an_error(self):
+        self.request()
+        self.override_vpos(VPOS_BASE_URL='http://127.0.0.1:1/api/v1', HTTP_MAX_RETRIES=0)
+        with self.assertLogs('vpos.poller', 'WARNING'):
+            result = poller.poll()
+        self.assertEqual((result.checked, result.errors), (1, 1))
+
+    def test_open_circuit_is_an_error(self):
+        self.request()
+        self.override_vpos(VPOS_BASE_URL='http://127.0.0.1:1/api/v1', HTTP_MAX_RETRIES=0,
+            CIRCUIT_FAILURE_THRESHOLD=1, CIRCUIT_RECOVERY_TIMEOUT=60)
+        with self.assertLogs('vpos.poller', 'WARNING') as logs:
+            first, second = poller.poll(), poller.poll()
+        self.assertEqual((first.errors, second.errors), (1, 1))
+        self.assertIn('Skipped check', logs.output[-1])
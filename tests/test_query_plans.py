@@ -0,0 +1,107 @@
+"""
+Query counts and query plans of the common Transaction access patterns:
+each one makes a single query and uses an index, a full scan of the
+table means an index is missing or unused.
+Plans are checked on SQLite and PostgreSQL, other databases only check counts.
+"""
+import uuid
+import random
+import datetime
+
+from django.db import connection
+from django.test import TestCase
+from django.utils import timezone
+
+from vpos import cache
+from vpos.models import Transaction
+
+
+TABLE = Transaction._meta.db_table
+
+
+def is_full_scan(plan: str, vendor: str) -> bool:
+    if vendor == 'sqlite':
+        return any(line.strip().endswith('SCAN %s' % TABLE) for line in plan.splitlines())
+    if vendor == 'postgresql':
+        return 'Seq Scan on %s' % TABLE in plan
+    return False
+
+
+class QueryPlansTests(TestCase):
+
+    ROWS = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        rand = random.Random(0)
+        now = timezone.now()
+        payments: list = []
+        for i in range(cls.ROWS):
+            status = rand.choice([None, 'accepted', 'accepted', 'rejected'])
+            payments.append(Transaction(
+                id=uuid.uuid4(),
+                key=uuid.uuid4().hex if status or i % 10 else None,
+                type=Transaction.Type.PAYMENT,
+                mobile='9%08d' % rand.randrange(cls.ROWS // 10),
+                amount='1500.00',
+                requested=bool(status) or i % 10 != 0,
+                requested_at=now,
+                status=status,
+                completed_at=now if status else None,
+                data={}))
+        Transaction.objects.bulk_create(payments, batch_size=500)
+        Transaction.objects.bulk_create((
+            Transaction(
+                id=uuid.uuid4(),
+                key=uuid.uuid4().hex,
+                type=Transaction.Type.REFUND,
+                mobile=parent.mobile,
+                amount=parent.amount,
+                parent=parent,
+                requested=True,
+                data={})
+            for parent in payments[:cls.ROWS // 20] if parent.status == 'accepted'),
+            batch_size=500)
+        # planners only prefer an index over a scan with table statistics
+        if connection.vendor in ('postgresql', 'sqlite'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        cls.payment = Transaction.objects.filter(
+            key__isnull=False, parent__isnull=True).first()
+
+    def get_patterns(self) -> dict:
+        objects = Transaction.objects
+        payment = self.payment
+        return {
+            'by key': objects.filter(key=payment.key),
+            'by id': objects.filter(id=payment.id),
+            'pending': objects.pending().filter(
+                key__isnull=False).values_list('id', 'key'),
+            'unrequested': objects.unrequested().order_by('created_at'),
+            'payments of a mobile': objects.payments().for_mobile(payment.mobile)[:20],
+            'pending refunds': objects.refunds().filter(status__isnull=True),
+            'refundable of a mobile': objects.for_mobile(payment.mobile).refundable()[:20],
+            'rejected since': objects.rejected().filter(
+                completed_at__gte=timezone.now() - datetime.timedelta(days=1))}
+
+    def test_patterns_make_one_query(self):
+        for name, queryset in self.get_patterns().items():
+            with self.subTest(name), self.assertNumQueries(1):
+                list(queryset)
+
+    def test_patterns_use_an_index(self):
+        if connection.vendor not in ('postgresql', 'sqlite'):
+            self.skipTest('no plan check on %s' % connection.vendor)
+        for name, queryset in self.get_patterns().items():
+            with self.subTest(name):
+                plan: str = queryset.explain()
+                self.assertFalse(is_full_scan(plan, connection.vendor),
+                    'full scan of %s:\n%s' % (TABLE, plan))
+
+    def test_status_entries_make_one_query(self):
+        pks: list = list(Transaction.objects.values_list('pk', flat=True)[:100])
+        with self.assertNumQueries(1):
+            entries: dict = cache.get_many(pks)
+        self.assertEqual(len(entries), len(pks))
+        with self.assertNumQueries(1):
+            self.assertEqual(cache.get(self.payment.pk)['id'], str(self.payment.pk))
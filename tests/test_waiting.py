@@ -0,0 +1,53 @@
+import threading
+
+from django.db import connection, transaction as db_transaction
+from django.test import TransactionTestCase
+
+from vpos.models import Transaction
+from vpos.waiting import TransactionWaiter
+
+from tests.utils import create_requested_payment, get_payment_data
+
+
+class NotifyTests(TransactionTestCase):
+
+    def wait_in_thread(self, pk) -> tuple:
+        waiter = TransactionWaiter(pk, poll_interval=60)
+        woken = threading.Event()
+
+        def wait():
+            if waiter.sleep(1):
+                woken.set()
+            connection.close()
+
+        thread = threading.Thread(target=wait)
+        thread.start()
+        return thread, woken
+
+    def test_waiters_woken_after_commit(self):
+        transaction = create_requested_payment()
+        thread, woken = self.wait_in_thread(transaction.pk)
+        with db_transaction.atomic():
+            self.assertTrue(transaction.confirm(get_payment_data(transaction)))
+            self.assertFalse(woken.wait(0.2))
+        thread.join()
+        self.assertTrue(woken.is_set())
+
+    def test_waiters_not_woken_on_rollback(self):
+        transaction = create_requested_payment()
+        thread, woken = self.wait_in_thread(transaction.pk)
+        with self.assertRaises(RuntimeError), db_transaction.atomic():
+            transaction.confirm(get_payment_data(transaction))
+            raise RuntimeError
+        thread.join()
+        self.assertFalse(woken.is_set())
+        self.assertIsNone(Transaction.objects.get(pk=transaction.pk).completed_at)
+
+    def test_confirm_many_wakes_waiters_after_commit(self):
+        transaction = create_requested_payment()
+        thread, woken = self.wait_in_thread(transaction.pk)
+        with db_transaction.atomic():
+            Transaction.objects.confirm_many([(transaction, get_payment_data(transaction))])
+            self.assertFalse(woken.wait(0.2))
+        thread.join()
+        self.assertTrue(woken.is_set())
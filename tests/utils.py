@@ -0,0 +1,81 @@
+import uuid
+import threading
+
+from django.conf import settings
+from django.db import connection
+from django.test import override_settings
+
+from vpos.models import Transaction
+from vpos.simulator import Simulator
+
+
+class CountingSimulator(Simulator):
+
+    """Simulator counting the POST /transactions calls, even with a known idempotency key"""
+
+    posts: int = 0
+
+    def create(self, body: dict, idempotency_key: str = None):
+        with self.lock:
+            self.posts += 1
+        return super().create(body, idempotency_key)
+
+
+class SimulatorMixin:
+
+    """Runs a simulator for each test, with the VPOS settings pointing to it"""
+
+    simulator_options: dict = {'eta': 60, 'latency': 0.2}
+    vpos_settings: dict = {}
+
+    def setUp(self):
+        super().setUp()
+        self.simulator = CountingSimulator(**self.simulator_options).start()
+        self.addCleanup(self.simulator.stop)
+        self.override_vpos(**self.vpos_settings)
+
+    def override_vpos(self, **values) -> None:
+        override = override_settings(VPOS={
+            **settings.VPOS, 'VPOS_BASE_URL': self.simulator.base_url, **values})
+        override.enable()
+        self.addCleanup(override.disable)
+
+
+def create_requested_payment(mobile: str = '923456789', amount: str = '1000.00', **kwargs) -> Transaction:
+    """A payment requested to vPOS, waiting for its confirmation"""
+    transaction = Transaction.objects.create_payment(mobile, amount, **kwargs)
+    transaction.save_location('/api/v1/requests/%s' % uuid.uuid4().hex)
+    return transaction
+
+
+def get_payment_data(transaction: Transaction, status: str = 'accepted') -> dict:
+    """vPOS transaction data of a confirmation (webhook or polling)"""
+    return {
+        'id': transaction.key,
+        'type': str(transaction.type),
+        'mobile': transaction.mobile,
+        'amount': str(transaction.amount),
+        'status': status,
+        'status_reason': None if status == 'accepted' else 3000}
+
+
+def run_threads(target, count: int) -> list:
+    """Runs target() in count threads started together, returns their results or errors"""
+    results: list = [None] * count
+    barrier = threading.Barrier(count)
+
+    def run(index: int):
+        barrier.wait()
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=run, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
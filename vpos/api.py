@@ -1,111 +1,182 @@
+import os
 import time
+import asyncio
+import threading
+import weakref
 import requests
 
-from typing import Union
+from typing import Dict, Union, Tuple
+from urllib.parse import urlsplit
 from requests import Response
-from vpos.configs import conf
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from vpos.configs import Snapshot, conf
+from vpos.exceptions import VposConfigurationError
+from vpos.instrumentation import get_endpoint, get_instrument
+from vpos import resilience
+from vpos.waiting import Waiter, WaitStrategy, get_strategy
 
 
-class VposAPI:
+IDEMPOTENT_METHODS: frozenset = frozenset(('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'))
+RETRY_STATUS_CODES: frozenset = frozenset((502, 503, 504))
 
+# tenant name (None for the default settings) -> session
+_sessions: Dict[Union[str, None], requests.Session] = {}
+_session_lock = threading.Lock()
+
+
+def get_session(tenant: str = None) -> requests.Session:
     """
-    Vpos API Interaction
-    Class for vpos.models.Transaction
+    Returns the process-wide keep-alive session used to talk with vPOS.
+    The underlying urllib3 pool is thread safe, so one session is shared by
+    all threads of the process. A forked child builds its own session,
+    never reusing the sockets of its parent.
+    Every tenant (see TENANTS) has its own session and HTTP_POOL_SIZE
+    connections, a slow tenant does not hold the connections of the others
     """
+    if (session := _sessions.get(tenant)) is None:
+        with _session_lock:
+            if (session := _sessions.get(tenant)) is None:
+                session = _sessions[tenant] = build_session(conf.get_tenant(tenant))
+    return session
 
-    __idempotency_key: str
 
-    def __init__(self, idempotency_key: str) -> None:
-        self.__idempotency_key = idempotency_key
-    
-    def create(self, **kwargs) -> Union[None, str]:
-        """
-        Create new Payment or Refund
-        Expect this named args
-            - type (str)
-            - mobile (str|None)
-            - amount (str|None)
-            - parent_id (str|None)
-            - polling: (bool)
-        Returns location string
-        """
-        r = self.post('/transactions',
-            data=self.__get_data_for_new_transaction(**kwargs))
-        if r.status_code == 202:
-            return r.headers.get('location')
-        return None
+class InstrumentedRetry(Retry):
 
-    def check(self, request_id: str, wait: bool = False) -> Union[dict, None]:
-        """
-        Check Transaction Queued/Running Status
-        Returns True if already completd else retuns False
-        f payment process is running (waiting user answer, in queue or else)
-        Will get the eta and wait (if True) some time to try the request again.
-        When finished, will return the transaction data (by following the location header)
-        """
-        
-        r = self.get(f'/requests/{request_id}')
+    """Retry reporting every retried call to the instrument"""
 
-        if r.status_code == 200:
-            data: dict = r.json()
-            if (eta := data.get('eta')) and wait:
-                try:
-                    seconds = int(float(eta)) + 1
-                    time.sleep(seconds if seconds <= 90 else 90)
-                except:
-                    return None
-                return self.check(request_id=request_id, wait=False)
-            elif eta is None:
-                return data # transaction data       
-        return None
+    def increment(self, method=None, url=None, *args, **kwargs):
+        # url is the request path, ex. /api/v1/requests/<id>
+        path: str = urlsplit(url or '').path
+        base: str = urlsplit(conf.VPOS_BASE_URL).path
+        get_instrument().http_retry(method,
+            get_endpoint(path[len(base):] if path.startswith(base) else path))
+        return super().increment(method, url, *args, **kwargs)
 
-    # ---------------------------------------------------------------------
-    # Base API Calls With Headers Configured
 
-    def get(self, path: str, **kwargs) -> Response:
-        url: str = f'{self.base_url}{path}'
-        with requests.get(url, headers=self.__headers, **kwargs) as r:
-            return r
-        
-    def post(self, path: str, data: dict = {}, **kwargs) -> Response:
-        url: str = f'{self.base_url}{path}'
-        with requests.post(url, json=data,
-                headers=self.__headers, **kwargs) as r:
-            return r
-    
-    def put(self, path: str, data: dict = {}, **kwargs) -> Response:
-        url: str = f'{self.base_url}{path}'
-        with requests.put(url, json=data,
-                headers=self.__headers, **kwargs) as r:
-            return r
-    
-    def delete(self, path: str, data: dict = {}, **kwargs) -> Response:
-        url: str = f'{self.base_url}{path}'
-        with requests.delete(url, json=data,
-                headers=self.__headers, **kwargs) as r:
-            return r
+def build_session(settings: Snapshot = None) -> requests.Session:
+    """Creates a new pooled session configured from VPOS settings (or a tenant settings)"""
+    settings = settings or conf.snapshot
+    retry = InstrumentedRetry(
+        total=conf.HTTP_MAX_RETRIES,
+        backoff_factor=conf.HTTP_RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=IDEMPOTENT_METHODS,
+        raise_on_status=False)
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=settings.values['HTTP_POOL_SIZE'],
+        max_retries=retry)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+def reset_session() -> None:
+    """
+    Drops the shared sessions, the next call will build new ones.
+    Useful after changing the VPOS settings at runtime.
+    """
+    global _sessions
+    with _session_lock:
+        sessions, _sessions = _sessions, {}
+    for session in sessions.values():
+        session.close()
+
+
+def _after_fork_in_child() -> None:
+    global _sessions, _session_lock
+    # sockets and lock state belong to the parent, do not touch them
+    _sessions = {}
+    _session_lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# async clients are bound to the event loop that created them,
+# event loop -> tenant name -> client
+_async_clients: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+
+def get_async_client(tenant: str = None):
+    """
+    Returns the keep-alive httpx.AsyncClient of the running event loop
+    and tenant (see get_session).
+    Requires the optional httpx dependency (pip install django-vpos[async])
+    """
+    clients: dict = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(tenant)
+    if client is None or client.is_closed:
+        client = clients[tenant] = build_async_client(conf.get_tenant(tenant))
+    return client
+
+
+def build_async_client(settings: Snapshot = None):
+    """Creates a new pooled httpx.AsyncClient configured from VPOS settings (or a tenant settings)"""
+    settings = settings or conf.snapshot
+    try:
+        import httpx
+    except ImportError:
+        raise VposConfigurationError(
+            'AsyncVposAPI requires httpx, install it with: '
+            'pip install django-vpos[async]')
+    transport = httpx.AsyncHTTPTransport(
+        retries=conf.HTTP_MAX_RETRIES,
+        limits=httpx.Limits(
+            max_connections=settings.values['HTTP_POOL_SIZE'],
+            max_keepalive_connections=settings.values['HTTP_POOL_SIZE']))
+    return httpx.AsyncClient(
+        transport=transport,
+        follow_redirects=True,
+        timeout=httpx.Timeout(
+            conf.HTTP_READ_TIMEOUT,
+            connect=conf.HTTP_CONNECT_TIMEOUT))
+
+
+class BaseVposAPI:
+
+    """
+    Request building shared by the sync and async vPOS clients
+    """
+
+    _idempotency_key: str
+    _tenant: Union[str, None]
+
+    def __init__(self, idempotency_key: str, tenant: str = None) -> None:
+        self._idempotency_key = idempotency_key
+        self._tenant = tenant
 
     @property
-    def __headers(self) -> dict:
-        headers = {
-            'Content-Type': 'application/json',
-            'Idempotency-Key': self.__idempotency_key,
-            'Authorization': f'Bearer {conf.TOKEN}'}
-        return headers
+    def settings(self) -> Snapshot:
+        """VPOS settings of the tenant (see TENANTS)"""
+        return conf.get_tenant(self._tenant)
+
+    @property
+    def _headers(self) -> dict:
+        return {
+            **self.settings.auth_headers,
+            'Idempotency-Key': self._idempotency_key}
     
+    @property
+    def timeout(self) -> tuple:
+        return (conf.HTTP_CONNECT_TIMEOUT, conf.HTTP_READ_TIMEOUT)
+
     @property
     def base_url(self) -> str:
         return conf.VPOS_BASE_URL
     
     @property
     def callback_url(self) -> str:
-        return f'{conf.URL}/{self.__idempotency_key}'
+        return self.settings.callback_url_prefix + self._idempotency_key
     
     @property
     def vpos_id(self) -> str:
         return conf.VPOS_ID
     
-    def __get_data_for_new_transaction(self, **kwargs) -> dict:
+    def _get_data_for_new_transaction(self, **kwargs) -> dict:
         """
         Expect this named args
             - type (str)
@@ -114,18 +185,222 @@ class VposAPI:
             - parent_id (str|None)
             - polling: (bool)
         """
+        snapshot = self.settings
         if kwargs['type'] == 'refund':
             data = {
                 'type': 'refund',
                 'parent_transaction_id': kwargs.get('parent_id'),
-                'supervisor_card': conf.get_supervisor_card()}
+                'supervisor_card': snapshot.supervisor_card}
         else:
             data = {
                 'type': 'payment',
-                'pos_id': conf.POS_ID,
+                'pos_id': snapshot.values['POS_ID'],
                 'mobile': kwargs.get('mobile'),
                 'amount': kwargs.get('amount')}
 
         if not kwargs.get('polling'):
             data['callback_url'] = self.callback_url
         return data
+
+    @staticmethod
+    def _get_location(r) -> Union[None, str]:
+        if r.status_code == 202:
+            return r.headers.get('location')
+        return None
+
+    @staticmethod
+    def _get_status(r) -> Tuple[Union[dict, None], Union[float, None]]:
+        if r.status_code == 200:
+            data: dict = r.json()
+            if (eta := data.get('eta')) is None:
+                return data, None
+            try:
+                return None, float(eta)
+            except (TypeError, ValueError):
+                return None, None
+        return None, None
+
+
+class VposAPI(BaseVposAPI):
+
+    """
+    Vpos API Interaction
+    Class for vpos.models.Transaction
+    """
+    
+    def create(self, **kwargs) -> Union[None, str]:
+        """
+        Create new Payment or Refund
+        Expect this named args
+            - type (str)
+            - mobile (str|None)
+            - amount (str|None)
+            - parent_id (str|None)
+            - polling: (bool)
+        Returns location string
+        """
+        with get_instrument().span('vpos.create', type=kwargs.get('type')):
+            r = self.post('/transactions',
+                data=self._get_data_for_new_transaction(**kwargs))
+        return self._get_location(r)
+
+    def check(self, request_id: str, wait: bool = False,
+            strategy: WaitStrategy = None,
+            waiter: Waiter = None) -> Union[dict, None]:
+        """
+        Check Transaction Queued/Running Status
+        Returns the transaction data (by following the location header) if
+        completed, else None.
+        With wait, while the payment process is running (waiting user answer,
+        in queue or else) looks again at the request when the wait strategy
+        says (see vpos.waiting), until completed, the deadline or the waiter
+        is woken up by a confirmation from another path
+        """
+        strategy = strategy or get_strategy()
+        waiter = waiter or Waiter()
+        start, first_eta, attempt = time.monotonic(), None, 0
+        with get_instrument().span('vpos.check', wait=wait):
+            while True:
+                data, eta = self._get_status(
+                    self.get(f'/requests/{request_id}'))
+                if data is not None:
+                    if first_eta is not None:
+                        get_instrument().eta(first_eta, time.monotonic() - start)
+                    return data # transaction data
+                if not wait or eta is None:
+                    return None
+                if first_eta is None:
+                    first_eta = eta
+                elif eta < strategy.min_delay:
+                    attempt += 1
+                delay = strategy.get_delay(attempt, eta, time.monotonic() - start)
+                if delay is None or waiter.sleep(delay):
+                    return None
+
+    def status(self, request_id: str) -> Tuple[Union[dict, None], Union[float, None]]:
+        """
+        Looks once at a request, never waits.
+        Returns (transaction data, None) if completed,
+        (None, eta) while running and (None, None) if unknown
+        """
+        return self._get_status(
+            self.get(f'/requests/{request_id}'))
+
+    # ---------------------------------------------------------------------
+    # Base API Calls With Headers Configured
+
+    def get(self, path: str, **kwargs) -> Response:
+        return self.request('GET', path, **kwargs)
+        
+    def post(self, path: str, data: dict = {}, **kwargs) -> Response:
+        return self.request('POST', path, json=data, **kwargs)
+    
+    def put(self, path: str, data: dict = {}, **kwargs) -> Response:
+        return self.request('PUT', path, json=data, **kwargs)
+    
+    def delete(self, path: str, data: dict = {}, **kwargs) -> Response:
+        return self.request('DELETE', path, json=data, **kwargs)
+
+    def request(self, method: str, path: str, **kwargs) -> Response:
+        """
+        Sends the request through the shared keep-alive session,
+        the circuit breaker and the concurrency limiter (see vpos.resilience).
+        Raises VposUnavailableError instead of calling an unhealthy gateway
+        """
+        url: str = f'{self.base_url}{path}'
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send() -> Response:
+            status, start = None, time.perf_counter()
+            try:
+                with get_session(self._tenant).request(method, url,
+                        headers=self._headers, **kwargs) as r:
+                    status = r.status_code
+                    return r
+            finally:
+                get_instrument().http_request(method, get_endpoint(path),
+                    status, time.perf_counter() - start)
+
+        return resilience.call(send, self._tenant)
+
+
+class AsyncVposAPI(BaseVposAPI):
+
+    """
+    Asyncio vPOS API Interaction
+    Same interface as VposAPI, but every call must be awaited
+    and waiting for eta never blocks the event loop
+    """
+
+    async def create(self, **kwargs) -> Union[None, str]:
+        """Create new Payment or Refund, see VposAPI.create"""
+        with get_instrument().span('vpos.create', type=kwargs.get('type')):
+            r = await self.post('/transactions',
+                data=self._get_data_for_new_transaction(**kwargs))
+        return self._get_location(r)
+
+    async def check(self, request_id: str, wait: bool = False,
+            strategy: WaitStrategy = None,
+            waiter: Waiter = None) -> Union[dict, None]:
+        """Check Transaction Queued/Running Status, see VposAPI.check"""
+        strategy = strategy or get_strategy()
+        waiter = waiter or Waiter()
+        start, first_eta, attempt = time.monotonic(), None, 0
+        with get_instrument().span('vpos.check', wait=wait):
+            while True:
+                data, eta = self._get_status(
+                    await self.get(f'/requests/{request_id}'))
+                if data is not None:
+                    if first_eta is not None:
+                        get_instrument().eta(first_eta, time.monotonic() - start)
+                    return data # transaction data
+                if not wait or eta is None:
+                    return None
+                if first_eta is None:
+                    first_eta = eta
+                elif eta < strategy.min_delay:
+                    attempt += 1
+                delay = strategy.get_delay(attempt, eta, time.monotonic() - start)
+                if delay is None or await waiter.asleep(delay):
+                    return None
+
+    async def status(self, request_id: str) -> Tuple[Union[dict, None], Union[float, None]]:
+        """Looks once at a request, see VposAPI.status"""
+        return self._get_status(
+            await self.get(f'/requests/{request_id}'))
+
+    # ---------------------------------------------------------------------
+    # Base API Calls With Headers Configured
+
+    async def get(self, path: str, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path: str, data: dict = {}, **kwargs):
+        return await self.request('POST', path, json=data, **kwargs)
+
+    async def put(self, path: str, data: dict = {}, **kwargs):
+        return await self.request('PUT', path, json=data, **kwargs)
+
+    async def delete(self, path: str, data: dict = {}, **kwargs):
+        # httpx.AsyncClient.delete does not accept a body
+        return await self.request('DELETE', path, json=data, **kwargs)
+
+    async def request(self, method: str, path: str, **kwargs):
+        """
+        Sends the request through the event loop keep-alive client,
+        see VposAPI.request
+        """
+        url: str = f'{self.base_url}{path}'
+
+        async def send():
+            status, start = None, time.perf_counter()
+            try:
+                r = await get_async_client(self._tenant).request(method, url,
+                    headers=self._headers, **kwargs)
+                status = r.status_code
+                return r
+            finally:
+                get_instrument().http_request(method, get_endpoint(path),
+                    status, time.perf_counter() - start)
+
+        return await resilience.acall(send, self._tenant)
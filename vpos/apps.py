@@ -8,5 +8,24 @@ class VposConfig(AppConfig):
     verbose_name = 'Django vPOS'
 
     def ready(self) -> None:
+        from django.core.signals import setting_changed
         from vpos.configs import conf
-        conf.validate()
+        from vpos.pubsub import publish_completed
+        from vpos.signals import transaction_completed
+        conf.load()
+        setting_changed.connect(reload_settings)
+        transaction_completed.connect(publish_completed, dispatch_uid='vpos.pubsub')
+
+
+def reload_settings(setting: str, **kwargs) -> None:
+    """Reloads VPOS when changed, ex. by override_settings in tests"""
+    if setting == 'VPOS':
+        from vpos import dispatch, pubsub, resilience, webhooks
+        from vpos.api import reset_session
+        from vpos.configs import conf
+        conf.reload()
+        reset_session()
+        resilience.reset()
+        pubsub.reset()
+        dispatch.reset()
+        webhooks.reset()
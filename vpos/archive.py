@@ -0,0 +1,208 @@
+"""
+Archival of completed transactions (see the vpos_archive command).
+
+Payments completed more than ARCHIVE_AFTER_DAYS days ago are moved, with
+their refund, out of the Transaction table, so it only holds open and
+recent transactions:
+    - to the ArchivedTransaction table (default). On PostgreSQL, the table
+      can be partitioned by month of created_at (opt-in, see partition_table),
+      missing partitions are then created as needed
+    - or to a JSONL store (gzip compressed if the path ends with .gz),
+      rows are appended, one line per transaction, and synced to disk before
+      the batch is deleted. A batch rolled back after its rows were written
+      (ex. a DB error on delete) is written again by the next run: the store
+      may hold duplicate lines, deduplicate by id when reading it
+Payments whose refund is open or recent are kept, so a refund and its
+parent are always in the same place. Each batch of ARCHIVE_BATCH_SIZE
+payments is read with values(), copied and deleted in a DB transaction:
+memory does not grow with the number of transactions.
+"""
+import io
+import os
+import gzip
+import datetime
+
+from typing import Iterable, List, Set, TextIO, Tuple, Union
+
+from django.db import connections, router, transaction as db_transaction
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+from vpos.configs import conf
+from vpos.export import write_jsonl
+from vpos.models import ArchivedTransaction, Transaction
+
+
+class ArchiveResult:
+
+    """Counters of an archiver run"""
+
+    batches: int
+    payments: int
+    refunds: int
+
+    def __init__(self) -> None:
+        self.batches = 0
+        self.payments = 0
+        self.refunds = 0
+
+    def __repr__(self) -> str:
+        return '<ArchiveResult batches=%d payments=%d refunds=%d>' % (
+            self.batches, self.payments, self.refunds)
+
+
+class Archiver:
+
+    """Moves completed transactions out of the Transaction table, see the module docstring"""
+
+    cutoff: datetime.datetime
+    batch_size: int
+    stream: Union[TextIO, None]
+
+    def __init__(self,
+            days: int = None,
+            batch_size: int = None,
+            stream: TextIO = None) -> None:
+        self.cutoff = timezone.now() - datetime.timedelta(
+            days=days or conf.ARCHIVE_AFTER_DAYS)
+        self.batch_size = batch_size or conf.ARCHIVE_BATCH_SIZE
+        self.stream = stream
+        self.__partitions: Set[Tuple[int, int]] = set()
+        self.__partitioned: Union[bool, None] = None
+
+    def get_queryset(self) -> QuerySet:
+        """Payments to archive, with no refund or an archivable one"""
+        return Transaction.objects.filter(
+            parent__isnull=True,
+            completed_at__lt=self.cutoff
+        ).filter(
+            Q(refund__isnull=True) | Q(refund__completed_at__lt=self.cutoff))
+
+    def run(self, max_batches: int = None) -> ArchiveResult:
+        """Archives batch after batch, until no transaction is left"""
+        result = ArchiveResult()
+        while max_batches is None or max_batches > 0:
+            if not self.archive_batch(result):
+                break
+            if max_batches is not None:
+                max_batches -= 1
+        return result
+
+    def archive_batch(self, result: ArchiveResult) -> bool:
+        """Archives a batch of payments and their refunds, False if none was left"""
+        with db_transaction.atomic():
+            pks: list = list(self.get_queryset().order_by(
+                'completed_at').values_list('pk', flat=True)[:self.batch_size])
+            if not pks:
+                return False
+            rows: list = list(Transaction.objects.filter(
+                Q(pk__in=pks) | Q(parent_id__in=pks)
+            ).order_by('created_at').values(*ArchivedTransaction.FIELDS))
+            if self.stream is not None:
+                write_jsonl(rows, self.stream)
+                self.sync()
+            else:
+                self.insert(rows)
+            Transaction.objects.filter(Q(pk__in=pks) | Q(parent_id__in=pks)).delete()
+        result.batches += 1
+        result.payments += len(pks)
+        result.refunds += len(rows) - len(pks)
+        return True
+
+    def sync(self) -> None:
+        """
+        Writes the stream to disk before the rows are deleted,
+        GzipFile.flush also flushes the compressor and the underlying file
+        """
+        self.stream.flush()
+        try:
+            fileno: int = self.stream.fileno()
+        except (AttributeError, io.UnsupportedOperation):
+            return  # not a file, ex. StringIO
+        os.fsync(fileno)
+
+    def insert(self, rows: List[dict]) -> None:
+        self.create_partitions(row['created_at'] for row in rows)
+        ArchivedTransaction.objects.bulk_create(
+            [ArchivedTransaction(**row) for row in rows],
+            batch_size=self.batch_size)
+
+    def create_partitions(self, dates: Iterable[datetime.datetime]) -> None:
+        """Creates the missing month partitions of dates, in UTC, if the table is partitioned"""
+        connection = connections[router.db_for_write(ArchivedTransaction)]
+        if self.__partitioned is None:
+            self.__partitioned = is_partitioned(connection)
+        if not self.__partitioned:
+            return
+        months: set = {(date.year, date.month) for date in dates} - self.__partitions
+        table: str = ArchivedTransaction._meta.db_table
+        with connection.cursor() as cursor:
+            for year, month in sorted(months):
+                start = datetime.date(year, month, 1)
+                end = datetime.date(year + month // 12, month % 12 + 1, 1)
+                cursor.execute(
+                    'CREATE TABLE IF NOT EXISTS %s PARTITION OF %s FOR VALUES FROM (%%s) TO (%%s)' % (
+                        connection.ops.quote_name('%s_y%dm%02d' % (table, year, month)),
+                        connection.ops.quote_name(table)),
+                    [start.isoformat(), end.isoformat()])
+                self.__partitions.add((year, month))
+
+
+# indexes of the partitioned table, the primary key is (id, created_at)
+PARTITION_INDEXES: Tuple[Tuple[str, str], ...] = (
+    ('vpos_archived_mobile_idx', '"mobile", "created_at" DESC'),
+    ('vpos_archived_key_idx', '"key"'),
+    ('vpos_archived_created_idx', '"created_at"'),
+    ('vpos_archived_parent_idx', '"parent_id"'),
+    ('vpos_archived_fee_version_idx', '"fee_version_id"'))
+
+
+def is_partitioned(connection) -> bool:
+    """Whether the ArchivedTransaction table is partitioned (PostgreSQL only)"""
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))',
+            [connection.ops.quote_name(ArchivedTransaction._meta.db_table)])
+        return cursor.fetchone()[0]
+
+
+def partition_table(using: str = None) -> None:
+    """
+    Recreates the empty ArchivedTransaction table partitioned by range of
+    created_at (see the vpos_archive_partition command), PostgreSQL only.
+    Raises ValueError if the table is not empty or already partitioned
+    """
+    using = using or router.db_for_write(ArchivedTransaction)
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        raise ValueError('Only PostgreSQL tables can be partitioned')
+    if is_partitioned(connection):
+        raise ValueError('The archive table is already partitioned')
+    quote = connection.ops.quote_name
+    table: str = ArchivedTransaction._meta.db_table
+    with db_transaction.atomic(using=using), connection.cursor() as cursor:
+        if ArchivedTransaction.objects.using(using).exists():
+            raise ValueError('The archive table must be empty to be partitioned')
+        cursor.execute('CREATE TABLE %s (LIKE %s INCLUDING DEFAULTS) PARTITION BY RANGE (%s)' % (
+            quote(table + '_partitioned'), quote(table), quote('created_at')))
+        cursor.execute('DROP TABLE %s' % quote(table))
+        cursor.execute('ALTER TABLE %s RENAME TO %s' % (
+            quote(table + '_partitioned'), quote(table)))
+        cursor.execute('ALTER TABLE %s ADD PRIMARY KEY (%s, %s)' % (
+            quote(table), quote('id'), quote('created_at')))
+        for name, columns in PARTITION_INDEXES:
+            cursor.execute('CREATE INDEX %s ON %s (%s)' % (quote(name), quote(table), columns))
+
+
+def open_store(path: str) -> TextIO:
+    """JSONL store to append archived transactions to, gzip compressed if path ends with .gz"""
+    if path.endswith('.gz'):
+        return gzip.open(path, 'at', encoding='utf-8')
+    return open(path, 'a', encoding='utf-8')
+
+
+def archive(**kwargs) -> ArchiveResult:
+    """Shortcut to Archiver(**kwargs).run()"""
+    return Archiver(**kwargs).run()
@@ -0,0 +1,107 @@
+"""
+Helpers for the bulk creation of transactions (see Manager.bulk_create_payments)
+"""
+import logging
+
+from typing import List, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from vpos.configs import conf
+from vpos.leases import get_request_lease
+
+
+logger = logging.getLogger('vpos.bulk')
+
+
+class BulkResult:
+
+    """
+    Result of one item of a bulk creation.
+    transaction is None if it could not be created, error is set if it could not
+    be created or, when requested, if the request to vPOS failed
+    """
+
+    index: int
+    transaction: 'Transaction'
+    error: Union[Exception, None]
+
+    def __init__(self, index: int, transaction=None, error: Exception = None) -> None:
+        self.index = index
+        self.transaction = transaction
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    def __repr__(self) -> str:
+        return '<BulkResult %d %s>' % (
+            self.index, 'ok' if self.ok else repr(self.error))
+
+
+def submit_requests(results: List[BulkResult],
+        polling: bool = False,
+        max_workers: int = None) -> None:
+    """
+    Requests the created transactions to vPOS concurrently, each under its
+    request lease (see Transaction.request): a transaction requested meanwhile
+    by another caller is not requested again, its call is waited for.
+    Each location is saved as soon as its call returns (see Transaction.save_location)
+    """
+    if not results:
+        return
+    model = type(results[0].transaction)
+    leases: dict = {}
+    busy: list = []
+    for result in results:
+        lease = get_request_lease(result.transaction)
+        if lease.acquire():
+            leases[result.transaction.pk] = lease
+        else:
+            busy.append((result, lease))
+    try:
+        # requested before the lease was taken
+        requested: set = set(model.objects.filter(
+            pk__in=list(leases), requested=True).values_list('pk', flat=True))
+        _create([
+            r for r in results
+            if r.transaction.pk in leases and r.transaction.pk not in requested
+        ], leases, polling, max_workers)
+    finally:
+        for lease in leases.values():
+            lease.release()
+    for result in results:
+        if result.transaction.pk in requested:
+            result.transaction.refresh_from_db(fields=model.REQUEST_FIELDS)
+    for result, lease in busy:
+        transaction = result.transaction
+        lease.wait(model.objects.filter(pk=transaction.pk, requested=True).exists)
+        transaction.refresh_from_db(fields=model.REQUEST_FIELDS)
+        if not transaction.requested:
+            result.error = RuntimeError('The concurrent request of the transaction failed')
+
+
+def _create(results: List[BulkResult], leases: dict, polling: bool, max_workers: int) -> None:
+    """Calls vPOS for each result, releases each lease once its location is saved"""
+    data: list = [r.transaction.get_request_data(polling=polling) for r in results]
+
+    def create(index: int):
+        transaction = results[index].transaction
+        try:
+            return transaction.api.create(**data[index]), None
+        except Exception as e:
+            logger.warning('Failed to request transaction %s',
+                transaction.pk, exc_info=True)
+            return None, e
+
+    with ThreadPoolExecutor(max_workers or conf.HTTP_POOL_SIZE) as executor:
+        futures: dict = {
+            executor.submit(create, index): results[index] for index in range(len(results))}
+        for future in as_completed(futures):
+            result: BulkResult = futures[future]
+            location, error = future.result()
+            if location is None:
+                result.error = error or ValueError('vPOS returned no location')
+            else:
+                result.transaction.save_location(location)
+            leases.pop(result.transaction.pk).release()
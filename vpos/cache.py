@@ -0,0 +1,117 @@
+"""
+Read-through cache of the transaction status (STATUS_CACHE setting).
+
+get and get_many return status entries (see get_entry) from the cache,
+the missing ones are read from the database with a single query and cached:
+    - completed transactions for STATUS_CACHE_TIMEOUT seconds, they never change
+    - pending ones for STATUS_CACHE_PENDING_TIMEOUT seconds only
+Reads only add entries, they never overwrite the ones written on confirmation
+(Transaction.confirm, polling) or on refund creation, once the DB transaction
+is committed. Without STATUS_CACHE, entries are always read from the database.
+"""
+from typing import Dict, Iterable, Union
+
+from django.core.cache import caches
+from django.db import transaction as db_transaction
+from django.db.models import F
+
+from vpos.configs import conf
+
+
+def get_cache_key(pk) -> str:
+    return 'vpos:transaction:%s' % pk
+
+
+def get_entry(transaction, refund=None) -> dict:
+    """Status entry of a transaction, refund is the pk of its refund if any"""
+    return {
+        'id': str(transaction.pk),
+        'type': str(transaction.type),
+        'status': transaction.status,
+        'status_code': transaction.status_code,
+        'status_reason': transaction.status_reason,
+        'completed_at': transaction.completed_at,
+        'payment': transaction.payment,
+        'parent': str(transaction.parent_id) if transaction.parent_id else None,
+        'refund': str(refund) if refund else None}
+
+
+def get(pk) -> Union[dict, None]:
+    """Status entry of the transaction pk, None if not found"""
+    return get_many([pk]).get(str(pk))
+
+
+def get_many(pks: Iterable) -> Dict[str, dict]:
+    """Status entries by id of the transactions pks, the ones not found are left out"""
+    pks = [str(pk) for pk in pks]
+    entries: Dict[str, dict] = {}
+    if conf.STATUS_CACHE:
+        cached: dict = caches[conf.STATUS_CACHE].get_many(
+            [get_cache_key(pk) for pk in pks])
+        for pk in pks:
+            if (entry := cached.get(get_cache_key(pk))) is not None:
+                entries[pk] = entry
+    if (missing := [pk for pk in pks if pk not in entries]):
+        entries.update(fetch(missing))
+    return entries
+
+
+def fetch(pks: list) -> Dict[str, dict]:
+    """Reads the status entries of pks from the database, and caches them"""
+    from vpos.models import Transaction
+    entries: Dict[str, dict] = {
+        str(transaction.pk): get_entry(transaction, transaction.refund_id)
+        for transaction in Transaction.objects.filter(pk__in=pks).only(
+            'id', 'type', 'status', 'status_code', 'completed_at',
+            'data', 'mobile', 'amount', 'parent_id'
+        ).annotate(refund_id=F('refund__id'))}
+    if conf.STATUS_CACHE and entries:
+        cache = caches[conf.STATUS_CACHE]
+        for pk, entry in entries.items():
+            cache.add(get_cache_key(pk), entry, get_timeout(entry))
+    return entries
+
+
+def get_timeout(entry: dict) -> float:
+    if entry['completed_at'] is None:
+        return conf.STATUS_CACHE_PENDING_TIMEOUT
+    return conf.STATUS_CACHE_TIMEOUT
+
+
+def set_completed(*transactions) -> None:
+    """Caches the entries of confirmed transactions, once committed"""
+    if not conf.STATUS_CACHE or not transactions:
+        return
+    from vpos.models import Transaction
+    # only payments completed in sandbox mode could already be refunded
+    refunds: dict = dict(Transaction.objects.filter(
+        parent_id__in=[t.pk for t in transactions if t.is_payment]
+    ).values_list('parent_id', 'pk'))
+    entries: dict = {
+        get_cache_key(t.pk): get_entry(t, refunds.get(t.pk)) for t in transactions}
+    db_transaction.on_commit(lambda: caches[conf.STATUS_CACHE].set_many(
+        entries, conf.STATUS_CACHE_TIMEOUT))
+
+
+def set_refunded(*refunds) -> None:
+    """
+    Updates the entries of the parents of new refunds, once committed.
+    Entries of parents not loaded as completed are deleted instead
+    """
+    if not conf.STATUS_CACHE or not refunds:
+        return
+    entries: dict = {
+        get_cache_key(r.parent_id): get_entry(r.parent, r.pk)
+        for r in refunds if r.parent.completed_at is not None}
+    stale: list = [
+        get_cache_key(r.parent_id)
+        for r in refunds if r.parent.completed_at is None]
+
+    def update() -> None:
+        cache = caches[conf.STATUS_CACHE]
+        if entries:
+            cache.set_many(entries, conf.STATUS_CACHE_TIMEOUT)
+        if stale:
+            cache.delete_many(stale)
+
+    db_transaction.on_commit(update)
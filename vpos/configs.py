@@ -1,3 +1,5 @@
+from types import MappingProxyType
+
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 
@@ -18,7 +20,86 @@ DEFAULTS: dict = {
     'VPOS_FEE': None,
     'VPOS_SUPERVISOR_CARD': None,
     'VPOS_BASE_URL': 'https://vpos.ao/api/v1',
-    'VPOS_TEST_SUPERVISOR_CARD': '9610123456123412341234123456789012345'}
+    'VPOS_TEST_SUPERVISOR_CARD': '9610123456123412341234123456789012345',
+    # http client (shared keep-alive session)
+    'HTTP_POOL_SIZE': 10,
+    'HTTP_CONNECT_TIMEOUT': 5,
+    'HTTP_READ_TIMEOUT': 30,
+    # retries only apply to idempotent methods (GET, PUT, DELETE)
+    'HTTP_MAX_RETRIES': 3,
+    'HTTP_RETRY_BACKOFF': 0.5,
+    # gateway protection (see vpos.resilience)
+    # consecutive failures opening the circuit, 0 (default) disables the circuit breaker
+    'CIRCUIT_FAILURE_THRESHOLD': 0,
+    'CIRCUIT_RECOVERY_TIMEOUT': 30,
+    # cache alias sharing the circuit state between processes
+    'CIRCUIT_CACHE': None,
+    # adaptive limit of calls in flight, CONCURRENCY_MAX = 0 (default) disables it
+    'CONCURRENCY_MIN': 1,
+    'CONCURRENCY_MAX': 0,
+    'CONCURRENCY_TIMEOUT': 1,
+    # other POS / merchants served by the same process (see TENANT_SETTINGS)
+    # ex: {'shop': {'POS_ID': 2, 'TOKEN': '...', 'URL': '...'}}
+    'TENANTS': {},
+    # deduplication of request/check_payment between processes (see vpos.leases)
+    # cache alias of the leases, None uses a row lock for requests
+    'LEASE_CACHE': None,
+    'LEASE_TIMEOUT': 60,
+    # check_payment(wait=True) (see vpos.waiting)
+    'WAIT_STRATEGY': 'vpos.waiting.WaitStrategy',
+    'WAIT_DEADLINE': 90,
+    'WAIT_MIN_DELAY': 0.5,
+    'WAIT_MAX_DELAY': 10,
+    'WAIT_BACKOFF': 2,
+    'WAIT_JITTER': 0.1,
+    # seconds between looks for a confirmation by the webhook, in WAIT_CACHE or the DB
+    'WAIT_POLL_INTERVAL': 2,
+    'WAIT_CACHE': None,
+    # webhook calls (see vpos.webhooks)
+    'WEBHOOK_MAX_BODY_SIZE': 16384,
+    # dotted path of a vpos.webhooks.SignatureVerifier, ex. vpos.webhooks.HmacVerifier
+    'WEBHOOK_VERIFIER': None,
+    'WEBHOOK_SECRET': None,
+    # watch_transaction_status long-poll/SSE (see vpos.pubsub)
+    # cache alias shared by the processes, None looks at the DB every PUBSUB_POLL_INTERVAL
+    'PUBSUB_CACHE': None,
+    'PUBSUB_TIMEOUT': 30,
+    'PUBSUB_POLL_INTERVAL': 2,
+    # requests sent by the outbox dispatcher instead of the caller (see vpos.outbox)
+    'OUTBOX': False,
+    'OUTBOX_BATCH_SIZE': 100,
+    'OUTBOX_MAX_ATTEMPTS': 5,
+    'OUTBOX_RETRY_BACKOFF': 2,
+    # seconds a claimed entry is hidden from other dispatchers
+    'OUTBOX_CLAIM_TIMEOUT': 60,
+    # read-through cache of the transaction status (see vpos.cache), None disables it
+    'STATUS_CACHE': None,
+    'STATUS_CACHE_TIMEOUT': 86400,
+    # seconds pending transactions are cached
+    'STATUS_CACHE_PENDING_TIMEOUT': 2,
+    # completed transactions moved out of the hot table (see vpos.archive)
+    'ARCHIVE_AFTER_DAYS': 365,
+    'ARCHIVE_BATCH_SIZE': 1000,
+    # transaction_completed dispatch (see vpos.dispatch)
+    'DISPATCHER': 'vpos.dispatch.SyncDispatcher',
+    'DISPATCHER_WORKERS': 4,
+    'DISPATCHER_QUEUE_SIZE': 1000,
+    # metrics and tracing (see vpos.instrumentation)
+    'INSTRUMENT': 'vpos.instrumentation.Instrument'}
+
+
+# settings a tenant may override, the others are shared
+TENANT_SETTINGS: tuple = (
+    'POS_ID',
+    'TOKEN',
+    'URL',
+    'MODE',
+    'BANK_FEE',
+    'VPOS_FEE',
+    'VPOS_SUPERVISOR_CARD',
+    'HTTP_POOL_SIZE',
+    'CONCURRENCY_MIN',
+    'CONCURRENCY_MAX')
 
 
 VPOS_STATUS_REASON: dict = {
@@ -43,26 +124,149 @@ VPOS_STATUS_REASON: dict = {
     '1000': _('Generic gateway error')}
 
 
+class Snapshot:
+
+    """
+    Immutable VPOS settings, resolved once (see VposSettings.load)
+    with the values derived from them precomputed for the request paths
+    """
+
+    __slots__ = (
+        'values',
+        # {'Content-Type', 'Authorization'} headers
+        'auth_headers',
+        # '<URL>/', the transaction id is appended
+        'callback_url_prefix',
+        # supervisor card of the current MODE
+        'supervisor_card',
+        # vpos.fees.FeeSchedule of VPOS_FEE and BANK_FEE
+        'vpos_fee_schedule',
+        'bank_fee_schedule',
+        # vpos.fees.get_version of VPOS_FEE and BANK_FEE
+        'fee_version',
+        # name of the tenant, None for the default settings
+        'tenant',
+        # tenant name -> Snapshot, of the default settings only
+        'tenants')
+
+    def __init__(self, values: dict, **derived) -> None:
+        object.__setattr__(self, 'values', MappingProxyType(dict(values)))
+        for attr in self.__slots__[1:]:
+            object.__setattr__(self, attr, derived.get(attr))
+
+    def __setattr__(self, attr: str, value) -> None:
+        raise AttributeError('VPOS settings are read only, use conf.reload()')
+
+
 class VposSettings:
 
     __defaults: dict
+    __user_settings: dict
+    __snapshot: Snapshot
+
+    validators: tuple = (
+        'validate_mode',
+        'validate_token',
+        'validate_url',
+        'validate_vpos_base_url',
+        'validate_vpos_supervisor_card',
+        'validate_vpos_fee',
+        'validate_bank_fee',
+        'validate_http_pool_size',
+        'validate_http_timeouts',
+        'validate_http_retries',
+        'validate_circuit_breaker',
+        'validate_concurrency',
+        'validate_tenants',
+        'validate_lease',
+        'validate_wait',
+        'validate_webhook',
+        'validate_pubsub',
+        'validate_outbox',
+        'validate_archive',
+        'validate_status_cache',
+        'validate_dispatcher',
+        'validate_instrument',
+        'validate_pos_id')
 
     def __init__(self, defaults: dict = None, user_settings: dict = None) -> None:
-        if user_settings:
-            self.__settings = user_settings
+        self.__user_settings = user_settings
         self.__defaults = defaults or DEFAULTS
+        self.__snapshot = None
 
     @property
-    def settigs(self) -> dict:
-        if not hasattr(self, '__settings'):
+    def settings(self) -> dict:
+        if self.__user_settings is None:
             return getattr(settings, 'VPOS', {})
-        return self.__settings
+        return self.__user_settings
+
+    @property
+    def snapshot(self) -> Snapshot:
+        if self.__snapshot is None:
+            return self.load()
+        return self.__snapshot
+
+    def load(self) -> Snapshot:
+        """Resolves, validates and freezes the settings"""
+        user_settings: dict = self.settings
+        values: dict = {
+            attr: user_settings.get(attr, default)
+            for attr, default in self.__defaults.items()}
+        # validated by another instance, the current snapshot is only
+        # replaced once the new settings are valid
+        checker = VposSettings(self.__defaults, values)
+        checker.__snapshot = Snapshot(values)
+        checker.validate()
+        snapshot = Snapshot(values, **self.__get_derived(values),
+            tenants=MappingProxyType({
+                name: self.__get_tenant(name, values, overrides)
+                for name, overrides in values['TENANTS'].items()}))
+        self.__snapshot = snapshot
+        return snapshot
+
+    def __get_tenant(self, name: str, values: dict, overrides: dict) -> Snapshot:
+        tenant = VposSettings(self.__defaults, {**values, **overrides, 'TENANTS': {}})
+        try:
+            values = tenant.load().values
+        except Err as e:
+            raise Err("TENANTS['%s']: %s" % (name, e))
+        return Snapshot(values, **self.__get_derived(values), tenant=name)
+
+    def get_tenant(self, tenant: str = None) -> Snapshot:
+        """Settings of a tenant (see TENANTS), the default settings if None"""
+        snapshot = self.snapshot
+        if not tenant:
+            return snapshot
+        try:
+            return snapshot.tenants[tenant]
+        except KeyError:
+            raise Err("Unknown VPOS tenant: '%s'" % tenant)
+
+    def reload(self) -> Snapshot:
+        """
+        Loads the settings again, for tests or after VPOS changes.
+        If they are invalid, the error is raised and the current snapshot is kept
+        """
+        return self.load()
+
+    @staticmethod
+    def __get_derived(values: dict) -> dict:
+        from vpos.fees import compile_schedule, get_version
+        return {
+            'auth_headers': MappingProxyType({
+                'Content-Type': 'application/json',
+                'Authorization': f'Bearer {values.get("TOKEN")}'}),
+            'callback_url_prefix': f'{values.get("URL")}/',
+            'supervisor_card': values.get('VPOS_TEST_SUPERVISOR_CARD')
+                if values.get('MODE') == 'sandbox' else values.get('VPOS_SUPERVISOR_CARD'),
+            'vpos_fee_schedule': compile_schedule(values.get('VPOS_FEE'), name='vpos fee'),
+            'bank_fee_schedule': compile_schedule(values.get('BANK_FEE'), name='bank fee'),
+            'fee_version': get_version(values.get('VPOS_FEE'), values.get('BANK_FEE'))}
     
     def validate(self):
         """configurations validation"""
-        for attr in dir(self):
-            if 'validate_' in attr:
-                getattr(self, attr)()
+        for validator in self.validators:
+            getattr(self, validator)()
     
     def validate_mode(self):
         modes = ('production', 'sandbox')
@@ -95,24 +299,132 @@ class VposSettings:
         if self.BANK_FEE != None and not isinstance(self.BANK_FEE, tuple):
             raise Err('BANK_FEE if set, must be a tuple in this order: (percent, min amount, max amount, puls amount)')
     
+    def validate_http_pool_size(self):
+        if not isinstance(self.HTTP_POOL_SIZE, int) or self.HTTP_POOL_SIZE < 1:
+            raise Err('HTTP_POOL_SIZE must be a positive integer')
+
+    def validate_http_timeouts(self):
+        for attr in ('HTTP_CONNECT_TIMEOUT', 'HTTP_READ_TIMEOUT'):
+            value = getattr(self, attr)
+            if value is not None and (not isinstance(value, (int, float)) or value <= 0):
+                raise Err('%s if set, must be a positive number of seconds' % attr)
+
+    def validate_http_retries(self):
+        if not isinstance(self.HTTP_MAX_RETRIES, int) or self.HTTP_MAX_RETRIES < 0:
+            raise Err('HTTP_MAX_RETRIES must be a non negative integer')
+        if not isinstance(self.HTTP_RETRY_BACKOFF, (int, float)) or self.HTTP_RETRY_BACKOFF < 0:
+            raise Err('HTTP_RETRY_BACKOFF must be a non negative number')
+
+    def validate_circuit_breaker(self):
+        if not isinstance(self.CIRCUIT_FAILURE_THRESHOLD, int) or self.CIRCUIT_FAILURE_THRESHOLD < 0:
+            raise Err('CIRCUIT_FAILURE_THRESHOLD must be a non negative integer')
+        if not isinstance(self.CIRCUIT_RECOVERY_TIMEOUT, (int, float)) or self.CIRCUIT_RECOVERY_TIMEOUT <= 0:
+            raise Err('CIRCUIT_RECOVERY_TIMEOUT must be a positive number of seconds')
+        if self.CIRCUIT_CACHE is not None and self.CIRCUIT_CACHE not in settings.CACHES:
+            raise Err("CIRCUIT_CACHE if set, must be an alias of CACHES: '%s'" % self.CIRCUIT_CACHE)
+
+    def validate_concurrency(self):
+        if not isinstance(self.CONCURRENCY_MAX, int) or self.CONCURRENCY_MAX < 0:
+            raise Err('CONCURRENCY_MAX must be a non negative integer')
+        if self.CONCURRENCY_MAX and (not isinstance(self.CONCURRENCY_MIN, int)
+                or not 1 <= self.CONCURRENCY_MIN <= self.CONCURRENCY_MAX):
+            raise Err('CONCURRENCY_MIN must be an integer between 1 and CONCURRENCY_MAX')
+        if not isinstance(self.CONCURRENCY_TIMEOUT, (int, float)) or self.CONCURRENCY_TIMEOUT < 0:
+            raise Err('CONCURRENCY_TIMEOUT must be a non negative number of seconds')
+
+    def validate_tenants(self):
+        if not isinstance(self.TENANTS, dict):
+            raise Err('TENANTS must be a dict of tenant name -> settings')
+        for name, overrides in self.TENANTS.items():
+            if not isinstance(name, str) or not 0 < len(name) <= 50:
+                raise Err('TENANTS names must be strings of 1 to 50 characters')
+            if not isinstance(overrides, dict):
+                raise Err("TENANTS['%s'] must be a dict of settings" % name)
+            if (invalid := set(overrides) - set(TENANT_SETTINGS)):
+                raise Err("TENANTS['%s'] can not set: %s" % (
+                    name, ', '.join(sorted(invalid))))
+            if not overrides.get('POS_ID') or not overrides.get('TOKEN'):
+                raise Err("TENANTS['%s'] requires its own POS_ID and TOKEN" % name)
+
+    def validate_lease(self):
+        if self.LEASE_CACHE is not None and self.LEASE_CACHE not in settings.CACHES:
+            raise Err("LEASE_CACHE if set, must be an alias of CACHES: '%s'" % self.LEASE_CACHE)
+        if not isinstance(self.LEASE_TIMEOUT, (int, float)) or self.LEASE_TIMEOUT <= 0:
+            raise Err('LEASE_TIMEOUT must be a positive number of seconds')
+
+    def validate_wait(self):
+        if not isinstance(self.WAIT_STRATEGY, str):
+            raise Err('WAIT_STRATEGY must be the dotted path of a vpos.waiting.WaitStrategy')
+        for attr in ('WAIT_DEADLINE', 'WAIT_MIN_DELAY', 'WAIT_MAX_DELAY', 'WAIT_POLL_INTERVAL'):
+            if not isinstance(getattr(self, attr), (int, float)) or getattr(self, attr) <= 0:
+                raise Err('%s must be a positive number of seconds' % attr)
+        if not isinstance(self.WAIT_BACKOFF, (int, float)) or self.WAIT_BACKOFF < 1:
+            raise Err('WAIT_BACKOFF must be a number greater or equal to 1')
+        if not isinstance(self.WAIT_JITTER, (int, float)) or not 0 <= self.WAIT_JITTER <= 1:
+            raise Err('WAIT_JITTER must be a number between 0 and 1')
+        if self.WAIT_CACHE is not None and self.WAIT_CACHE not in settings.CACHES:
+            raise Err("WAIT_CACHE if set, must be an alias of CACHES: '%s'" % self.WAIT_CACHE)
+
+    def validate_webhook(self):
+        if not isinstance(self.WEBHOOK_MAX_BODY_SIZE, int) or self.WEBHOOK_MAX_BODY_SIZE < 1:
+            raise Err('WEBHOOK_MAX_BODY_SIZE must be a positive number of bytes')
+        if self.WEBHOOK_VERIFIER is not None and not isinstance(self.WEBHOOK_VERIFIER, str):
+            raise Err('WEBHOOK_VERIFIER if set, must be the dotted path of a vpos.webhooks.SignatureVerifier')
+
+    def validate_pubsub(self):
+        for attr in ('PUBSUB_TIMEOUT', 'PUBSUB_POLL_INTERVAL'):
+            if not isinstance(getattr(self, attr), (int, float)) or getattr(self, attr) <= 0:
+                raise Err('%s must be a positive number of seconds' % attr)
+        if self.PUBSUB_CACHE is not None and self.PUBSUB_CACHE not in settings.CACHES:
+            raise Err("PUBSUB_CACHE if set, must be an alias of CACHES: '%s'" % self.PUBSUB_CACHE)
+
+    def validate_outbox(self):
+        if not isinstance(self.OUTBOX, bool):
+            raise Err('OUTBOX must be True or False')
+        for attr in ('OUTBOX_BATCH_SIZE', 'OUTBOX_MAX_ATTEMPTS'):
+            if not isinstance(getattr(self, attr), int) or getattr(self, attr) < 1:
+                raise Err('%s must be a positive integer' % attr)
+        for attr in ('OUTBOX_RETRY_BACKOFF', 'OUTBOX_CLAIM_TIMEOUT'):
+            if not isinstance(getattr(self, attr), (int, float)) or getattr(self, attr) <= 0:
+                raise Err('%s must be a positive number of seconds' % attr)
+
+    def validate_archive(self):
+        for attr in ('ARCHIVE_AFTER_DAYS', 'ARCHIVE_BATCH_SIZE'):
+            if not isinstance(getattr(self, attr), int) or getattr(self, attr) < 1:
+                raise Err('%s must be a positive integer' % attr)
+
+    def validate_status_cache(self):
+        for attr in ('STATUS_CACHE_TIMEOUT', 'STATUS_CACHE_PENDING_TIMEOUT'):
+            if not isinstance(getattr(self, attr), (int, float)) or getattr(self, attr) <= 0:
+                raise Err('%s must be a positive number of seconds' % attr)
+        if self.STATUS_CACHE is not None and self.STATUS_CACHE not in settings.CACHES:
+            raise Err("STATUS_CACHE if set, must be an alias of CACHES: '%s'" % self.STATUS_CACHE)
+
+    def validate_dispatcher(self):
+        if not isinstance(self.DISPATCHER, str):
+            raise Err('DISPATCHER must be the dotted path of a vpos.dispatch.BaseDispatcher')
+        for attr in ('DISPATCHER_WORKERS', 'DISPATCHER_QUEUE_SIZE'):
+            if not isinstance(getattr(self, attr), int) or getattr(self, attr) < 1:
+                raise Err('%s must be a positive integer' % attr)
+
+    def validate_instrument(self):
+        if not isinstance(self.INSTRUMENT, str):
+            raise Err('INSTRUMENT must be the dotted path of a vpos.instrumentation.Instrument')
+
     def validate_pos_id(self):
         if not self.POS_ID:
             raise Err('POS_ID is required')
 
     def get_supervisor_card(self) -> str:
-        if self.MODE == 'sandbox':
-            return self.VPOS_TEST_SUPERVISOR_CARD
-        return self.VPOS_SUPERVISOR_CARD
+        return self.snapshot.supervisor_card
 
     def __getattr__(self, attr: str):
-        if attr not in self.__defaults:
-            raise AttributeError("Invalid VPOS setting: '%s'" % attr)
+        if attr.startswith('_'):
+            raise AttributeError(attr)
         try:
-            value = self.settigs[attr]
+            return self.snapshot.values[attr]
         except KeyError:
-            value = self.__defaults[attr]
-        setattr(self, attr, value)
-        return value
+            raise AttributeError("Invalid VPOS setting: '%s'" % attr)
     
 
 conf = VposSettings()
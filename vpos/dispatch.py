@@ -0,0 +1,228 @@
+"""
+Dispatch of the transaction_completed signal.
+
+The dispatcher is configured with the DISPATCHER setting:
+    - vpos.dispatch.SyncDispatcher (default): receivers run right away,
+      inside the webhook request or the check_payment call
+    - vpos.dispatch.ThreadPoolDispatcher: receivers run after the DB commit
+      on a bounded pool of worker threads, the webhook answers right away
+
+Other queues (celery, rq...) can be plugged by subclassing BaseDispatcher,
+the worker only needs to call vpos.dispatch.send_completed(transaction).
+"""
+import os
+import queue
+import logging
+import threading
+
+from typing import Dict
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, transaction as db_transaction
+from django.utils.module_loading import import_string
+
+from vpos.configs import conf
+from vpos.instrumentation import get_instrument
+from vpos.signals import get_receiver, transaction_completed
+
+
+logger = logging.getLogger('vpos.dispatch')
+
+
+class ReceiverStats:
+
+    """Timing of a signal receiver"""
+
+    calls: int
+    errors: int
+    total: float
+    max: float
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.calls if self.calls else 0.0
+
+    def add(self, seconds: float, error: bool = False) -> None:
+        self.calls += 1
+        self.errors += int(error)
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def __repr__(self) -> str:
+        return '<ReceiverStats calls=%d errors=%d mean=%.4fs max=%.4fs>' % (
+            self.calls, self.errors, self.mean, self.max)
+
+
+# receiver name -> stats, for every dispatcher of the process
+stats: Dict[str, ReceiverStats] = {}
+_stats_lock = threading.Lock()
+
+
+def get_receiver_name(receiver) -> str:
+    return '%s.%s' % (
+        getattr(receiver, '__module__', ''),
+        getattr(receiver, '__qualname__', repr(receiver)))
+
+
+def record(receiver, seconds: float, error: bool = False) -> None:
+    name = get_receiver_name(receiver)
+    with _stats_lock:
+        stats.setdefault(name, ReceiverStats()).add(seconds, error)
+    get_instrument().signal_handler(name, seconds, error)
+    logger.debug('%s took %.4fs', name, seconds)
+
+
+def send_completed(transaction, robust: bool = False) -> list:
+    """
+    Sends transaction_completed, async receivers included.
+    If robust, errors are logged and returned instead of raised
+    """
+    sender = type(transaction)
+    if robust:
+        responses = transaction_completed.send_robust(sender, transaction=transaction)
+    else:
+        responses = transaction_completed.send(sender, transaction=transaction)
+    return get_responses(responses, robust)
+
+
+async def asend_completed(transaction, robust: bool = False) -> list:
+    """Asyncio version of send_completed, sync receivers run in a thread"""
+    if not hasattr(transaction_completed, 'asend'):
+        # django < 5.0
+        return await sync_to_async(send_completed)(transaction, robust)
+    sender = type(transaction)
+    if robust:
+        responses = await transaction_completed.asend_robust(sender, transaction=transaction)
+    else:
+        responses = await transaction_completed.asend(sender, transaction=transaction)
+    return get_responses(responses, robust)
+
+
+def get_responses(responses: list, robust: bool) -> list:
+    """(receiver, response) pairs of the connected receivers, errors logged if robust"""
+    responses = [(get_receiver(wrapper), response) for wrapper, response in responses]
+    if robust:
+        for receiver, response in responses:
+            if isinstance(response, Exception):
+                logger.error('transaction_completed receiver %s failed',
+                    get_receiver_name(receiver), exc_info=response)
+    return responses
+
+
+class BaseDispatcher:
+
+    """Decides when and where transaction_completed receivers run"""
+
+    def dispatch(self, transaction) -> None:
+        raise NotImplementedError
+
+    async def adispatch(self, transaction) -> None:
+        """Dispatch from asyncio code (acheck_payment, aconfirm)"""
+        await sync_to_async(self.dispatch)(transaction)
+
+
+class SyncDispatcher(BaseDispatcher):
+
+    """Runs the receivers right away, errors are raised to the caller"""
+
+    def dispatch(self, transaction) -> None:
+        send_completed(transaction)
+
+    async def adispatch(self, transaction) -> None:
+        await asend_completed(transaction)
+
+
+class OnCommitDispatcher(BaseDispatcher):
+
+    """
+    Base for deferred dispatchers, enqueue is called
+    once the current DB transaction commits (right away in autocommit)
+    """
+
+    def dispatch(self, transaction) -> None:
+        db_transaction.on_commit(lambda: self.enqueue(transaction))
+
+    def enqueue(self, transaction) -> None:
+        raise NotImplementedError
+
+
+class ThreadPoolDispatcher(OnCommitDispatcher):
+
+    """
+    Runs the receivers after commit on DISPATCHER_WORKERS daemon threads.
+    At most DISPATCHER_QUEUE_SIZE transactions wait in the queue, when full
+    the receivers run in the caller thread instead of being dropped
+    """
+
+    workers: int
+    queue_size: int
+
+    def __init__(self, workers: int = None, queue_size: int = None) -> None:
+        self.workers = workers or conf.DISPATCHER_WORKERS
+        self.queue_size = queue_size or conf.DISPATCHER_QUEUE_SIZE
+        self.__lock = threading.Lock()
+        self.__pid = None
+        self.__queue = None
+
+    def enqueue(self, transaction) -> None:
+        try:
+            self.__get_queue().put_nowait(transaction)
+        except queue.Full:
+            logger.warning('Dispatch queue is full, running receivers inline')
+            send_completed(transaction, robust=True)
+
+    def __get_queue(self) -> queue.Queue:
+        # threads do not survive a fork, start them again in the child
+        if self.__pid != os.getpid():
+            with self.__lock:
+                if self.__pid != os.getpid():
+                    self.__queue = queue.Queue(self.queue_size)
+                    for i in range(self.workers):
+                        threading.Thread(target=self.__work,
+                            args=(self.__queue,),
+                            name='vpos-dispatch-%d' % i,
+                            daemon=True).start()
+                    self.__pid = os.getpid()
+        return self.__queue
+
+    @staticmethod
+    def __work(jobs: queue.Queue) -> None:
+        while True:
+            transaction = jobs.get()
+            close_old_connections()
+            try:
+                send_completed(transaction, robust=True)
+            finally:
+                close_old_connections()
+                jobs.task_done()
+
+
+_dispatcher: BaseDispatcher = None
+
+
+def get_dispatcher() -> BaseDispatcher:
+    """The dispatcher set in the DISPATCHER setting"""
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = import_string(conf.DISPATCHER)()
+    return _dispatcher
+
+
+def reset() -> None:
+    """Drops the dispatcher, the next dispatch uses the current DISPATCHER setting"""
+    global _dispatcher
+    _dispatcher = None
+
+
+def dispatch_completed(transaction) -> None:
+    get_dispatcher().dispatch(transaction)
+
+
+async def adispatch_completed(transaction) -> None:
+    await get_dispatcher().adispatch(transaction)
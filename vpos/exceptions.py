@@ -2,3 +2,35 @@
 
 class VposConfigurationError(Exception):
     pass
+
+
+class VposUnavailableError(Exception):
+
+    """The call to vPOS was not made, the gateway is considered unhealthy"""
+
+
+class VposCircuitOpenError(VposUnavailableError):
+
+    """The circuit breaker is open, retry_after is the seconds until the next probe"""
+
+    def __init__(self, retry_after: float) -> None:
+        super().__init__('vPOS circuit is open, retry in %.1fs' % retry_after)
+        self.retry_after = retry_after
+
+
+class VposConcurrencyLimitError(VposUnavailableError):
+
+    """Too many calls in flight to vPOS"""
+
+    def __init__(self, limit: int) -> None:
+        super().__init__('vPOS concurrency limit of %d calls reached' % limit)
+        self.limit = limit
+
+
+class VposWebhookError(Exception):
+
+    """A webhook call rejected before any DB query, status is the HTTP status to answer"""
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
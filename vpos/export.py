@@ -0,0 +1,214 @@
+"""
+Streaming export and reconciliation of transactions (see the vpos_export command).
+
+Rows are read with values() and iterator(), server-side cursors on PostgreSQL,
+keys of the data JSON are extracted by the database, and CSV/JSONL is written
+row by row: memory does not grow with the number of transactions.
+
+Reconciliation merges our requested transactions and a vPOS statement,
+both sorted by vPOS id (Transaction.key), and yields their differences.
+"""
+import csv
+import json
+import decimal
+
+from typing import Dict, Iterable, Iterator, TextIO, Tuple, Union
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import F, QuerySet
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Collate
+
+from vpos.models import Transaction
+
+
+EXPORT_FIELDS: Tuple[str, ...] = (
+    'id',
+    'key',
+    'type',
+    'status',
+    'status_code',
+    'mobile',
+    'amount',
+    'vpos_fee',
+    'bank_fee',
+    'parent_key',
+    'created_at',
+    'requested_at',
+    'completed_at')
+
+# exported name -> path in Transaction.data
+JSON_FIELDS: Dict[str, Tuple[str, ...]] = {
+    'location': ('location',),
+    'status_datetime': ('transaction', 'status_datetime'),
+    'clearing_period': ('transaction', 'clearing_period')}
+
+RECONCILE_FIELDS: Tuple[str, ...] = (
+    'key', 'issue', 'status', 'statement_status', 'amount', 'statement_amount')
+
+# binary collations, so the database sorts keys like python compares strings
+KEY_COLLATIONS: Dict[str, str] = {
+    'postgresql': 'C',
+    'mysql': 'utf8mb4_bin'}
+
+CHUNK_SIZE: int = 2000
+
+
+def get_json_path(path: Tuple[str, ...]):
+    expression = KeyTextTransform(path[0], 'data')
+    for key in path[1:]:
+        expression = KeyTextTransform(key, expression)
+    return expression
+
+
+def export_rows(queryset: QuerySet = None,
+        fields: Iterable[str] = EXPORT_FIELDS,
+        json_fields: Dict[str, Tuple[str, ...]] = None,
+        chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Streams transactions as dicts of fields plus the json_fields
+    (default JSON_FIELDS) taken from data by the database
+    """
+    json_fields = JSON_FIELDS if json_fields is None else json_fields
+    queryset = Transaction.objects.all() if queryset is None else queryset
+    annotations: dict = {
+        name: get_json_path(path) for name, path in json_fields.items()}
+    if 'parent_key' in fields:
+        annotations['parent_key'] = F('parent__key')
+    if not queryset.query.order_by:
+        queryset = queryset.order_by('created_at', 'id')
+    return queryset.annotate(**annotations).values(
+        *fields, *json_fields).iterator(chunk_size=chunk_size)
+
+
+def write_csv(rows: Iterable[dict], stream: TextIO, fields: Iterable[str]) -> int:
+    """Writes rows as CSV with a header, returns the number of rows"""
+    writer = csv.DictWriter(stream, fieldnames=list(fields), extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow({
+            name: value.isoformat() if hasattr(value, 'isoformat') else value
+            for name, value in row.items()})
+        count += 1
+    return count
+
+
+def write_jsonl(rows: Iterable[dict], stream: TextIO) -> int:
+    """Writes rows as JSON lines, returns the number of rows"""
+    encoder = DjangoJSONEncoder(separators=(',', ':'))
+    count = 0
+    for row in rows:
+        stream.write(encoder.encode(row))
+        stream.write('\n')
+        count += 1
+    return count
+
+
+def read_statement(stream: TextIO, format: str = 'csv') -> Iterator[dict]:
+    """
+    Streams a vPOS statement (CSV with a header or JSON lines)
+    with at least the id column, optionally status and amount
+    """
+    if format == 'jsonl':
+        for line in stream:
+            if line.strip():
+                yield json.loads(line)
+    else:
+        yield from csv.DictReader(stream)
+
+
+def get_key_order(queryset: QuerySet):
+    vendor: str = connections[queryset.db].vendor
+    if (collation := KEY_COLLATIONS.get(vendor)):
+        return Collate('key', collation).asc()
+    # sqlite compares text bytewise
+    return F('key').asc()
+
+
+def sorted_by(rows: Iterable[dict], key: str, name: str) -> Iterator[dict]:
+    """Yields rows, raising ValueError if they are not sorted by key"""
+    last = None
+    for index, row in enumerate(rows, 1):
+        value = str(row[key])
+        if last is not None and value < last:
+            raise ValueError('%s is not sorted by %s: %r after %r (row %d)' % (
+                name, key, value, last, index))
+        last = value
+        yield row
+
+
+def parse_amount(value) -> Union[decimal.Decimal, None]:
+    try:
+        return decimal.Decimal(str(value)).quantize(decimal.Decimal('0.01'))
+    except (decimal.InvalidOperation, TypeError, ValueError):
+        return None
+
+
+def reconcile(statement: Iterable[dict],
+        queryset: QuerySet = None,
+        id_field: str = 'id',
+        chunk_size: int = CHUNK_SIZE) -> Iterator[dict]:
+    """
+    Merge join of a statement and our requested transactions by key,
+    both sorted by key. Yields one dict (RECONCILE_FIELDS) per difference,
+    issue is one of missing_local, missing_statement, status_mismatch
+    and amount_mismatch
+    """
+    queryset = Transaction.objects.all() if queryset is None else queryset
+    queryset = queryset.filter(requested=True, key__isnull=False)
+    local = sorted_by(queryset.order_by(get_key_order(queryset)).values(
+        'key', 'status', 'amount').iterator(chunk_size=chunk_size), 'key', 'transactions')
+    remote = sorted_by(statement, id_field, 'statement')
+    row, entry = next(local, None), next(remote, None)
+    while row is not None or entry is not None:
+        entry_key = str(entry[id_field]) if entry is not None else None
+        if entry is None or (row is not None and row['key'] < entry_key):
+            yield get_difference(row['key'], 'missing_statement', row, None)
+            row = next(local, None)
+        elif row is None or entry_key < row['key']:
+            yield get_difference(entry_key, 'missing_local', None, entry)
+            entry = next(remote, None)
+        else:
+            yield from compare(row, entry)
+            row, entry = next(local, None), next(remote, None)
+
+
+def compare(row: dict, entry: dict) -> Iterator[dict]:
+    if (status := entry.get('status')) and status != row['status']:
+        yield get_difference(row['key'], 'status_mismatch', row, entry)
+    if (amount := entry.get('amount')) not in (None, '') and \
+            parse_amount(amount) != parse_amount(row['amount']):
+        yield get_difference(row['key'], 'amount_mismatch', row, entry)
+
+
+def get_difference(key: str, issue: str,
+        row: Union[dict, None], entry: Union[dict, None]) -> dict:
+    return {
+        'key': key,
+        'issue': issue,
+        'status': row and row['status'],
+        'statement_status': entry and entry.get('status'),
+        'amount': row and row['amount'],
+        'statement_amount': entry and entry.get('amount')}
+
+
+def get_format(path: str) -> str:
+    return 'jsonl' if path.endswith(('.jsonl', '.ndjson', '.json')) else 'csv'
+
+
+def export(stream: TextIO, format: str = 'csv',
+        queryset: QuerySet = None,
+        fields: Iterable[str] = None) -> int:
+    """
+    Writes transactions to stream as CSV or JSON lines, returns the number of rows.
+    fields are names of EXPORT_FIELDS and JSON_FIELDS, all by default
+    """
+    fields = list(fields or (*EXPORT_FIELDS, *JSON_FIELDS))
+    rows = export_rows(queryset,
+        fields=[name for name in fields if name not in JSON_FIELDS],
+        json_fields={name: JSON_FIELDS[name] for name in fields if name in JSON_FIELDS})
+    if format == 'jsonl':
+        return write_jsonl(rows, stream)
+    return write_csv(rows, stream, fields)
@@ -0,0 +1,238 @@
+"""
+Fee schedules with exact cents arithmetic.
+
+A schedule is built once from a fee tuple (percent, min amount, max amount, plus amount),
+see BANK_FEE and VPOS_FEE settings, and can be applied to a single amount
+or to whole lists / numpy arrays of amounts at once, for settlement reports
+and pricing simulations. Results are the same cents stored per transaction.
+
+Transactions store the fee expenses (columns) and the version of the fee settings
+(FeeVersion) they were created with, fee breakdowns are computed from it on demand.
+"""
+import json
+import decimal
+import hashlib
+import functools
+
+from typing import Dict, Iterable, List, Set, Tuple, Union
+
+from django.db import router, transaction as db_transaction
+
+from vpos.configs import conf
+
+try:
+    import numpy
+except ImportError:  # numpy is optional
+    numpy = None
+
+
+CENTS = decimal.Decimal('0.01')
+# numpy int64 is used while products stay below this bound
+INT64_SAFE: int = 2 ** 62
+
+
+def to_cents(amount) -> int:
+    """Converts an amount (Decimal, str, int or float) to integer cents, half up"""
+    return int((decimal.Decimal(str(amount)) * 100).to_integral_value(
+        rounding=decimal.ROUND_HALF_UP))
+
+
+def from_cents(cents: int) -> decimal.Decimal:
+    return (decimal.Decimal(int(cents)) * CENTS).quantize(CENTS)
+
+
+class FeeSchedule:
+
+    """
+    Precompiled fee. The percent is kept as an exact fraction
+    and amounts as integer cents, so no float rounding is involved
+    """
+
+    __slots__ = (
+        'name', 'fee', 'percent', 'min_amount', 'max_amount', 'plus',
+        '_numerator', '_denominator', '_min', '_max', '_plus')
+
+    def __init__(self, fee: tuple, name: str = None) -> None:
+        percent, min_amount, max_amount, plus = fee
+        self.name = name
+        self.fee = tuple(fee)
+        self.percent = decimal.Decimal(str(percent or 0))
+        self.min_amount = min_amount
+        self.max_amount = max_amount
+        self.plus = plus or 0
+        numerator, denominator = self.percent.as_integer_ratio()
+        # fee cents = cents * percent / 100 = cents * numerator / _denominator
+        self._numerator = numerator
+        self._denominator = denominator * 100
+        self._min = to_cents(min_amount) if min_amount else None
+        self._max = to_cents(max_amount) if max_amount else None
+        self._plus = to_cents(self.plus)
+
+    def __repr__(self) -> str:
+        return '<FeeSchedule %s %r>' % (self.name, self.fee)
+
+    @property
+    def active(self) -> bool:
+        return bool(self.percent)
+
+    # -------------------------------------------------------------------------------------------
+    # single amount
+
+    def expense_cents(self, cents: int) -> int:
+        """Fee expense in cents for an amount in cents"""
+        if not self._numerator:
+            return 0
+        d = self._denominator
+        # exact fee = n / d cents
+        n = cents * self._numerator + self._plus * d
+        if self._min and n < self._min * d:
+            return self._min
+        if self._max and n > self._max * d:
+            return self._max
+        return (2 * n + d) // (2 * d)
+
+    def expense(self, amount) -> decimal.Decimal:
+        """Fee expense for an amount, as Decimal rounded to cents"""
+        return from_cents(self.expense_cents(to_cents(amount)))
+
+    def breakdown(self, amount) -> Union[dict, None]:
+        """Fee details of an amount, same keys as vpos.utils.get_calculated_fees"""
+        if not self.active:
+            return None
+        cents = to_cents(amount)
+        expense = self.expense_cents(cents)
+        fee_amount = (cents * self._numerator + self._plus * self._denominator) / self._denominator
+        return {
+            'name': self.name,
+            'amount': float(from_cents(cents)),
+            'net_amount': float(from_cents(cents - expense)),
+            'expense': float(from_cents(expense)),
+            'fee_amount': round(fee_amount / 100, 6),
+            'applied_plus_amount': self.plus,
+            'applied_fee': float(self.percent),
+            'applied_min_amount': self.min_amount,
+            'applied_max_amount': self.max_amount}
+
+    # -------------------------------------------------------------------------------------------
+    # many amounts
+
+    def apply_cents(self, cents):
+        """
+        Fee expenses in cents for many amounts in cents.
+        A numpy array is computed at once and returns a numpy array,
+        any other iterable returns a list
+        """
+        if numpy is not None and isinstance(cents, numpy.ndarray):
+            return self.__apply_array(cents)
+        return [self.expense_cents(c) for c in cents]
+
+    def apply(self, amounts: Iterable) -> List[decimal.Decimal]:
+        """Fee expenses, as Decimal, for many amounts"""
+        return [from_cents(c) for c in self.apply_cents(
+            [to_cents(amount) for amount in amounts])]
+
+    def __apply_array(self, cents):
+        cents = numpy.asarray(cents, dtype=numpy.int64)
+        if not self._numerator or not cents.size:
+            return numpy.zeros(cents.shape, dtype=numpy.int64)
+        d = self._denominator
+        peak = int(numpy.abs(cents).max()) * self._numerator + self._plus * d
+        if 2 * peak + d >= INT64_SAFE:
+            # too big for int64, exact python integers
+            return numpy.array(
+                [self.expense_cents(int(c)) for c in cents], dtype=object)
+        n = cents * self._numerator + self._plus * d
+        expense = (2 * n + d) // (2 * d)
+        # min is checked last, it wins as in expense_cents
+        if self._max:
+            expense = numpy.where(n > self._max * d, self._max, expense)
+        if self._min:
+            expense = numpy.where(n < self._min * d, self._min, expense)
+        return expense
+
+
+NO_FEE = FeeSchedule((0, None, None, 0))
+
+
+@functools.lru_cache(maxsize=32)
+def compile_schedule(fee: tuple, name: str = None) -> FeeSchedule:
+    """Schedule of a fee tuple, built once per distinct tuple"""
+    if not fee:
+        return NO_FEE
+    return FeeSchedule(tuple(fee), name=name)
+
+
+def get_vpos_fee_schedule(tenant: str = None) -> FeeSchedule:
+    return conf.get_tenant(tenant).vpos_fee_schedule
+
+
+def get_bank_fee_schedule(tenant: str = None) -> FeeSchedule:
+    return conf.get_tenant(tenant).bank_fee_schedule
+
+
+def calculate_fees(amounts: Iterable, tenant: str = None) -> Tuple[list, list]:
+    """
+    vPOS and bank fee expenses in cents of many amounts,
+    amounts may be a numpy array of cents or an iterable of amounts
+    """
+    if numpy is None or not isinstance(amounts, numpy.ndarray):
+        amounts = [to_cents(amount) for amount in amounts]
+    return (
+        get_vpos_fee_schedule(tenant).apply_cents(amounts),
+        get_bank_fee_schedule(tenant).apply_cents(amounts))
+
+
+# -----------------------------------------------------------------------------------------------
+# fee versions
+
+# FeeVersion id -> (vpos fee, bank fee) schedules, versions are never changed
+_versions: Dict[str, Tuple[FeeSchedule, FeeSchedule]] = {}
+# ids of the FeeVersion rows known to be committed
+_saved: Set[str] = set()
+
+
+def get_version(vpos_fee: tuple, bank_fee: tuple) -> Union[str, None]:
+    """Version id of a pair of fee tuples, None if no fee applies"""
+    fees = [
+        [None if value is None else str(decimal.Decimal(str(value)).normalize())
+            for value in list(fee[:3]) + [fee[3] or 0]] if fee and fee[0] else None
+        for fee in (vpos_fee, bank_fee)]
+    if not any(fees):
+        return None
+    return hashlib.sha256(json.dumps(fees).encode()).hexdigest()[:16]
+
+
+def get_current_version(tenant: str = None) -> Union[str, None]:
+    """
+    Version of the VPOS_FEE and BANK_FEE settings of a tenant, saved on first use.
+    The row may be created in the caller's DB transaction, it is only known
+    to be saved once committed: a rollback removes it and the next call saves it again
+    """
+    settings = conf.get_tenant(tenant)
+    version: Union[str, None] = settings.fee_version
+    if version is not None and version not in _saved:
+        from vpos.models.fee import FeeVersion
+        schedules = settings.vpos_fee_schedule, settings.bank_fee_schedule
+        FeeVersion.objects.get_or_create(id=version, defaults={
+            'vpos_fee': list(schedules[0].fee) if schedules[0].active else None,
+            'bank_fee': list(schedules[1].fee) if schedules[1].active else None})
+        _versions.setdefault(version, schedules)
+        db_transaction.on_commit(lambda: _saved.add(version),
+            using=router.db_for_write(FeeVersion))
+    return version
+
+
+def get_version_schedules(version: Union[str, None]) -> Tuple[FeeSchedule, FeeSchedule]:
+    """vPOS and bank fee schedules of a version, loaded once per process"""
+    if version is None:
+        return NO_FEE, NO_FEE
+    if (schedules := _versions.get(version)) is None:
+        from vpos.models.fee import FeeVersion
+        fees = FeeVersion.objects.filter(id=version).values_list(
+            'vpos_fee', 'bank_fee').first()
+        if fees is None:
+            return NO_FEE, NO_FEE
+        schedules = _versions[version] = (
+            compile_schedule(tuple(fees[0]) if fees[0] else None, name='vpos fee'),
+            compile_schedule(tuple(fees[1]) if fees[1] else None, name='bank fee'))
+    return schedules
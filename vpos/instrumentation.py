@@ -0,0 +1,236 @@
+"""
+Instrumentation hooks of the vPOS hot paths.
+
+The instrument is set with the INSTRUMENT setting (a dotted path):
+    - vpos.instrumentation.Instrument (default): does nothing
+    - vpos.instrumentation.PrometheusInstrument: prometheus_client counters/histograms
+    - vpos.instrumentation.OpenTelemetryInstrument: opentelemetry spans and histograms
+
+Custom backends subclass Instrument and override the hooks they need.
+"""
+import threading
+import contextlib
+
+from typing import Dict, Union
+
+from django.utils.module_loading import import_string
+
+from vpos.configs import conf
+
+
+_null_span = contextlib.nullcontext()
+_lock = threading.RLock()
+# instruments by INSTRUMENT path, prometheus collectors by (registry, namespace)
+_instruments: Dict[str, 'Instrument'] = {}
+_prometheus_metrics: Dict[tuple, dict] = {}
+
+
+class Instrument:
+
+    """No-op instrument, the base of every backend"""
+
+    def span(self, name: str, **attributes):
+        """Context manager around an operation (create, check, webhook...)"""
+        return _null_span
+
+    def http_request(self, method: str, endpoint: str,
+            status: Union[int, None], seconds: float) -> None:
+        """A call to vPOS, status is None if it failed without a response"""
+
+    def http_retry(self, method: str, endpoint: str) -> None:
+        """A call to vPOS is about to be retried"""
+
+    def confirmation(self, source: str, status: Union[str, None],
+            seconds: Union[float, None]) -> None:
+        """
+        A transaction was confirmed, source is 'callback' or 'polling',
+        seconds is the time since it was requested to vPOS
+        """
+
+    def eta(self, predicted: float, observed: float) -> None:
+        """Eta given by vPOS and the seconds it really took to complete"""
+
+    def webhook(self, status: int, seconds: float) -> None:
+        """A vPOS callback was answered"""
+
+    def signal_handler(self, receiver: str, seconds: float, error: bool) -> None:
+        """A transaction_completed receiver ran"""
+
+    def circuit_state(self, state: str) -> None:
+        """The circuit breaker became closed, open or half_open"""
+
+    def concurrency_limit(self, limit: int, tenant: str = None) -> None:
+        """The adaptive limit of calls in flight of a tenant (None by default) changed"""
+
+    def fail_fast(self, reason: str) -> None:
+        """A call was not made, reason is circuit_open or concurrency_limit"""
+
+
+class PrometheusInstrument(Instrument):
+
+    """Prometheus metrics, requires prometheus_client"""
+
+    def __init__(self, registry=None, namespace: str = 'vpos') -> None:
+        from prometheus_client import REGISTRY
+        registry = registry or REGISTRY
+        # collectors are registered once per registry and namespace,
+        # instances share them (a registry rejects duplicate names)
+        with _lock:
+            key: tuple = (registry, namespace)
+            if key not in _prometheus_metrics:
+                _prometheus_metrics[key] = create_prometheus_metrics(registry, namespace)
+        self.__dict__.update(_prometheus_metrics[key])
+
+    def http_request(self, method, endpoint, status, seconds):
+        self.http_requests.labels(method, endpoint, str(status)).observe(seconds)
+
+    def http_retry(self, method, endpoint):
+        self.http_retries.labels(method, endpoint).inc()
+
+    def confirmation(self, source, status, seconds):
+        if seconds is not None:
+            self.confirmations.labels(source, str(status)).observe(seconds)
+
+    def eta(self, predicted, observed):
+        self.eta_errors.observe(observed - predicted)
+
+    def webhook(self, status, seconds):
+        self.webhooks.labels(str(status)).observe(seconds)
+
+    def signal_handler(self, receiver, seconds, error):
+        self.signal_handlers.labels(receiver, str(error).lower()).observe(seconds)
+
+    def circuit_state(self, state):
+        for name in ('closed', 'open', 'half_open'):
+            self.circuit_states.labels(name).set(int(name == state))
+
+    def concurrency_limit(self, limit, tenant=None):
+        self.concurrency_limits.labels(tenant or '').set(limit)
+
+    def fail_fast(self, reason):
+        self.fail_fasts.labels(reason).inc()
+
+
+def create_prometheus_metrics(registry, namespace: str) -> dict:
+    """Collectors of PrometheusInstrument, by attribute name"""
+    from prometheus_client import Counter, Gauge, Histogram
+    metrics: dict = {}
+    metrics['http_requests'] = Histogram('http_request_seconds',
+        'Latency of vPOS API calls',
+        ['method', 'endpoint', 'status'],
+        namespace=namespace, registry=registry)
+    metrics['http_retries'] = Counter('http_retries',
+        'Retried vPOS API calls',
+        ['method', 'endpoint'],
+        namespace=namespace, registry=registry)
+    metrics['confirmations'] = Histogram('confirmation_seconds',
+        'Time from request to confirmation of transactions',
+        ['source', 'status'],
+        namespace=namespace, registry=registry,
+        buckets=(1, 5, 10, 20, 30, 60, 90, 120, 300, 600, 1800))
+    metrics['eta_errors'] = Histogram('eta_error_seconds',
+        'Observed minus predicted completion time (vPOS eta)',
+        namespace=namespace, registry=registry,
+        buckets=(-30, -10, -5, -2, -1, 0, 1, 2, 5, 10, 30, 90))
+    metrics['webhooks'] = Histogram('webhook_seconds',
+        'Latency of the vPOS callback view',
+        ['status'],
+        namespace=namespace, registry=registry)
+    metrics['signal_handlers'] = Histogram('signal_handler_seconds',
+        'Duration of transaction_completed receivers',
+        ['receiver', 'error'],
+        namespace=namespace, registry=registry)
+    metrics['circuit_states'] = Gauge('circuit_state',
+        'State of the vPOS circuit breaker (1 for the current state)',
+        ['state'],
+        namespace=namespace, registry=registry)
+    metrics['concurrency_limits'] = Gauge('concurrency_limit',
+        'Adaptive limit of vPOS calls in flight',
+        ['tenant'],
+        namespace=namespace, registry=registry)
+    metrics['fail_fasts'] = Counter('fail_fast',
+        'vPOS calls not made to protect the gateway',
+        ['reason'],
+        namespace=namespace, registry=registry)
+    return metrics
+
+
+class OpenTelemetryInstrument(Instrument):
+
+    """OpenTelemetry spans and metrics, requires opentelemetry-api"""
+
+    def __init__(self, name: str = 'vpos') -> None:
+        from opentelemetry import metrics, trace
+        self.tracer = trace.get_tracer(name)
+        meter = metrics.get_meter(name)
+        self.http_requests = meter.create_histogram('vpos.http.request.duration',
+            unit='s', description='Latency of vPOS API calls')
+        self.http_retries = meter.create_counter('vpos.http.retries',
+            description='Retried vPOS API calls')
+        self.confirmations = meter.create_histogram('vpos.confirmation.duration',
+            unit='s', description='Time from request to confirmation of transactions')
+        self.eta_errors = meter.create_histogram('vpos.eta.error',
+            unit='s', description='Observed minus predicted completion time (vPOS eta)')
+        self.webhooks = meter.create_histogram('vpos.webhook.duration',
+            unit='s', description='Latency of the vPOS callback view')
+        self.signal_handlers = meter.create_histogram('vpos.signal_handler.duration',
+            unit='s', description='Duration of transaction_completed receivers')
+        self.circuit_changes = meter.create_counter('vpos.circuit.changes',
+            description='State changes of the vPOS circuit breaker')
+        self.concurrency_changes = meter.create_up_down_counter('vpos.concurrency.limit',
+            description='Adaptive limit of vPOS calls in flight')
+        self.fail_fasts = meter.create_counter('vpos.fail_fast',
+            description='vPOS calls not made to protect the gateway')
+        self.__limits: dict = {}
+
+    def span(self, name, **attributes):
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+    def http_request(self, method, endpoint, status, seconds):
+        self.http_requests.record(seconds, {
+            'http.method': method, 'vpos.endpoint': endpoint, 'http.status_code': str(status)})
+
+    def http_retry(self, method, endpoint):
+        self.http_retries.add(1, {'http.method': method, 'vpos.endpoint': endpoint})
+
+    def confirmation(self, source, status, seconds):
+        if seconds is not None:
+            self.confirmations.record(seconds, {
+                'vpos.source': source, 'vpos.status': str(status)})
+
+    def eta(self, predicted, observed):
+        self.eta_errors.record(observed - predicted)
+
+    def webhook(self, status, seconds):
+        self.webhooks.record(seconds, {'http.status_code': str(status)})
+
+    def signal_handler(self, receiver, seconds, error):
+        self.signal_handlers.record(seconds, {
+            'vpos.receiver': receiver, 'error': str(error).lower()})
+
+    def circuit_state(self, state):
+        self.circuit_changes.add(1, {'vpos.circuit.state': state})
+
+    def concurrency_limit(self, limit, tenant=None):
+        # up-down counter, the change since the last limit of the tenant
+        self.concurrency_changes.add(limit - self.__limits.get(tenant, 0),
+            {'vpos.tenant': tenant or ''})
+        self.__limits[tenant] = limit
+
+    def fail_fast(self, reason):
+        self.fail_fasts.add(1, {'vpos.reason': reason})
+
+
+def get_instrument() -> Instrument:
+    """The instrument set in the INSTRUMENT setting, built once per path"""
+    path: str = conf.INSTRUMENT
+    if (instrument := _instruments.get(path)) is None:
+        with _lock:
+            if (instrument := _instruments.get(path)) is None:
+                instrument = _instruments[path] = import_string(path)()
+    return instrument
+
+
+def get_endpoint(path: str) -> str:
+    """Endpoint label of an API path, without ids: /requests/123 -> /requests"""
+    return '/' + path.strip('/').split('/', 1)[0]
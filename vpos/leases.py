@@ -0,0 +1,220 @@
+"""
+Deduplication of concurrent calls for the same transaction
+(see Transaction.request and Transaction.check_payment).
+
+    - SingleFlight collapses concurrent calls with the same key made in one process
+      (threads or asyncio tasks) into a single call, whose result or error is
+      shared by every caller.
+    - CacheLease is a lease held in a Django cache with a TTL, across processes:
+      only the process that takes it makes the call, the others wait for its end.
+    - RowLease is the same lease held in a column of the row (Transaction.requesting_until),
+      taken with a conditional UPDATE: no lock nor DB transaction is held during the call.
+"""
+import os
+import time
+import uuid
+import datetime
+import asyncio
+import threading
+
+from typing import Callable, Dict, Union
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+
+from vpos.configs import conf
+
+
+class _Call:
+
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self) -> None:
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+
+    """Runs a function once per key at a time, concurrent callers share its result"""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._futures: Dict[tuple, asyncio.Future] = {}
+
+    def do(self, key: str, fn: Callable) -> tuple:
+        """Returns (result of fn(), True if this caller ran fn)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, False
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result, True
+
+    async def ado(self, key: str, fn: Callable) -> tuple:
+        """Asyncio version of do, fn() returns an awaitable"""
+        # futures belong to the loop that created them
+        loop_key = (id(asyncio.get_running_loop()), key)
+        if (future := self._futures.get(loop_key)) is not None:
+            return await asyncio.shield(future), False
+        future = self._futures[loop_key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except BaseException as e:
+            future.set_exception(e)
+            # retrieved, even if nobody else waits for it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._futures[loop_key]
+        return result, True
+
+
+class Lease:
+
+    """
+    A lease held for at most timeout seconds. The TTL must be longer than
+    the call it protects, an expired lease lets another process make the call again
+    """
+
+    timeout: float
+
+    def acquire(self) -> bool:
+        raise NotImplementedError
+
+    def release(self) -> None:
+        raise NotImplementedError
+
+    def held(self) -> bool:
+        raise NotImplementedError
+
+    def wait(self, done: Callable[[], bool], timeout: float = None) -> bool:
+        """
+        Waits until done() is True or the lease is released by its holder.
+        Returns done()
+        """
+        deadline = time.monotonic() + (timeout or self.timeout)
+        delay = 0.05
+        while not done():
+            if not self.held() or time.monotonic() >= deadline:
+                return done()
+            time.sleep(delay)
+            delay = min(delay * 2, 1)
+        return True
+
+    async def await_done(self, done: Callable, timeout: float = None) -> bool:
+        """Asyncio version of wait, done() returns an awaitable"""
+        held = sync_to_async(self.held)
+        deadline = time.monotonic() + (timeout or self.timeout)
+        delay = 0.05
+        while not await done():
+            if not await held() or time.monotonic() >= deadline:
+                return await done()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 1)
+        return True
+
+
+class CacheLease(Lease):
+
+    """A lease on name, held in the LEASE_CACHE"""
+
+    def __init__(self, name: str, timeout: float = None, alias: str = None) -> None:
+        self.cache = caches[alias or conf.LEASE_CACHE]
+        self.key = 'vpos:lease:' + name
+        self.timeout = timeout or conf.LEASE_TIMEOUT
+        self.token = uuid.uuid4().hex
+
+    def acquire(self) -> bool:
+        return self.cache.add(self.key, self.token, self.timeout)
+
+    def release(self) -> None:
+        # no compare-and-delete in the cache API, only
+        # a lease that expired and was taken again could be lost
+        if self.cache.get(self.key) == self.token:
+            self.cache.delete(self.key)
+
+    def held(self) -> bool:
+        return self.cache.get(self.key) is not None
+
+
+class RowLease(Lease):
+
+    """
+    A lease on the request of a not yet requested transaction, held in its
+    requesting_until column and taken with a conditional UPDATE
+    """
+
+    def __init__(self, model, pk, timeout: float = None) -> None:
+        self.model = model
+        self.pk = pk
+        self.timeout = timeout or conf.LEASE_TIMEOUT
+        self.until = None
+
+    def acquire(self) -> bool:
+        now = timezone.now()
+        until = now + datetime.timedelta(seconds=self.timeout)
+        if self.model.objects.filter(
+                Q(requesting_until__isnull=True) | Q(requesting_until__lte=now),
+                pk=self.pk, requested=False).update(requesting_until=until):
+            self.until = until
+            return True
+        return False
+
+    def release(self) -> None:
+        # only the lease of this holder, an expired one may have been taken again
+        if self.until is not None:
+            self.model.objects.filter(
+                pk=self.pk, requesting_until=self.until).update(requesting_until=None)
+            self.until = None
+
+    def held(self) -> bool:
+        return self.model.objects.filter(
+            pk=self.pk, requesting_until__gt=timezone.now()).exists()
+
+
+def get_lease(name: str, timeout: float = None) -> Union[CacheLease, None]:
+    """A lease in the LEASE_CACHE, None if no LEASE_CACHE is set"""
+    if conf.LEASE_CACHE:
+        return CacheLease(name, timeout)
+    return None
+
+
+def get_request_lease(transaction) -> Lease:
+    """The lease of the request of transaction, in the LEASE_CACHE if set, else in its row"""
+    if conf.LEASE_CACHE:
+        return CacheLease('request:%s' % transaction.pk)
+    return RowLease(type(transaction), transaction.pk)
+
+
+flight = SingleFlight()
+
+
+def _after_fork_in_child() -> None:
+    global flight
+    # calls in flight belong to the parent
+    flight = SingleFlight()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from vpos import archive
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Moves transactions completed more than --days ago, with their refund, '
+        'to the ArchivedTransaction table or a JSONL store')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=None,
+            help='Archive transactions completed more than this days ago (default: ARCHIVE_AFTER_DAYS)')
+        parser.add_argument('--batch-size', type=int, default=None,
+            help='Payments archived per batch and DB transaction (default: ARCHIVE_BATCH_SIZE)')
+        parser.add_argument('--jsonl', default=None, metavar='PATH',
+            help='Append to this JSONL store instead of the table, gzip compressed if it ends with .gz')
+        parser.add_argument('--max-batches', type=int, default=None)
+
+    def handle(self, *args, **options):
+        stream = archive.open_store(options['jsonl']) if options['jsonl'] else None
+        try:
+            result = archive.Archiver(
+                days=options['days'],
+                batch_size=options['batch_size'],
+                stream=stream).run(max_batches=options['max_batches'])
+        finally:
+            if stream is not None:
+                stream.close()
+        self.stdout.write('batches: %d, payments: %d, refunds: %d' % (
+            result.batches, result.payments, result.refunds))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+from vpos import archive
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Recreates the empty archive table partitioned by month of created_at, '
+        'PostgreSQL only. Run it once, before the first vpos_archive')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        try:
+            archive.partition_table(using=options['database'])
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write('The archive table is now partitioned by month of created_at')
@@ -0,0 +1,85 @@
+import sys
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime, parse_date
+
+from vpos import export
+from vpos.models import Transaction
+
+
+class Command(BaseCommand):
+
+    help = (
+        'Streams transactions to CSV/JSONL, or with --reconcile, '
+        'the differences between a vPOS statement and our transactions')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=['csv', 'jsonl'], default=None,
+            help='Output format (default: from --output extension, else csv)')
+        parser.add_argument('--output', default='-',
+            help='Output file, - for stdout')
+        parser.add_argument('--since', default=None,
+            help='Only transactions created at or after this date/datetime')
+        parser.add_argument('--until', default=None,
+            help='Only transactions created before this date/datetime')
+        parser.add_argument('--status', choices=['accepted', 'rejected', 'pending'],
+            default=None)
+        parser.add_argument('--fields', default=None,
+            help='Comma separated fields to export (default: all)')
+        parser.add_argument('--reconcile', default=None, metavar='STATEMENT',
+            help='vPOS statement (CSV or JSONL) sorted by id to reconcile')
+        parser.add_argument('--statement-id', default='id',
+            help='Column of the statement with the vPOS transaction id')
+
+    def handle(self, *args, **options):
+        output: str = options['output']
+        format: str = options['format'] or export.get_format(output)
+        stream = sys.stdout if output == '-' else open(output, 'w', newline='')
+        try:
+            queryset = self.get_queryset(options)
+            if options['reconcile']:
+                count = self.reconcile(queryset, stream, format, options)
+                self.stderr.write('differences: %d' % count)
+            else:
+                fields = options['fields'].split(',') if options['fields'] else None
+                count = export.export(stream, format, queryset, fields)
+                self.stderr.write('transactions: %d' % count)
+        except ValueError as e:
+            raise CommandError(e)
+        finally:
+            if stream is not sys.stdout:
+                stream.close()
+
+    def reconcile(self, queryset, stream, format: str, options: dict) -> int:
+        path: str = options['reconcile']
+        with open(path, newline='') as statement:
+            differences = export.reconcile(
+                export.read_statement(statement, export.get_format(path)),
+                queryset,
+                id_field=options['statement_id'])
+            if format == 'jsonl':
+                return export.write_jsonl(differences, stream)
+            return export.write_csv(differences, stream, export.RECONCILE_FIELDS)
+
+    def get_queryset(self, options: dict):
+        queryset = Transaction.objects.all()
+        if options['since']:
+            queryset = queryset.filter(created_at__gte=self.parse(options['since']))
+        if options['until']:
+            queryset = queryset.filter(created_at__lt=self.parse(options['until']))
+        if options['status']:
+            queryset = getattr(queryset, options['status'])()
+        return queryset
+
+    @staticmethod
+    def parse(value: str) -> datetime.datetime:
+        if (parsed := parse_datetime(value)) is None:
+            if (day := parse_date(value)) is None:
+                raise CommandError('Invalid date: %s' % value)
+            parsed = datetime.datetime.combine(day, datetime.time.min)
+        if settings.USE_TZ and timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from vpos.outbox import OutboxDispatcher
+
+
+class Command(BaseCommand):
+
+    help = 'Sends the vPOS requests enqueued in the outbox (OUTBOX setting)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+            help='Max concurrent requests to vPOS (default: HTTP_POOL_SIZE)')
+        parser.add_argument('--batch-size', type=int, default=None,
+            help='Entries claimed and saved per batch (default: OUTBOX_BATCH_SIZE)')
+        parser.add_argument('--forever', action='store_true',
+            help='Keep running, looking at the outbox every --interval seconds when empty')
+        parser.add_argument('--interval', type=float, default=1.0)
+
+    def handle(self, *args, **options):
+        dispatcher = OutboxDispatcher(
+            max_workers=options['workers'],
+            batch_size=options['batch_size'])
+        if options['forever']:
+            try:
+                dispatcher.run_forever(interval=options['interval'])
+            except KeyboardInterrupt:
+                return
+        result = dispatcher.run()
+        self.stdout.write(
+            'claimed: %d, requested: %d, retried: %d, failed: %d' % (
+                result.claimed, result.requested, result.retried, result.failed))
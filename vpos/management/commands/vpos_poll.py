@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from vpos.poller import Poller
+
+
+class Command(BaseCommand):
+
+    help = 'Checks the status of requested transactions not yet confirmed by vPOS'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None,
+            help='Max concurrent requests to vPOS (default: HTTP_POOL_SIZE)')
+        parser.add_argument('--batch-size', type=int, default=1000,
+            help='Transactions loaded and saved per batch')
+        parser.add_argument('--max-wait', type=float, default=0,
+            help='Seconds to keep checking running transactions when their eta is due')
+
+    def handle(self, *args, **options):
+        poller = Poller(
+            max_workers=options['workers'],
+            batch_size=options['batch_size'])
+        result = poller.run(max_wait=options['max_wait'])
+        self.stdout.write(
+            'checked: %d, completed: %d, pending: %d, errors: %d' % (
+                result.checked, result.completed, result.pending, result.errors))
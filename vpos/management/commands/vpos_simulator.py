@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+
+from vpos.simulator import Simulator
+
+
+class Command(BaseCommand):
+
+    help = 'Runs a local vPOS API simulator (set VPOS_BASE_URL to the printed url)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--eta', type=float, default=1.0,
+            help='Seconds until a transaction is completed')
+        parser.add_argument('--latency', type=float, default=0.0,
+            help='Seconds added to every response')
+        parser.add_argument('--reject-ratio', type=float, default=0.0,
+            help='Ratio (0-1) of transactions rejected at random')
+        parser.add_argument('--reject-code', type=int, default=2001,
+            help='Status reason code of rejected transactions')
+        parser.add_argument('--outcome', action='append', default=[],
+            metavar='MOBILE:CODE',
+            help='Status reason code for a mobile number, repeatable')
+
+    def handle(self, *args, **options):
+        outcomes: dict = {}
+        for outcome in options['outcome']:
+            mobile, _, code = outcome.partition(':')
+            outcomes[mobile] = int(code) if code else None
+        simulator = Simulator(
+            host=options['host'],
+            port=options['port'],
+            eta=options['eta'],
+            latency=options['latency'],
+            reject_ratio=options['reject_ratio'],
+            reject_code=options['reject_code'],
+            outcomes=outcomes)
+        self.stdout.write('vPOS simulator on http://%s:%d%s' % (
+            options['host'], options['port'], simulator.base_path))
+        try:
+            simulator.serve_forever()
+        except KeyboardInterrupt:
+            pass
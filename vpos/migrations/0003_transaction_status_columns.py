@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0002_alter_transaction_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='bank_fee',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='bank fee'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='completed_at',
+            field=models.DateTimeField(db_index=True, default=None, editable=False, null=True, verbose_name='completed at'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='status',
+            field=models.CharField(choices=[('accepted', 'Accepted'), ('rejected', 'Rejected')], default=None, editable=False, max_length=8, null=True, verbose_name='status'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='status_code',
+            field=models.PositiveIntegerField(default=None, editable=False, null=True, verbose_name='status reason code'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='vpos_fee',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='vpos fee'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['status', 'completed_at'], name='vpos_status_completed_idx'),
+        ),
+    ]
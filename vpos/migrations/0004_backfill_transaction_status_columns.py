@@ -0,0 +1,58 @@
+import decimal
+
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+CENTS = decimal.Decimal('0.01')
+
+
+def get_fee(data: dict, name: str) -> decimal.Decimal:
+    expense = (data.get(name) or {}).get('expense') or 0
+    return decimal.Decimal(str(expense)).quantize(
+        CENTS, rounding=decimal.ROUND_HALF_UP)
+
+
+def get_status_code(payment: dict):
+    try:
+        return int(payment['status_reason'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def backfill(apps, schema_editor):
+    """Copies status and fees from the data json into the new columns, in batches"""
+    Transaction = apps.get_model('vpos', 'Transaction')
+    fields = ['status', 'status_code', 'completed_at', 'vpos_fee', 'bank_fee']
+    last_pk = None
+    while True:
+        queryset = Transaction.objects.order_by('pk').only('pk', 'data', 'updated_at')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        batch = list(queryset[:BATCH_SIZE])
+        if not batch:
+            break
+        for transaction in batch:
+            data: dict = transaction.data or {}
+            if (payment := data.get('transaction')):
+                transaction.status = payment.get('status')
+                transaction.status_code = get_status_code(payment)
+                transaction.completed_at = transaction.updated_at
+            transaction.vpos_fee = get_fee(data, 'vpos_fee')
+            transaction.bank_fee = get_fee(data, 'bank_fee')
+        Transaction.objects.bulk_update(batch, fields)
+        last_pk = batch[-1].pk
+
+
+class Migration(migrations.Migration):
+
+    # each batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ('vpos', '0003_transaction_status_columns'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop),
+    ]
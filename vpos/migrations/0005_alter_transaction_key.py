@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0004_backfill_transaction_status_columns'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='transaction',
+            name='key',
+            field=models.CharField(default=None, editable=False, max_length=100, null=True, unique=True, verbose_name='location id'),
+        ),
+    ]
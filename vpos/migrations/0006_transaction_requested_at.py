@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0005_alter_transaction_key'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='requested_at',
+            field=models.DateTimeField(default=None, editable=False, null=True, verbose_name='requested at'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0006_transaction_requested_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['type', 'status'], name='vpos_type_status_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['mobile', '-created_at'], name='vpos_mobile_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('requested', True), ('status__isnull', True)), fields=['requested_at'], name='vpos_pending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('requested', False)), fields=['created_at'], name='vpos_unrequested_idx'),
+        ),
+    ]
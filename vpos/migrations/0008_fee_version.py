@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:50
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0007_transaction_access_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeVersion',
+            fields=[
+                ('id', models.CharField(editable=False, max_length=16, primary_key=True, serialize=False, verbose_name='id')),
+                ('vpos_fee', models.JSONField(default=None, editable=False, null=True, verbose_name='vpos fee')),
+                ('bank_fee', models.JSONField(default=None, editable=False, null=True, verbose_name='bank fee')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+            ],
+            options={
+                'verbose_name': 'Fee Version',
+                'verbose_name_plural': 'Fee Versions',
+            },
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='fee_version',
+            field=models.ForeignKey(db_constraint=False, default=None, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='transactions', to='vpos.feeversion', verbose_name='fee version'),
+        ),
+    ]
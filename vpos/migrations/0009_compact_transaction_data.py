@@ -0,0 +1,155 @@
+import re
+import json
+import decimal
+import hashlib
+
+from django.db import migrations
+
+
+# the helpers below are frozen copies of the code of this release
+# (vpos.fees, vpos.validators), later changes must not alter this migration
+
+BATCH_SIZE = 1000
+FEES = ('vpos_fee', 'bank_fee')
+CENTS = decimal.Decimal('0.01')
+PHONE_REGEX = re.compile(r'^(?:(\+244|00244))?(9)(1|2|3|4|9)([\d]{7,7})$')
+PHONE_REPLACE = r'\2\3\4'
+
+
+def get_fee(breakdown: dict):
+    if not breakdown or not breakdown.get('applied_fee'):
+        return None
+    return [
+        breakdown.get('applied_fee'),
+        breakdown.get('applied_min_amount'),
+        breakdown.get('applied_max_amount'),
+        breakdown.get('applied_plus_amount')]
+
+
+def get_version(fees: list):
+    fees = [
+        [None if value is None else str(decimal.Decimal(str(value)).normalize())
+            for value in list(fee[:3]) + [fee[3] or 0]] if fee else None
+        for fee in fees]
+    if not any(fees):
+        return None
+    return hashlib.sha256(json.dumps(fees).encode()).hexdigest()[:16]
+
+
+def get_breakdown(fee: list, amount, name: str):
+    """Fee details of an amount, as vpos.fees.FeeSchedule.breakdown"""
+    percent, min_amount, max_amount, plus = fee
+    percent = decimal.Decimal(str(percent or 0))
+    if not percent:
+        return None
+    amount = decimal.Decimal(str(amount)).quantize(CENTS, rounding=decimal.ROUND_HALF_UP)
+    fee_amount = amount * percent / 100 + decimal.Decimal(str(plus or 0))
+    if min_amount and fee_amount < decimal.Decimal(str(min_amount)):
+        expense = decimal.Decimal(str(min_amount))
+    elif max_amount and fee_amount > decimal.Decimal(str(max_amount)):
+        expense = decimal.Decimal(str(max_amount))
+    else:
+        expense = fee_amount
+    expense = expense.quantize(CENTS, rounding=decimal.ROUND_HALF_UP)
+    return {
+        'name': name,
+        'amount': float(amount),
+        'net_amount': float(amount - expense),
+        'expense': float(expense),
+        'fee_amount': round(float(fee_amount), 6),
+        'applied_plus_amount': plus or 0,
+        'applied_fee': float(percent),
+        'applied_min_amount': min_amount,
+        'applied_max_amount': max_amount}
+
+
+def clean_number(phone: str) -> str:
+    if (match := PHONE_REGEX.match(phone)):
+        return match.expand(PHONE_REPLACE)
+    return phone
+
+
+def get_payment_columns(transaction) -> dict:
+    return {
+        'type': transaction.type,
+        'mobile': clean_number(transaction.mobile),
+        'amount': str(transaction.amount)}
+
+
+def batches(Transaction):
+    last_pk = None
+    while True:
+        queryset = Transaction.objects.order_by('pk').only(
+            'pk', 'data', 'type', 'mobile', 'amount', 'fee_version')
+        if last_pk is not None:
+            queryset = queryset.filter(pk__gt=last_pk)
+        batch = list(queryset[:BATCH_SIZE])
+        if not batch:
+            break
+        yield batch
+        last_pk = batch[-1].pk
+
+
+def compact(apps, schema_editor):
+    """
+    Replaces the fee breakdowns of the data json by a fee version, and drops
+    the vPOS transaction values already stored in columns, in batches
+    """
+    Transaction = apps.get_model('vpos', 'Transaction')
+    FeeVersion = apps.get_model('vpos', 'FeeVersion')
+    versions: set = set()
+    for batch in batches(Transaction):
+        changed: list = []
+        for transaction in batch:
+            data: dict = transaction.data or {}
+            if not any(name in data for name in FEES) and not data.get('transaction'):
+                continue
+            fees = [get_fee(data.pop(name, None)) for name in FEES]
+            if (version := get_version(fees)) is not None:
+                if version not in versions:
+                    FeeVersion.objects.get_or_create(id=version, defaults={
+                        'vpos_fee': fees[0], 'bank_fee': fees[1]})
+                    versions.add(version)
+                transaction.fee_version_id = version
+            if (payment := data.get('transaction')):
+                columns = get_payment_columns(transaction)
+                data['transaction'] = {
+                    key: value for key, value in payment.items()
+                    if key not in columns or columns[key] != value}
+            transaction.data = data
+            changed.append(transaction)
+        Transaction.objects.bulk_update(changed, ['data', 'fee_version'])
+
+
+def expand(apps, schema_editor):
+    """Puts the fee breakdowns and the vPOS transaction values back in the data json"""
+    Transaction = apps.get_model('vpos', 'Transaction')
+    FeeVersion = apps.get_model('vpos', 'FeeVersion')
+    versions: dict = {
+        version.id: (version.vpos_fee, version.bank_fee)
+        for version in FeeVersion.objects.all()}
+    for batch in batches(Transaction):
+        for transaction in batch:
+            data: dict = transaction.data or {}
+            for name, fee in zip(FEES, versions.get(transaction.fee_version_id, ())):
+                if fee and (breakdown := get_breakdown(
+                        fee, transaction.amount, name.replace('_', ' '))):
+                    data[name] = breakdown
+            if (payment := data.get('transaction')) is not None:
+                data['transaction'] = {**get_payment_columns(transaction), **payment}
+            transaction.data = data
+        Transaction.objects.bulk_update(batch, ['data'])
+
+
+class Migration(migrations.Migration):
+
+    # each batch is committed on its own
+    atomic = False
+
+    dependencies = [
+        ('vpos', '0008_fee_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(compact, expand),
+    ]
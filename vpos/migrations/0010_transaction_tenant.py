@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0009_compact_transaction_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='tenant',
+            field=models.CharField(default=None, editable=False, max_length=50, null=True, verbose_name='tenant'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-18 01:55
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0010_transaction_tenant'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OutboxEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('polling', models.BooleanField(default=False, editable=False, verbose_name='polling')),
+                ('attempts', models.PositiveIntegerField(default=0, editable=False, verbose_name='attempts')),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='available at')),
+                ('failed', models.BooleanField(default=False, editable=False, verbose_name='failed')),
+                ('last_error', models.TextField(blank=True, default='', editable=False, verbose_name='last error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('transaction', models.OneToOneField(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='outbox_entry', to='vpos.transaction', verbose_name='transaction')),
+            ],
+            options={
+                'verbose_name': 'Outbox Entry',
+                'verbose_name_plural': 'Outbox Entries',
+                'indexes': [models.Index(condition=models.Q(('failed', False)), fields=['available_at'], name='vpos_outbox_available_idx')],
+            },
+        ),
+    ]
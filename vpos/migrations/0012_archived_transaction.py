@@ -0,0 +1,41 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0011_outbox_entry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransaction',
+            fields=[
+                ('id', models.UUIDField(editable=False, primary_key=True, serialize=False, verbose_name='id')),
+                ('key', models.CharField(db_index=True, default=None, editable=False, max_length=100, null=True, verbose_name='location id')),
+                ('amount', models.DecimalField(decimal_places=2, editable=False, max_digits=12, verbose_name='amount')),
+                ('mobile', models.CharField(editable=False, max_length=15, verbose_name='mobile number')),
+                ('type', models.CharField(choices=[('payment', 'Payment'), ('refund', 'Refund')], editable=False, max_length=7, verbose_name='type')),
+                ('tenant', models.CharField(default=None, editable=False, max_length=50, null=True, verbose_name='tenant')),
+                ('data', models.JSONField(default=dict, editable=False, verbose_name='additional data')),
+                ('status', models.CharField(choices=[('accepted', 'Accepted'), ('rejected', 'Rejected')], default=None, editable=False, max_length=8, null=True, verbose_name='status')),
+                ('status_code', models.PositiveIntegerField(default=None, editable=False, null=True, verbose_name='status reason code')),
+                ('vpos_fee', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='vpos fee')),
+                ('bank_fee', models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=12, verbose_name='bank fee')),
+                ('created_at', models.DateTimeField(db_index=True, editable=False, verbose_name='created at')),
+                ('requested_at', models.DateTimeField(default=None, editable=False, null=True, verbose_name='requested at')),
+                ('completed_at', models.DateTimeField(default=None, editable=False, null=True, verbose_name='completed at')),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='archived at')),
+                ('fee_version', models.ForeignKey(db_constraint=False, default=None, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='archived_transactions', to='vpos.feeversion', verbose_name='fee version')),
+                ('parent', models.ForeignKey(db_constraint=False, default=None, editable=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='+', to='vpos.archivedtransaction', verbose_name='parent transaction')),
+            ],
+            options={
+                'verbose_name': 'Archived Transaction',
+                'verbose_name_plural': 'Archived Transactions',
+                'indexes': [models.Index(fields=['mobile', '-created_at'], name='vpos_archived_mobile_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 02:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('vpos', '0012_archived_transaction'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='requesting_until',
+            field=models.DateTimeField(default=None, editable=False, null=True, verbose_name='requesting until'),
+        ),
+    ]
@@ -1 +1,4 @@
-from .transaction import Transaction
\ No newline at end of file
+from .fee import FeeVersion
+from .transaction import Transaction
+from .outbox import OutboxEntry
+from .archive import ArchivedTransaction
\ No newline at end of file
@@ -0,0 +1,134 @@
+from typing import Union
+
+from django.db import models
+from django.utils.functional import cached_property
+from django.utils.translation import gettext_lazy as _
+
+from vpos.configs import VPOS_STATUS_REASON
+from vpos.fees import get_version_schedules
+from vpos.models.fee import FeeVersion
+from vpos.models.transaction import TransactionStatus, TransactionType
+
+
+class ArchivedTransaction(models.Model):
+
+    """
+    Completed transaction moved out of the Transaction table (see vpos.archive),
+    read only. Refunds are archived with their parent, so parent and refund
+    are always both in this table.
+    On PostgreSQL the table can be partitioned by month of created_at
+    (see vpos.archive.partition_table), its primary key is then (id, created_at)
+    """
+
+    class Meta:
+        verbose_name = _('Archived Transaction')
+        verbose_name_plural = _('Archived Transactions')
+        indexes = [
+            models.Index(
+                fields=['mobile', '-created_at'],
+                name='vpos_archived_mobile_idx')]
+
+    Type = TransactionType
+    Status = TransactionStatus
+
+    # columns copied from Transaction
+    FIELDS: tuple = (
+        'id',
+        'key',
+        'amount',
+        'mobile',
+        'type',
+        'tenant',
+        'data',
+        'status',
+        'status_code',
+        'vpos_fee',
+        'bank_fee',
+        'fee_version_id',
+        'parent_id',
+        'created_at',
+        'requested_at',
+        'completed_at')
+
+    # no unique key, unique indexes of partitioned tables must include created_at
+    id = models.UUIDField(_('id'), primary_key=True, editable=False)
+    key = models.CharField(_('location id'),
+        max_length=100, null=True, default=None, db_index=True, editable=False)
+    amount = models.DecimalField(_('amount'),
+        max_digits=12, decimal_places=2, editable=False)
+    mobile = models.CharField(_('mobile number'), max_length=15, editable=False)
+    type = models.CharField(_('type'),
+        max_length=7, choices=Type.choices, editable=False)
+    tenant = models.CharField(_('tenant'),
+        max_length=50, null=True, default=None, editable=False)
+    data = models.JSONField(_('additional data'), default=dict, editable=False)
+    status = models.CharField(_('status'),
+        max_length=8, choices=Status.choices, null=True, default=None, editable=False)
+    status_code = models.PositiveIntegerField(_('status reason code'),
+        null=True, default=None, editable=False)
+    vpos_fee = models.DecimalField(_('vpos fee'),
+        max_digits=12, decimal_places=2, default=0, editable=False)
+    bank_fee = models.DecimalField(_('bank fee'),
+        max_digits=12, decimal_places=2, default=0, editable=False)
+    fee_version = models.ForeignKey(
+        FeeVersion,
+        on_delete=models.DO_NOTHING,
+        verbose_name=_('fee version'),
+        related_name='archived_transactions',
+        db_constraint=False,
+        null=True,
+        default=None,
+        editable=False)
+    # a refund and its parent are archived together, no constraint
+    # nor unique index, not allowed on partitioned tables (see refund)
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.DO_NOTHING,
+        verbose_name=(_('parent transaction')),
+        related_name='+',
+        db_constraint=False,
+        null=True,
+        default=None,
+        editable=False)
+
+    created_at = models.DateTimeField(_('created at'), db_index=True, editable=False)
+    requested_at = models.DateTimeField(_('requested at'),
+        null=True, default=None, editable=False)
+    completed_at = models.DateTimeField(_('completed at'),
+        null=True, default=None, editable=False)
+    archived_at = models.DateTimeField(_('archived at'), auto_now_add=True)
+
+    @cached_property
+    def refund(self) -> Union['ArchivedTransaction', None]:
+        """Archived refund of this payment, like Transaction.refund"""
+        return ArchivedTransaction.objects.filter(parent_id=self.pk).first()
+
+    @property
+    def bank_fee_data(self) -> dict:
+        if 'bank_fee' in self.data:
+            return self.data['bank_fee']
+        return get_version_schedules(self.fee_version_id)[1].breakdown(self.amount) or {}
+
+    @property
+    def vpos_fee_data(self) -> dict:
+        if 'vpos_fee' in self.data:
+            return self.data['vpos_fee']
+        return get_version_schedules(self.fee_version_id)[0].breakdown(self.amount) or {}
+
+    @property
+    def net_amount(self):
+        return self.amount - self.vpos_fee - self.bank_fee
+
+    @property
+    def status_reason(self) -> Union[str, None]:
+        if (code := self.status_code):
+            return VPOS_STATUS_REASON.get(str(code))
+        return None
+
+    @property
+    def is_payment(self) -> bool:
+        return self.type == self.Type.PAYMENT
+
+    @property
+    def is_refund(self) -> bool:
+        return self.type == self.Type.REFUND
@@ -0,0 +1,20 @@
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+
+class FeeVersion(models.Model):
+
+    """
+    VPOS_FEE and BANK_FEE settings transactions were created with,
+    the id is vpos.fees.get_version of both fee tuples
+    """
+
+    class Meta:
+        verbose_name = _('Fee Version')
+        verbose_name_plural = _('Fee Versions')
+
+    id = models.CharField(_('id'),
+        primary_key=True, max_length=16, editable=False)
+    vpos_fee = models.JSONField(_('vpos fee'), null=True, default=None, editable=False)
+    bank_fee = models.JSONField(_('bank fee'), null=True, default=None, editable=False)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
@@ -0,0 +1,35 @@
+from django.db import models
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+
+
+class OutboxEntry(models.Model):
+
+    """
+    vPOS request of a transaction waiting to be sent by the
+    outbox dispatcher (see OUTBOX and vpos.outbox), deleted once sent
+    """
+
+    class Meta:
+        verbose_name = _('Outbox Entry')
+        verbose_name_plural = _('Outbox Entries')
+        indexes = [
+            models.Index(
+                fields=['available_at'],
+                condition=models.Q(failed=False),
+                name='vpos_outbox_available_idx')]
+
+    id = models.BigAutoField(primary_key=True)
+    transaction = models.OneToOneField(
+        'vpos.Transaction',
+        on_delete=models.CASCADE,
+        verbose_name=_('transaction'),
+        related_name='outbox_entry',
+        editable=False)
+    polling = models.BooleanField(_('polling'), default=False, editable=False)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0, editable=False)
+    # claimed entries are hidden until the claim expires
+    available_at = models.DateTimeField(_('available at'), default=timezone.now, editable=False)
+    failed = models.BooleanField(_('failed'), default=False, editable=False)
+    last_error = models.TextField(_('last error'), blank=True, default='', editable=False)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
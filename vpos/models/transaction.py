@@ -1,15 +1,31 @@
 import uuid
 import decimal
-from typing import Union
+from typing import Union, Iterable, Tuple, List
 
-from django.db import models
+from asgiref.sync import sync_to_async
+from django.db import models, DatabaseError
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext_lazy as _
 from django.core.exceptions import ValidationError
 
-from vpos.utils import get_calculated_fees
+from vpos import cache, leases
+from vpos.bulk import BulkResult, submit_requests
+from vpos.fees import (
+    from_cents,
+    to_cents,
+    get_bank_fee_schedule,
+    get_current_version,
+    get_version_schedules,
+    get_vpos_fee_schedule)
+from vpos.models.fee import FeeVersion
+from vpos.models.outbox import OutboxEntry
 from vpos.validators import PhoneValidator
-from vpos.signals import transaction_completed
-from vpos.api import VposAPI
+from vpos.dispatch import adispatch_completed, dispatch_completed
+from vpos.waiting import TransactionWaiter, notify
+from vpos.instrumentation import get_instrument
+from vpos.api import VposAPI, AsyncVposAPI
 from vpos.configs import (
     VPOS_STATUS_REASON,
     conf)
@@ -20,7 +36,45 @@ class TransactionType(models.TextChoices):
     REFUND = 'refund', ('Refund')
 
 
-class Manager(models.Manager):
+class TransactionStatus(models.TextChoices):
+    ACCEPTED = 'accepted', _('Accepted')
+    REJECTED = 'rejected', _('Rejected')
+
+
+class TransactionQuerySet(models.QuerySet):
+
+    """Chainable filters of the common access patterns, each one backed by an index"""
+
+    def payments(self):
+        return self.filter(type=TransactionType.PAYMENT)
+
+    def refunds(self):
+        return self.filter(type=TransactionType.REFUND)
+
+    def for_mobile(self, mobile: str):
+        """Transactions of a mobile number, newest first"""
+        return self.filter(mobile=mobile).order_by('-created_at')
+
+    def unrequested(self):
+        """Transactions never requested to vPOS"""
+        return self.filter(requested=False)
+
+    def pending(self):
+        """Requested transactions not yet accepted or rejected"""
+        return self.filter(requested=True, status__isnull=True)
+
+    def accepted(self):
+        return self.filter(status=TransactionStatus.ACCEPTED)
+
+    def rejected(self):
+        return self.filter(status=TransactionStatus.REJECTED)
+
+    def refundable(self):
+        """Accepted payments without a refund"""
+        return self.payments().accepted().filter(refund__isnull=True)
+
+
+class Manager(models.Manager.from_queryset(TransactionQuerySet)):
     
     def create_refund(self, parent):
         """Creates a new Refund Transaction"""
@@ -28,56 +82,267 @@ class Manager(models.Manager):
             parent=parent,
             type=TransactionType.REFUND,
             mobile=parent.mobile,
-            amount=parent.amount)
-        if conf.MODE == 'production':
+            amount=parent.amount,
+            tenant=parent.tenant)
+        if conf.get_tenant(parent.tenant).values['MODE'] == 'production':
             transaction.full_clean()
             if parent.rejected or parent.is_refund:
                 raise ValidationError(
                     _("'parent' must be an accepted payment transaction"))
-        transaction.save()
+        self.__save(transaction)
+        cache.set_refunded(transaction)
         return transaction
     
-    def create_payment(self, mobile: str, amount: str):
-        """Creates a new Refund Transaction"""
-        
-        data: dict = {}
+    def create_payment(self, mobile: str, amount: str, tenant: str = None):
+        """Creates a new Payment Transaction, of a tenant (see TENANTS) if given"""
 
         transaction = self.model(
             type=TransactionType.PAYMENT,
             mobile=mobile,
             amount=amount,
-            parent=None)
+            parent=None,
+            tenant=tenant or None)
         
-        if conf.VPOS_FEE:
-            data['vpos_fee'] = get_calculated_fees(
-                float(transaction.amount), conf.VPOS_FEE, name='vpos fee')
-        
-        if conf.BANK_FEE:
-            data['bank_fee'] = get_calculated_fees(
-                float(transaction.amount), conf.BANK_FEE, name='bank fee')
+        self.__set_fees(transaction)
 
-        if conf.MODE == 'production':
+        if conf.get_tenant(tenant).values['MODE'] == 'production':
             transaction.full_clean()
 
-        transaction.data = data
-        transaction.save()
+        self.__save(transaction)
         return transaction
 
+    def __save(self, transaction: 'Transaction') -> None:
+        """Saves a new transaction, with OUTBOX its request is enqueued in the same DB transaction"""
+        if not conf.OUTBOX:
+            transaction.save()
+            return
+        with db_transaction.atomic(using=self.db):
+            transaction.save()
+            OutboxEntry.objects.using(self.db).create(transaction=transaction)
+
+    def bulk_create_payments(self,
+            items: Iterable[Union[dict, tuple]],
+            batch_size: int = 500,
+            request: bool = False,
+            polling: bool = False,
+            max_workers: int = None,
+            tenant: str = None) -> List[BulkResult]:
+        """
+        Creates many Payment Transactions (of a tenant if given) with bulk inserts.
+        Expects {'mobile': ..., 'amount': ...} dicts or (mobile, amount) tuples.
+        Fields are validated without per row queries, fees are computed once per
+        distinct amount and, if request is True, payments are requested to vPOS
+        concurrently (with OUTBOX, requests are always enqueued instead).
+        Returns one BulkResult per item, in the same order, failed
+        items have an error instead of aborting the batch
+        """
+        results: list = []
+        fees: dict = {}
+        items = [
+            (item.get('mobile'), item.get('amount')) if isinstance(item, dict) else item
+            for item in items]
+        validate: bool = conf.get_tenant(tenant).values['MODE'] == 'production'
+        if validate:
+            valid_mobiles = PhoneValidator.clean_numbers(
+                [mobile for mobile, _amount in items])
+        for index, (mobile, amount) in enumerate(items):
+            result = BulkResult(index)
+            results.append(result)
+            if validate and valid_mobiles[index] is None:
+                result.error = ValidationError(
+                    {'mobile': [PhoneValidator.message]})
+                continue
+            transaction = self.model(
+                type=TransactionType.PAYMENT,
+                mobile=mobile,
+                amount=amount,
+                parent=None,
+                tenant=tenant or None)
+            try:
+                if validate:
+                    self.__clean_fields(transaction, exclude=['mobile'])
+                if transaction.amount not in fees:
+                    fees[transaction.amount] = self.__get_fees(transaction.amount, tenant)
+                transaction.fee_version_id, transaction.vpos_fee, transaction.bank_fee = (
+                    fees[transaction.amount])
+            except (ValidationError, decimal.InvalidOperation, TypeError, ValueError) as e:
+                result.error = e
+                continue
+            result.transaction = transaction
+        return self.__bulk_insert(results, batch_size, request, polling, max_workers)
+
+    def bulk_create_refunds(self,
+            parents: Iterable['Transaction'],
+            batch_size: int = 500,
+            request: bool = False,
+            polling: bool = False,
+            max_workers: int = None) -> List[BulkResult]:
+        """
+        Creates many Refund Transactions with bulk inserts,
+        see bulk_create_payments. Parents already refunded are reported as failed
+        """
+        results: list = []
+        parents = list(parents)
+        refunded: set = set(self.filter(
+            parent__in=[parent.pk for parent in parents]
+        ).values_list('parent_id', flat=True))
+        for index, parent in enumerate(parents):
+            result = BulkResult(index)
+            results.append(result)
+            if parent.pk in refunded:
+                result.error = ValidationError(
+                    _("'parent' transaction was already refunded"))
+                continue
+            if (conf.get_tenant(parent.tenant).values['MODE'] == 'production'
+                    and (parent.rejected or parent.is_refund)):
+                result.error = ValidationError(
+                    _("'parent' must be an accepted payment transaction"))
+                continue
+            refunded.add(parent.pk)
+            result.transaction = self.model(
+                parent=parent,
+                type=TransactionType.REFUND,
+                mobile=parent.mobile,
+                amount=parent.amount,
+                tenant=parent.tenant)
+        results = self.__bulk_insert(results, batch_size, request, polling, max_workers)
+        cache.set_refunded(*[r.transaction for r in results if r.transaction is not None])
+        return results
+
+    def __bulk_insert(self,
+            results: List[BulkResult],
+            batch_size: int,
+            request: bool,
+            polling: bool,
+            max_workers: int) -> List[BulkResult]:
+        valid: list = [r for r in results if r.ok]
+        for i in range(0, len(valid), batch_size):
+            chunk = valid[i:i + batch_size]
+            try:
+                self.__insert_chunk(chunk, polling)
+            except DatabaseError:
+                # inserted row by row, only the offending items fail
+                for result in chunk:
+                    try:
+                        self.__insert_chunk([result], polling)
+                    except DatabaseError as e:
+                        result.transaction, result.error = None, e
+        if request and not conf.OUTBOX:
+            submit_requests(
+                [r for r in valid if r.ok], polling=polling,
+                max_workers=max_workers)
+        return results
+
+    def __insert_chunk(self, chunk: List[BulkResult], polling: bool) -> None:
+        with db_transaction.atomic(using=self.db):
+            self.bulk_create([r.transaction for r in chunk])
+            if conf.OUTBOX:
+                OutboxEntry.objects.using(self.db).bulk_create(
+                    OutboxEntry(transaction=r.transaction, polling=polling)
+                    for r in chunk)
+
+    def __set_fees(self, transaction: 'Transaction') -> None:
+        transaction.fee_version_id, transaction.vpos_fee, transaction.bank_fee = (
+            self.__get_fees(transaction.amount, transaction.tenant))
+
+    @staticmethod
+    def __get_fees(amount, tenant: str = None) -> Tuple[Union[str, None], decimal.Decimal, decimal.Decimal]:
+        """
+        Returns the fee version and the vpos and bank fee expenses for an amount of a tenant,
+        fee breakdowns are not stored (see Transaction.vpos_fee_data)
+        """
+        cents: int = to_cents(amount)
+        return (
+            get_current_version(tenant),
+            from_cents(get_vpos_fee_schedule(tenant).expense_cents(cents)),
+            from_cents(get_bank_fee_schedule(tenant).expense_cents(cents)))
+
+    @staticmethod
+    def __clean_fields(transaction: 'Transaction', exclude: list = None) -> None:
+        """full_clean without validate_unique, that runs a query per row"""
+        transaction.clean_fields(exclude=exclude)
+        transaction.clean()
+
+    def confirm_many(self, items: Iterable[Tuple['Transaction', dict]],
+            batch_size: int = None, source: str = 'polling') -> List['Transaction']:
+        """
+        Confirms many transactions with a single bulk update.
+        Expects (transaction, transaction data) pairs,
+        returns the transactions that were confirmed
+        """
+        items: dict = {
+            transaction.pk: (transaction, data)
+            for transaction, data in items if not transaction.payment}
+        completed: list = []
+        now = timezone.now()
+        with db_transaction.atomic(using=self.db):
+            # rows confirmed meanwhile by the webhook are left untouched
+            for pk in self.select_for_update().filter(
+                    pk__in=list(items), completed_at__isnull=True
+                    ).values_list('pk', flat=True):
+                transaction, data = items[pk]
+                transaction.set_payment(data, completed_at=now)
+                transaction.updated_at = now
+                completed.append(transaction)
+            self.bulk_update(completed, self.model.PAYMENT_FIELDS + ['updated_at'],
+                batch_size=batch_size)
+            cache.set_completed(*completed)
+            # waiters wake up once the rows are visible to them
+            pks: list = [transaction.pk for transaction in completed]
+            db_transaction.on_commit(lambda: notify(*pks), using=self.db)
+        for transaction in completed:
+            transaction.record_confirmation(source)
+            dispatch_completed(transaction)
+        return completed
+
+    async def acreate_refund(self, parent):
+        """Asyncio version of create_refund"""
+        return await sync_to_async(self.create_refund)(parent)
+
+    async def acreate_payment(self, mobile: str, amount: str, tenant: str = None):
+        """Asyncio version of create_payment"""
+        return await sync_to_async(self.create_payment)(mobile, amount, tenant)
+
 
 class Transaction(models.Model):
 
     class Meta:
         verbose_name = _('Transaction')
         verbose_name_plural = _('Transactions')
+        indexes = [
+            models.Index(
+                fields=['status', 'completed_at'],
+                name='vpos_status_completed_idx'),
+            models.Index(
+                fields=['type', 'status'],
+                name='vpos_type_status_idx'),
+            models.Index(
+                fields=['mobile', '-created_at'],
+                name='vpos_mobile_created_idx'),
+            # partial indexes (PostgreSQL, SQLite) only hold the few rows
+            # the poller and the request jobs look for
+            models.Index(
+                fields=['requested_at'],
+                condition=models.Q(requested=True, status__isnull=True),
+                name='vpos_pending_idx'),
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(requested=False),
+                name='vpos_unrequested_idx')]
     
     Type = TransactionType
+    Status = TransactionStatus
     objects = Manager()
-    api: VposAPI
+
+    # fields derived from the vPOS transaction data (see set_payment)
+    PAYMENT_FIELDS: list = ['data', 'status', 'status_code', 'completed_at']
+    # fields set when requested to vPOS (see set_location)
+    REQUEST_FIELDS: list = ['key', 'data', 'requested', 'requested_at']
 
     id = models.UUIDField(_('id'),
         primary_key=True, default=uuid.uuid4, editable=False)
     key = models.CharField(_('location id'),
-        max_length=100, null=True, default=None, editable=False)
+        max_length=100, null=True, default=None, unique=True, editable=False)
     amount = models.DecimalField(_('amount'),
         max_digits=12, decimal_places=2, editable=False)
     mobile = models.CharField(_('mobile number'),
@@ -85,7 +350,28 @@ class Transaction(models.Model):
     type = models.CharField(_('type'),
         max_length=7, choices=Type.choices, editable=False)
     requested = models.BooleanField(_('was requested'), default=False, editable=False)
+    # key of the TENANTS setting, None for the default POS
+    tenant = models.CharField(_('tenant'),
+        max_length=50, null=True, default=None, editable=False)
     data = models.JSONField(_('additional data'), default=dict, editable=False)
+    status = models.CharField(_('status'),
+        max_length=8, choices=Status.choices, null=True, default=None, editable=False)
+    status_code = models.PositiveIntegerField(_('status reason code'),
+        null=True, default=None, editable=False)
+    vpos_fee = models.DecimalField(_('vpos fee'),
+        max_digits=12, decimal_places=2, default=0, editable=False)
+    bank_fee = models.DecimalField(_('bank fee'),
+        max_digits=12, decimal_places=2, default=0, editable=False)
+    # no constraint, fee versions are only ever added
+    fee_version = models.ForeignKey(
+        FeeVersion,
+        on_delete=models.DO_NOTHING,
+        verbose_name=_('fee version'),
+        related_name='transactions',
+        db_constraint=False,
+        null=True,
+        default=None,
+        editable=False)
     parent = models.OneToOneField(
         'self',
         on_delete=models.CASCADE,
@@ -98,38 +384,49 @@ class Transaction(models.Model):
     
     created_at = models.DateTimeField(_('created at'), auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    requested_at = models.DateTimeField(_('requested at'),
+        null=True, default=None, editable=False)
+    completed_at = models.DateTimeField(_('completed at'),
+        null=True, default=None, db_index=True, editable=False)
+    # lease of the request to vPOS, without LEASE_CACHE (see vpos.leases.RowLease)
+    requesting_until = models.DateTimeField(_('requesting until'),
+        null=True, default=None, editable=False)
 
-    def __init__(self, *args, **kwargs) -> None:
-        super().__init__(*args, **kwargs)
-        self.api = VposAPI(
-            idempotency_key=self.idempotency_key)
+    @cached_property
+    def api(self) -> VposAPI:
+        """
+        vPOS API client for this transaction,
+        built on first use and not for every loaded row
+        """
+        return VposAPI(
+            idempotency_key=self.idempotency_key, tenant=self.tenant)
+
+    @property
+    def aapi(self) -> AsyncVposAPI:
+        """Asyncio vPOS API client for this transaction"""
+        return AsyncVposAPI(
+            idempotency_key=self.idempotency_key, tenant=self.tenant)
 
     # -------------------------------------------------------------------------------------------
     # fees
 
     @property
-    def bank_fee_data(self):
-        return self.data.get('bank_fee', {})
-    
-    @property
-    def vpos_fee_data(self):
-        return self.data.get('vpos_fee', {})
+    def bank_fee_data(self) -> dict:
+        """Bank fee breakdown, computed from the fee version"""
+        if 'bank_fee' in self.data:
+            return self.data['bank_fee']
+        return get_version_schedules(self.fee_version_id)[1].breakdown(self.amount) or {}
     
     @property
-    def vpos_fee(self):
-        if (fee := self.data.get('vpos_fee')):
-            return fee.get('expense', 0)
-        return 0
+    def vpos_fee_data(self) -> dict:
+        """vPOS fee breakdown, computed from the fee version"""
+        if 'vpos_fee' in self.data:
+            return self.data['vpos_fee']
+        return get_version_schedules(self.fee_version_id)[0].breakdown(self.amount) or {}
     
     @property
-    def bank_fee(self):
-        if (fee := self.data.get('bank_fee')):
-            return fee.get('expense', 0)
-        return 0
-    
-    @property
-    def fees_expense(self):
-        return decimal.Decimal('%.2f' % (self.vpos_fee + self.bank_fee))
+    def fees_expense(self) -> decimal.Decimal:
+        return self.vpos_fee + self.bank_fee
     
     @property
     def net_amount(self):
@@ -141,21 +438,16 @@ class Transaction(models.Model):
     @property
     def payment(self) -> Union[dict, None]:
         """Transaction Data from vPOS"""
-        return self.data.get('transaction')
-    
-    @property
-    def status(self) -> Union[str, None]:
-        """Transaction Status from vPOS (accepted or rejected)"""
-        if (payment := self.payment):
-            return payment.get('status')
-        return None
-    
-    @property
-    def status_code(self) -> Union[int, None]:
-        """vPOS Transaction Status Reason Code"""
-        if (payment := self.payment):
-            return payment.get('status_reason')
-        return None
+        if (payment := self.data.get('transaction')) is None:
+            return None
+        return {**self.__get_payment_columns(), **payment}
+
+    def __get_payment_columns(self) -> dict:
+        # values of the vPOS transaction data already stored in columns
+        return {
+            'type': str(self.type),
+            'mobile': PhoneValidator.clean_number(self.mobile),
+            'amount': str(self.amount)}
     
     @property
     def status_reason(self) -> Union[str, None]:
@@ -166,11 +458,11 @@ class Transaction(models.Model):
     
     @property
     def accepted(self) -> bool:
-        return self.status == 'accepted'
+        return self.status == self.Status.ACCEPTED
     
     @property
     def rejected(self) -> bool:
-        return self.status == 'rejected'
+        return self.status == self.Status.REJECTED
     
     @property
     def is_payment(self) -> bool:
@@ -189,62 +481,293 @@ class Transaction(models.Model):
         """location string provided by vPOS api header"""
         return self.data.get('location', '')
 
+    def set_payment(self, data: dict, completed_at=None) -> None:
+        """
+        Sets the vPOS transaction data and the fields derived from it, without saving.
+        Values already stored in columns are left out of data (see payment)
+        """
+        columns: dict = self.__get_payment_columns()
+        self.data.update({'transaction': {
+            key: value for key, value in data.items()
+            if key not in columns or columns[key] != value}})
+        self.status = data.get('status')
+        try:
+            self.status_code = int(data['status_reason'])
+        except (KeyError, TypeError, ValueError):
+            self.status_code = None
+        self.completed_at = completed_at or timezone.now()
+
     def confirm(self, transaction_data: dict) -> bool:
         """Confirms transaction"""
         if not self.payment:
-            self.__set_transaction_data(
-                data=transaction_data)
-            return True
+            return self.__set_transaction_data(
+                data=transaction_data, source='callback')
         return False
     
+    async def aconfirm(self, transaction_data: dict) -> bool:
+        """Asyncio version of confirm"""
+        if not self.payment:
+            return await self.__aset_transaction_data(
+                data=transaction_data, source='callback')
+        return False
+
     def check_payment(self, wait: bool = False) -> Union[dict, None]:
         """
         Checks transaction status from vPOS API,
         return transaction data if transaction accepted/rejected
-        else returns None
+        else returns None.
+        Concurrent checks of the same transaction make a single call to vPOS
         """
         if not self.payment:
-            if (transaction := self.api.check(self.key, wait=wait)):
-                self.__set_transaction_data(
-                    data=transaction)
-                return transaction
-            return None
+            _payment, leader = leases.flight.do(
+                'check:%s:%d' % (self.pk, wait), lambda: self.__check(wait))
+            if not leader:
+                self.refresh_from_db(fields=self.PAYMENT_FIELDS)
         return self.payment
 
     def request(self, polling: bool = False) -> bool:
-        """Request Payment or Refund"""
+        """
+        Request Payment or Refund.
+        Concurrent requests of the same transaction, in this process or in
+        others, make a single call to vPOS: the other callers wait for it and
+        return whether it requested the transaction, or get its error in this
+        process. Returns False if already requested. With OUTBOX, see enqueue_request
+        """
+        if conf.OUTBOX:
+            return self.enqueue_request(polling)
         if not self.requested:
-            if self.type == self.Type.REFUND:
-                location = self.api.create(
-                    type=str(self.Type.REFUND),
-                    polling=polling,
-                    parent_id=self.parent.key)
-            else:
-                location = self.api.create(
-                    type=str(self.Type.PAYMENT),
-                    mobile=PhoneValidator.clean_number(self.mobile),
-                    amount=str(self.amount),
-                    polling=polling)
-            assert location is not None
-            self.__set_key(location)
-            return True
+            requested, leader = leases.flight.do(
+                'request:%s' % self.pk, lambda: self.__request(polling))
+            if not leader:
+                self.refresh_from_db(fields=self.REQUEST_FIELDS)
+                return self.requested
+            return requested
         return False
+
+    def enqueue_request(self, polling: bool = False) -> bool:
+        """
+        Leaves the request to the outbox dispatcher (see vpos.outbox).
+        The entry saved by create_payment / create_refund gets the polling flag
+        while not claimed by a dispatcher. Returns False if already requested or claimed
+        """
+        if self.requested:
+            return False
+        _entry, created = OutboxEntry.objects.get_or_create(
+            transaction=self, defaults={'polling': polling})
+        if created:
+            return True
+        return OutboxEntry.objects.filter(
+            transaction=self, attempts=0, failed=False).update(polling=polling) > 0
+
+    def get_request_data(self, polling: bool = False) -> dict:
+        """Named args of VposAPI.create to request this transaction"""
+        if self.type == self.Type.REFUND:
+            return {
+                'type': str(self.Type.REFUND),
+                'polling': polling,
+                'parent_id': self.parent.key}
+        return {
+            'type': str(self.Type.PAYMENT),
+            'mobile': PhoneValidator.clean_number(self.mobile),
+            'amount': str(self.amount),
+            'polling': polling}
+
+    def set_location(self, location: str) -> None:
+        """Sets the location returned by vPOS and marks as requested, without saving"""
+        self.key = location.split('/')[-1]
+        self.data.update({'location': location})
+        self.requested = True
+        self.requested_at = timezone.now()
+
+    def save_location(self, location: str) -> bool:
+        """
+        Sets the location and saves it with a conditional update, right when vPOS
+        answers, so the webhook finds the key. Returns False if a key was already saved
+        """
+        self.set_location(location)
+        self.updated_at = timezone.now()
+        fields: list = self.REQUEST_FIELDS + ['updated_at']
+        if not type(self).objects.filter(pk=self.pk, key__isnull=True).update(
+                **{field: getattr(self, field) for field in fields}):
+            self.refresh_from_db(fields=fields)
+            return False
+        return True
     
+    async def acheck_payment(self, wait: bool = False) -> Union[dict, None]:
+        """
+        Asyncio version of check_payment,
+        waiting for the vPOS eta does not block the event loop
+        """
+        if not self.payment:
+            _payment, leader = await leases.flight.ado(
+                'check:%s:%d' % (self.pk, wait), lambda: self.__acheck(wait))
+            if not leader:
+                await sync_to_async(self.refresh_from_db)(fields=self.PAYMENT_FIELDS)
+        return self.payment
+
+    async def arequest(self, polling: bool = False) -> bool:
+        """Asyncio version of request"""
+        if conf.OUTBOX:
+            return await sync_to_async(self.enqueue_request)(polling)
+        if not self.requested:
+            requested, leader = await leases.flight.ado(
+                'request:%s' % self.pk, lambda: self.__arequest(polling))
+            if not leader:
+                await sync_to_async(self.refresh_from_db)(fields=self.REQUEST_FIELDS)
+                return self.requested
+            return requested
+        return False
+
+    # -------------------------------------------------------------------------------------------
+    # deduplication of vPOS calls (see vpos.leases)
+    # requests are serialized by a lease in the LEASE_CACHE, else in the row (requesting_until),
+    # no DB transaction nor lock is held during the call.
+    # Without LEASE_CACHE, checks are only deduplicated inside the process
+
+    def __request(self, polling: bool) -> bool:
+        requested = type(self).objects.filter(pk=self.pk, requested=True)
+        lease = leases.get_request_lease(self)
+        if not lease.acquire():
+            # already requested, or being requested by another process: wait for its call
+            waited: bool = not requested.exists()
+            if waited:
+                lease.wait(requested.exists)
+            self.refresh_from_db(fields=self.REQUEST_FIELDS)
+            return waited and self.requested
+        try:
+            # requested before the lease was taken
+            if requested.exists():
+                self.refresh_from_db(fields=self.REQUEST_FIELDS)
+                return False
+            self.__create(polling)
+        finally:
+            lease.release()
+        return True
+
+    def __create(self, polling: bool) -> None:
+        location = self.api.create(
+            **self.get_request_data(polling=polling))
+        assert location is not None
+        self.__set_key(location)
+
+    def __check(self, wait: bool) -> Union[dict, None]:
+        lease = leases.get_lease('check:%s' % self.pk, self.__get_check_timeout(wait))
+        if lease is not None and not lease.acquire():
+            # another process is checking, use its result
+            if wait:
+                lease.wait(type(self).objects.filter(
+                    pk=self.pk, completed_at__isnull=False).exists)
+            self.refresh_from_db(fields=self.PAYMENT_FIELDS)
+            return self.payment
+        try:
+            waiter = TransactionWaiter(self.pk)
+            if (transaction := self.api.check(self.key, wait=wait, waiter=waiter)):
+                self.__set_transaction_data(
+                    data=transaction)
+            elif waiter.notified:
+                # confirmed meanwhile by the webhook
+                self.refresh_from_db(fields=self.PAYMENT_FIELDS)
+            return self.payment
+        finally:
+            if lease is not None:
+                lease.release()
+
+    async def __arequest(self, polling: bool) -> bool:
+        lease = leases.get_request_lease(self)
+        requested = sync_to_async(type(self).objects.filter(
+            pk=self.pk, requested=True).exists)
+        refresh = sync_to_async(self.refresh_from_db)
+        if not await sync_to_async(lease.acquire)():
+            waited: bool = not await requested()
+            if waited:
+                await lease.await_done(requested)
+            await refresh(fields=self.REQUEST_FIELDS)
+            return waited and self.requested
+        try:
+            if await requested():
+                await refresh(fields=self.REQUEST_FIELDS)
+                return False
+            data: dict = await sync_to_async(self.get_request_data)(
+                polling=polling)
+            location = await self.aapi.create(**data)
+            assert location is not None
+            await sync_to_async(self.__set_key)(location)
+        finally:
+            await sync_to_async(lease.release)()
+        return True
+
+    async def __acheck(self, wait: bool) -> Union[dict, None]:
+        lease = leases.get_lease('check:%s' % self.pk, self.__get_check_timeout(wait))
+        if lease is not None and not await sync_to_async(lease.acquire)():
+            if wait:
+                await lease.await_done(sync_to_async(type(self).objects.filter(
+                    pk=self.pk, completed_at__isnull=False).exists))
+            await sync_to_async(self.refresh_from_db)(fields=self.PAYMENT_FIELDS)
+            return self.payment
+        try:
+            waiter = TransactionWaiter(self.pk)
+            if (transaction := await self.aapi.check(self.key, wait=wait, waiter=waiter)):
+                await self.__aset_transaction_data(data=transaction)
+            elif waiter.notified:
+                await sync_to_async(self.refresh_from_db)(fields=self.PAYMENT_FIELDS)
+            return self.payment
+        finally:
+            if lease is not None:
+                await sync_to_async(lease.release)()
+
+    @staticmethod
+    def __get_check_timeout(wait: bool) -> float:
+        # a waiting check may sleep for the whole vPOS eta
+        if wait:
+            return conf.WAIT_DEADLINE + 2 * (conf.HTTP_READ_TIMEOUT or 30)
+        return conf.LEASE_TIMEOUT
+
     def __set_key(self, location: str) -> None:
         if not self.key:
-            self.key = location.split('/')[-1]
-            self.data.update({'location': location})
-            self.requested = True
-            self.save()
+            self.save_location(location)
     
-    def __set_transaction_data(self, data: dict) -> None:
-        if not self.payment:
-            self.data.update({'transaction': data})
-            self.save()
+    def record_confirmation(self, source: str) -> None:
+        """Reports the confirmation to the instrument, source is 'callback' or 'polling'"""
+        seconds = None
+        if self.requested_at and self.completed_at:
+            seconds = (self.completed_at - self.requested_at).total_seconds()
+        get_instrument().confirmation(source, self.status, seconds)
+
+    def __set_transaction_data(self, data: dict, source: str = 'polling',
+            dispatch: bool = True) -> bool:
+        """
+        Saves the vPOS transaction data with a conditional update, so only the
+        first confirmation (webhook or polling) is saved and dispatched
+        (by the caller if not dispatch). Returns False if the transaction was already confirmed
+        """
+        if self.payment:
+            return False
+        self.set_payment(data)
+        self.updated_at = timezone.now()
+        fields: list = self.PAYMENT_FIELDS + ['updated_at']
+        updated: int = type(self).objects.filter(
+            pk=self.pk, completed_at__isnull=True
+        ).update(**{field: getattr(self, field) for field in fields})
+        if not updated:
+            self.refresh_from_db(fields=fields)
+            return False
+        cache.set_completed(self)
+        # waiters wake up once the row is visible to them
+        pk = self.pk
+        db_transaction.on_commit(lambda: notify(pk))
+        self.record_confirmation(source)
+        if dispatch:
             self.__dispatch_transaction_completed()
+        return True
     
     def __dispatch_transaction_completed(self):
-        transaction_completed.send(
-            self.__class__,
-            transaction=self)
+        dispatch_completed(self)
+
+    async def __aset_transaction_data(self, data: dict, source: str = 'polling') -> bool:
+        """Asyncio version of __set_transaction_data, receivers are dispatched with adispatch"""
+        if not await sync_to_async(self.__set_transaction_data)(
+                data=data, source=source, dispatch=False):
+            return False
+        await adispatch_completed(self)
+        return True
     
\ No newline at end of file
@@ -0,0 +1,166 @@
+"""
+Transactional outbox of the vPOS requests (OUTBOX setting).
+
+With OUTBOX, create_payment / create_refund (and request) do not call vPOS:
+an OutboxEntry is saved in the same DB transaction as the transaction, and
+the outbox dispatcher (manage.py vpos_outbox) sends the requests:
+    - entries are claimed in batches with SELECT ... FOR UPDATE SKIP LOCKED,
+      and hidden for OUTBOX_CLAIM_TIMEOUT seconds, so many dispatchers can run
+      and no lock is held during the vPOS calls
+    - requests are sent concurrently (at most max_workers in flight, and the
+      limits of vpos.resilience), with the transaction id as idempotency key
+    - each location is saved as soon as its call returns, so webhooks find
+      the key, sent entries are deleted with a bulk query
+    - failed calls are retried with exponential backoff (OUTBOX_RETRY_BACKOFF),
+      up to OUTBOX_MAX_ATTEMPTS, then the entry is marked as failed
+"""
+import time
+import datetime
+import logging
+
+from typing import List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.db import transaction as db_transaction
+from django.db.models import F
+from django.utils import timezone
+
+from vpos.configs import conf
+from vpos.models import OutboxEntry, Transaction
+
+
+logger = logging.getLogger('vpos.outbox')
+
+
+class OutboxResult:
+
+    """Counters of an outbox dispatcher run"""
+
+    claimed: int
+    requested: int
+    retried: int
+    failed: int
+
+    def __init__(self) -> None:
+        self.claimed = 0
+        self.requested = 0
+        self.retried = 0
+        self.failed = 0
+
+    def __repr__(self) -> str:
+        return '<OutboxResult claimed=%d requested=%d retried=%d failed=%d>' % (
+            self.claimed, self.requested, self.retried, self.failed)
+
+
+class OutboxDispatcher:
+
+    """Sends the requests of the outbox, see the module docstring"""
+
+    max_workers: int
+    batch_size: int
+
+    def __init__(self, max_workers: int = None, batch_size: int = None) -> None:
+        self.max_workers = max_workers or conf.HTTP_POOL_SIZE
+        self.batch_size = batch_size or conf.OUTBOX_BATCH_SIZE
+
+    def run(self, max_batches: int = None) -> OutboxResult:
+        """Sends the available entries, batch after batch, until none is left"""
+        result = OutboxResult()
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            while max_batches is None or max_batches > 0:
+                if not (entries := self.claim()):
+                    break
+                self.send(executor, entries, result)
+                if max_batches is not None:
+                    max_batches -= 1
+        return result
+
+    def run_forever(self, interval: float = 1.0) -> None:
+        """Runs again every interval seconds while the outbox is empty"""
+        while True:
+            if not self.run().claimed:
+                time.sleep(interval)
+
+    def claim(self) -> List[OutboxEntry]:
+        """Locks a batch of available entries and hides them from other dispatchers"""
+        now = timezone.now()
+        with db_transaction.atomic():
+            entries = list(OutboxEntry.objects.select_for_update(
+                skip_locked=True, of=('self',)
+            ).filter(
+                failed=False, available_at__lte=now
+            ).select_related(
+                'transaction', 'transaction__parent'
+            ).order_by('available_at')[:self.batch_size])
+            if entries:
+                OutboxEntry.objects.filter(pk__in=[e.pk for e in entries]).update(
+                    attempts=F('attempts') + 1,
+                    available_at=now + datetime.timedelta(seconds=conf.OUTBOX_CLAIM_TIMEOUT))
+        for entry in entries:
+            entry.attempts += 1
+        return entries
+
+    def send(self,
+            executor: ThreadPoolExecutor,
+            entries: List[OutboxEntry],
+            result: OutboxResult) -> None:
+        """
+        Requests the claimed entries, each location is saved as soon as its call
+        returns (see Transaction.save_location), then the entries with bulk queries
+        """
+        result.claimed += len(entries)
+        sent: list = [e for e in entries if e.transaction.requested]
+        futures: dict = {
+            executor.submit(self.__create, entry): entry
+            for entry in entries if not entry.transaction.requested}
+        retried: list = []
+        for future in as_completed(futures):
+            entry: OutboxEntry = futures[future]
+            location, error = future.result()
+            if location is not None:
+                entry.transaction.save_location(location)
+                result.requested += 1
+                sent.append(entry)
+                continue
+            now = timezone.now()
+            entry.last_error = error[:2000]
+            if entry.attempts >= conf.OUTBOX_MAX_ATTEMPTS:
+                entry.failed = True
+                result.failed += 1
+                logger.error('Outbox request of transaction %s failed: %s',
+                    entry.transaction_id, error)
+            else:
+                entry.available_at = now + datetime.timedelta(
+                    seconds=self.get_delay(entry.attempts))
+                result.retried += 1
+            retried.append(entry)
+        with db_transaction.atomic():
+            if sent:
+                OutboxEntry.objects.filter(pk__in=[e.pk for e in sent]).delete()
+            if retried:
+                OutboxEntry.objects.bulk_update(retried,
+                    ['available_at', 'failed', 'last_error'])
+
+    @staticmethod
+    def get_delay(attempts: int) -> float:
+        """Seconds before the next attempt"""
+        return conf.OUTBOX_RETRY_BACKOFF * 2 ** (attempts - 1)
+
+    @staticmethod
+    def __create(entry: OutboxEntry) -> Tuple[Union[str, None], Union[str, None]]:
+        transaction: Transaction = entry.transaction
+        try:
+            location = transaction.api.create(
+                **transaction.get_request_data(polling=entry.polling))
+        except Exception as e:
+            logger.warning('Failed to request transaction %s',
+                transaction.pk, exc_info=True)
+            return None, '%s: %s' % (type(e).__name__, e)
+        if location is None:
+            return None, 'vPOS returned no location'
+        return location, None
+
+
+def dispatch(**kwargs) -> OutboxResult:
+    """Shortcut to OutboxDispatcher(**kwargs).run()"""
+    return OutboxDispatcher(**kwargs).run()
@@ -0,0 +1,162 @@
+"""
+Batch status polling for transactions requested with polling=True
+"""
+import math
+import time
+import logging
+import requests
+
+from typing import Dict, Iterator, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db.models import QuerySet
+
+from vpos.api import VposAPI
+from vpos.configs import conf
+from vpos.exceptions import VposConfigurationError, VposUnavailableError
+from vpos.instrumentation import get_instrument
+from vpos.models import Transaction
+
+
+logger = logging.getLogger('vpos.poller')
+
+
+class PollResult:
+
+    """Counters of a poller run"""
+
+    checked: int
+    completed: int
+    pending: int
+    errors: int
+
+    def __init__(self) -> None:
+        self.checked = 0
+        self.completed = 0
+        self.pending = 0
+        self.errors = 0
+
+    def __repr__(self) -> str:
+        return '<PollResult checked=%d completed=%d pending=%d errors=%d>' % (
+            self.checked, self.completed, self.pending, self.errors)
+
+
+class Poller:
+
+    """
+    Reconciles requested but unconfirmed transactions.
+    Transactions are checked concurrently (at most max_workers requests in flight),
+    the ones still running are grouped by the eta returned by vPOS and checked
+    again together when it is due, confirmed ones are saved with a bulk update.
+    """
+
+    max_workers: int
+    batch_size: int
+    eta_resolution: float
+
+    def __init__(self,
+            max_workers: int = None,
+            batch_size: int = 1000,
+            eta_resolution: float = 1.0) -> None:
+        self.max_workers = max_workers or conf.HTTP_POOL_SIZE
+        self.batch_size = batch_size
+        self.eta_resolution = eta_resolution
+        self.__etas = {}
+
+    def get_queryset(self) -> QuerySet:
+        """Requested transactions without vPOS transaction data"""
+        return Transaction.objects.pending().filter(key__isnull=False)
+
+    def run(self, max_wait: float = 0, queryset: QuerySet = None) -> PollResult:
+        """
+        Checks every pending transaction once. Then, for max_wait seconds,
+        checks again the running ones as soon as their eta is due
+        """
+        result = PollResult()
+        deadline = time.monotonic() + max_wait
+        buckets: Dict[float, list] = {}
+        # pk -> (first eta, when it was given), to measure the eta accuracy
+        self.__etas = {}
+
+        with ThreadPoolExecutor(self.max_workers) as executor:
+            for batch in self.__iter_batches(queryset):
+                self.__check(executor, batch, result, buckets)
+
+            while buckets:
+                due = min(buckets)
+                if due > deadline:
+                    break
+                if (delay := due - time.monotonic()) > 0:
+                    time.sleep(delay)
+                group = buckets.pop(due)
+                for i in range(0, len(group), self.batch_size):
+                    self.__check(executor,
+                        group[i:i + self.batch_size], result, buckets)
+
+        result.pending = sum(len(group) for group in buckets.values())
+        return result
+
+    def __iter_batches(self, queryset: QuerySet = None) -> Iterator[List[Tuple]]:
+        queryset = self.get_queryset() if queryset is None else queryset
+        batch: list = []
+        for item in queryset.values_list('id', 'key', 'tenant').iterator(
+                chunk_size=self.batch_size):
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def __check(self,
+            executor: ThreadPoolExecutor,
+            batch: List[Tuple],
+            result: PollResult,
+            buckets: Dict[float, list]) -> None:
+        completed: dict = {}
+        for item, (data, eta, error) in zip(batch,
+                executor.map(self.__get_status, batch)):
+            result.checked += 1
+            if error:
+                result.errors += 1
+            elif data is not None:
+                completed[item[0]] = data
+                if (first := self.__etas.pop(item[0], None)):
+                    get_instrument().eta(first[0], time.monotonic() - first[1])
+            elif eta is not None:
+                self.__etas.setdefault(item[0], (eta, time.monotonic()))
+                buckets.setdefault(self.__get_due(eta), []).append(item)
+        if completed:
+            transactions = Transaction.objects.in_bulk(list(completed))
+            confirmed = Transaction.objects.confirm_many(
+                ((t, completed[pk]) for pk, t in transactions.items()),
+                batch_size=self.batch_size)
+            result.completed += len(confirmed)
+
+    def __get_due(self, eta: float) -> float:
+        """Rounds the due time up, so close etas are checked together"""
+        due = time.monotonic() + max(eta, 0)
+        return math.ceil(due / self.eta_resolution) * self.eta_resolution
+
+    @staticmethod
+    def __get_status(item: Tuple) -> Tuple[Union[dict, None], Union[float, None], bool]:
+        pk, key, tenant = item
+        try:
+            data, eta = VposAPI(idempotency_key=str(pk), tenant=tenant).status(key)
+        except (requests.RequestException, ValueError):
+            logger.warning('Failed to check transaction %s', pk, exc_info=True)
+            return None, None, True
+        except VposUnavailableError as e:
+            # circuit open or no free slot, left pending for the next run
+            logger.warning('Skipped check of transaction %s: %r', pk, e)
+            return None, None, True
+        except VposConfigurationError as e:
+            # unknown or removed tenant
+            logger.error('Failed to check transaction %s: %s', pk, e)
+            return None, None, True
+        return data, eta, False
+
+
+def poll(max_wait: float = 0, **kwargs) -> PollResult:
+    """Shortcut to Poller(**kwargs).run(max_wait)"""
+    return Poller(**kwargs).run(max_wait=max_wait)
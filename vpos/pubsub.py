@@ -0,0 +1,140 @@
+"""
+Publication of completed transactions to the clients waiting for them
+(see the watch_transaction_status view).
+
+transaction_completed publishes the status of the transaction to the broker:
+    - Broker (default): wakes up the waiters of this process right away, waiters
+      look at the database every PUBSUB_POLL_INTERVAL seconds for confirmations
+      made by other processes
+    - CacheBroker (PUBSUB_CACHE set): the status is also written to the cache,
+      waiters look at the cache instead of the database
+"""
+import asyncio
+import threading
+
+from typing import Dict, Set, Tuple, Union
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+
+from vpos.configs import VPOS_STATUS_REASON, conf
+
+
+STATUS_FIELDS: Tuple[str, ...] = ('id', 'status', 'status_code', 'completed_at')
+
+
+def get_message(values: dict) -> dict:
+    """Status message of a transaction, from its STATUS_FIELDS"""
+    code = values.get('status_code')
+    return {
+        'id': str(values['id']),
+        'status': values.get('status'),
+        'status_code': code,
+        'status_reason': str(VPOS_STATUS_REASON[str(code)])
+            if str(code) in VPOS_STATUS_REASON else None,
+        'completed_at': values.get('completed_at')}
+
+
+def get_status(pk) -> Union[dict, None]:
+    """Status message of the transaction pk from the database, None if not found"""
+    from vpos.models import Transaction
+    values = Transaction.objects.filter(pk=pk).values(*STATUS_FIELDS).first()
+    return get_message(values) if values is not None else None
+
+
+class Broker:
+
+    """In-process publication, see the module docstring"""
+
+    poll_interval: float
+
+    def __init__(self, poll_interval: float = None) -> None:
+        self.poll_interval = poll_interval or conf.PUBSUB_POLL_INTERVAL
+        self._lock = threading.Lock()
+        self._waiters: Dict[str, Set[Tuple[asyncio.AbstractEventLoop, asyncio.Future]]] = {}
+
+    def publish(self, pk, message: dict) -> None:
+        """Wakes up every waiter of the transaction pk, from any thread"""
+        with self._lock:
+            waiters = self._waiters.pop(str(pk), ())
+        for loop, future in waiters:
+            if not loop.is_closed():
+                loop.call_soon_threadsafe(self.__resolve, future, message)
+
+    @staticmethod
+    def __resolve(future: asyncio.Future, message: dict) -> None:
+        if not future.done():
+            future.set_result(message)
+
+    async def lookup(self, pk) -> Union[dict, None]:
+        """Message of pk if completed in another process"""
+        message = await sync_to_async(get_status)(pk)
+        if message is not None and message['status'] is not None:
+            return message
+        return None
+
+    async def wait(self, pk, timeout: float) -> Union[dict, None]:
+        """Waits at most timeout seconds for pk to complete, returns its message or None"""
+        loop = asyncio.get_running_loop()
+        waiter = (loop, loop.create_future())
+        with self._lock:
+            self._waiters.setdefault(str(pk), set()).add(waiter)
+        try:
+            deadline = loop.time() + timeout
+            while (remaining := deadline - loop.time()) > 0:
+                try:
+                    return await asyncio.wait_for(asyncio.shield(waiter[1]),
+                        min(remaining, self.poll_interval))
+                except asyncio.TimeoutError:
+                    pass
+                if (message := await self.lookup(pk)) is not None:
+                    return message
+            return None
+        finally:
+            with self._lock:
+                if (waiters := self._waiters.get(str(pk))) is not None:
+                    waiters.discard(waiter)
+                    if not waiters:
+                        del self._waiters[str(pk)]
+
+
+class CacheBroker(Broker):
+
+    """Publication through PUBSUB_CACHE, shared by every process"""
+
+    def __init__(self, poll_interval: float = None, alias: str = None) -> None:
+        super().__init__(poll_interval)
+        self.cache = caches[alias or conf.PUBSUB_CACHE]
+
+    @staticmethod
+    def get_key(pk) -> str:
+        return 'vpos:status:%s' % pk
+
+    def publish(self, pk, message: dict) -> None:
+        self.cache.set(self.get_key(pk), message, conf.PUBSUB_TIMEOUT * 10)
+        super().publish(pk, message)
+
+    async def lookup(self, pk) -> Union[dict, None]:
+        return await sync_to_async(self.cache.get)(self.get_key(pk))
+
+
+_broker: Union[Broker, None] = None
+
+
+def get_broker() -> Broker:
+    """The broker of the PUBSUB_CACHE setting"""
+    global _broker
+    if _broker is None:
+        _broker = CacheBroker() if conf.PUBSUB_CACHE else Broker()
+    return _broker
+
+
+def reset() -> None:
+    global _broker
+    _broker = None
+
+
+def publish_completed(sender, transaction, **kwargs) -> None:
+    """transaction_completed receiver"""
+    get_broker().publish(transaction.pk, get_message({
+        field: getattr(transaction, field) for field in STATUS_FIELDS}))
@@ -0,0 +1,367 @@
+"""
+Protection of the vPOS gateway calls (see VposAPI.request).
+
+    - CircuitBreaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failures (timeouts,
+      connection errors, 5xx and the 1000/1001 gateway errors) calls fail fast with
+      VposCircuitOpenError for CIRCUIT_RECOVERY_TIMEOUT seconds, then a single probe
+      call is let through, closing the circuit on success or opening it again.
+      With CIRCUIT_CACHE (a cache alias) the state is shared by every process.
+    - AdaptiveLimiter: caps the calls in flight (AIMD). The limit grows by one per
+      limit successful calls up to CONCURRENCY_MAX and is halved on every failure,
+      down to CONCURRENCY_MIN. Callers wait at most CONCURRENCY_TIMEOUT seconds for
+      a slot, then fail fast with VposConcurrencyLimitError.
+      Every tenant (see TENANTS) has its own limiter, the circuit breaker is shared.
+"""
+import os
+import time
+import asyncio
+import threading
+
+from typing import Callable, Dict, Union
+
+from django.core.cache import caches
+
+from vpos.configs import conf
+from vpos.exceptions import VposCircuitOpenError, VposConcurrencyLimitError
+from vpos.instrumentation import get_instrument
+
+
+# vPOS status reasons meaning the gateway itself failed
+GATEWAY_ERRORS: frozenset = frozenset(('1000', '1001'))
+
+CLOSED: str = 'closed'
+OPEN: str = 'open'
+HALF_OPEN: str = 'half_open'
+
+
+def is_failure(r) -> bool:
+    """True if a vPOS response (requests or httpx) means the gateway is unhealthy"""
+    if r.status_code >= 500:
+        return True
+    if r.status_code == 200 and b'status_reason' in r.content:
+        try:
+            return str(r.json().get('status_reason')) in GATEWAY_ERRORS
+        except (ValueError, AttributeError):
+            return False
+    return False
+
+
+class CircuitBreaker:
+
+    """In-process circuit breaker, see the module docstring"""
+
+    threshold: int
+    recovery_timeout: float
+
+    def __init__(self, threshold: int, recovery_timeout: float) -> None:
+        self.threshold = threshold
+        self.recovery_timeout = recovery_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        return self._get_state(self._opened_at)
+
+    def _get_state(self, opened_at: Union[float, None]) -> str:
+        if opened_at is None:
+            return CLOSED
+        if self._now() - opened_at < self.recovery_timeout:
+            return OPEN
+        return HALF_OPEN
+
+    def _now(self) -> float:
+        return time.monotonic()
+
+    def _retry_after(self, opened_at: float) -> float:
+        return max(opened_at + self.recovery_timeout - self._now(), 0)
+
+    def allow(self) -> bool:
+        """
+        Raises VposCircuitOpenError if the call must not be made.
+        Returns True if the call is the recovery probe
+        """
+        if self._opened_at is None:
+            return False
+        with self._lock:
+            opened_at = self._opened_at
+            state = self._get_state(opened_at)
+            if state == CLOSED:
+                return False
+            if state == OPEN or self._probing:
+                raise VposCircuitOpenError(self._retry_after(opened_at))
+            self._probing = True
+        get_instrument().circuit_state(HALF_OPEN)
+        return True
+
+    def record(self, failed: bool, probe: bool = False) -> None:
+        """Result of an allowed call"""
+        if not failed:
+            if self._failures or self._opened_at is not None:
+                with self._lock:
+                    closed = self._opened_at is not None
+                    self._failures = 0
+                    self._opened_at = None
+                    self._probing = False
+                if closed:
+                    get_instrument().circuit_state(CLOSED)
+            return
+        with self._lock:
+            self._failures += 1
+            opened = probe or (self._opened_at is None and self._failures >= self.threshold)
+            if opened:
+                self._opened_at = self._now()
+                self._probing = False
+        if opened:
+            get_instrument().circuit_state(OPEN)
+
+    def cancel(self, probe: bool) -> None:
+        """An allowed call was not made"""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+
+class CacheCircuitBreaker(CircuitBreaker):
+
+    """
+    Circuit breaker keeping its state in a Django cache, shared by all processes.
+    Failures further apart than recovery_timeout do not add up
+    """
+
+    def __init__(self, threshold: int, recovery_timeout: float,
+            alias: str = 'default', prefix: str = 'vpos:circuit:') -> None:
+        super().__init__(threshold, recovery_timeout)
+        self.cache = caches[alias]
+        self.opened_key = prefix + 'opened'
+        self.failures_key = prefix + 'failures'
+        self.probe_key = prefix + 'probe'
+        # set when the last look at the cache saw failures
+        self._dirty = False
+
+    @property
+    def state(self) -> str:
+        return self._get_state(self.cache.get(self.opened_key))
+
+    def _now(self) -> float:
+        # shared with other hosts, monotonic clocks are not
+        return time.time()
+
+    def allow(self) -> bool:
+        values: dict = self.cache.get_many([self.opened_key, self.failures_key])
+        opened_at = values.get(self.opened_key)
+        self._dirty = bool(values)
+        state = self._get_state(opened_at)
+        if state == CLOSED:
+            return False
+        # only one process gets the probe
+        if state == OPEN or not self.cache.add(self.probe_key, 1, self.recovery_timeout):
+            raise VposCircuitOpenError(self._retry_after(opened_at))
+        get_instrument().circuit_state(HALF_OPEN)
+        return True
+
+    def record(self, failed: bool, probe: bool = False) -> None:
+        if not failed:
+            if self._dirty or probe:
+                self.cache.delete_many([self.opened_key, self.failures_key, self.probe_key])
+                self._dirty = False
+                if probe:
+                    get_instrument().circuit_state(CLOSED)
+            return
+        self.cache.add(self.failures_key, 0, self.recovery_timeout)
+        try:
+            failures = self.cache.incr(self.failures_key)
+        except ValueError:
+            # expired in between
+            failures = 1
+        self._dirty = True
+        # opened_at stays until a probe succeeds
+        if probe:
+            self.cache.set(self.opened_key, self._now(), None)
+            self.cache.delete(self.probe_key)
+            get_instrument().circuit_state(OPEN)
+        elif failures >= self.threshold and self.cache.add(self.opened_key, self._now(), None):
+            get_instrument().circuit_state(OPEN)
+
+    def cancel(self, probe: bool) -> None:
+        if probe:
+            self.cache.delete(self.probe_key)
+
+
+class AdaptiveLimiter:
+
+    """AIMD limit of the calls in flight, see the module docstring"""
+
+    min_limit: int
+    max_limit: int
+    timeout: float
+    in_flight: int
+
+    def __init__(self, min_limit: int, max_limit: int, timeout: float,
+            tenant: str = None) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.timeout = timeout
+        self.tenant = tenant
+        self.in_flight = 0
+        self._limit = float(max_limit)
+        self._condition = threading.Condition()
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def try_acquire(self) -> bool:
+        with self._condition:
+            if self.in_flight < self.limit:
+                self.in_flight += 1
+                return True
+            return False
+
+    def acquire(self) -> None:
+        """Waits for a slot, raises VposConcurrencyLimitError after timeout"""
+        with self._condition:
+            if not self._condition.wait_for(
+                    lambda: self.in_flight < self.limit, self.timeout):
+                raise VposConcurrencyLimitError(self.limit)
+            self.in_flight += 1
+
+    async def aacquire(self) -> None:
+        """Asyncio version of acquire, never blocks the event loop"""
+        deadline = time.monotonic() + self.timeout
+        while not self.try_acquire():
+            if time.monotonic() >= deadline:
+                raise VposConcurrencyLimitError(self.limit)
+            await asyncio.sleep(0.005)
+
+    def release(self, failed: bool) -> None:
+        with self._condition:
+            self.in_flight -= 1
+            limit = self.limit
+            if failed:
+                self._limit = max(self.min_limit, self._limit / 2)
+            else:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            changed = self.limit != limit
+            self._condition.notify(max(self.limit - self.in_flight, 1))
+        if changed:
+            get_instrument().concurrency_limit(self.limit, self.tenant)
+
+
+_breaker: Union[CircuitBreaker, None] = None
+# tenant name (None for the default settings) -> limiter
+_limiters: Dict[Union[str, None], Union[AdaptiveLimiter, None]] = {}
+_loaded: bool = False
+_lock = threading.Lock()
+
+
+def _load() -> None:
+    global _breaker, _loaded
+    with _lock:
+        if _loaded:
+            return
+        if conf.CIRCUIT_FAILURE_THRESHOLD:
+            if conf.CIRCUIT_CACHE:
+                _breaker = CacheCircuitBreaker(conf.CIRCUIT_FAILURE_THRESHOLD,
+                    conf.CIRCUIT_RECOVERY_TIMEOUT, alias=conf.CIRCUIT_CACHE)
+            else:
+                _breaker = CircuitBreaker(conf.CIRCUIT_FAILURE_THRESHOLD,
+                    conf.CIRCUIT_RECOVERY_TIMEOUT)
+        _loaded = True
+
+
+def get_breaker() -> Union[CircuitBreaker, None]:
+    """The circuit breaker of the process, None if disabled"""
+    if not _loaded:
+        _load()
+    return _breaker
+
+
+def get_limiter(tenant: str = None) -> Union[AdaptiveLimiter, None]:
+    """The concurrency limiter of the process and tenant, None if disabled"""
+    try:
+        return _limiters[tenant]
+    except KeyError:
+        pass
+    with _lock:
+        if tenant not in _limiters:
+            values = conf.get_tenant(tenant).values
+            _limiters[tenant] = AdaptiveLimiter(values['CONCURRENCY_MIN'],
+                values['CONCURRENCY_MAX'], conf.CONCURRENCY_TIMEOUT, tenant
+            ) if values['CONCURRENCY_MAX'] else None
+        return _limiters[tenant]
+
+
+def reset() -> None:
+    """Drops the breaker and limiters, they are built again from the settings"""
+    global _breaker, _limiters, _loaded, _lock
+    _breaker = None
+    _limiters = {}
+    _loaded = False
+    _lock = threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    # calls in flight belong to the parent
+    os.register_at_fork(after_in_child=reset)
+
+
+def _allow(breaker: Union[CircuitBreaker, None]) -> bool:
+    try:
+        return breaker.allow() if breaker is not None else False
+    except VposCircuitOpenError:
+        get_instrument().fail_fast('circuit_open')
+        raise
+
+
+def _rejected(breaker: Union[CircuitBreaker, None], probe: bool) -> None:
+    get_instrument().fail_fast('concurrency_limit')
+    if breaker is not None:
+        breaker.cancel(probe)
+
+
+def _done(breaker, limiter, failed: bool, probe: bool) -> None:
+    if limiter is not None:
+        limiter.release(failed)
+    if breaker is not None:
+        breaker.record(failed, probe)
+
+
+def call(send: Callable, tenant: str = None):
+    """Calls send() (a vPOS request) through the circuit breaker and the tenant limiter"""
+    breaker, limiter = get_breaker(), get_limiter(tenant)
+    probe = _allow(breaker)
+    if limiter is not None:
+        try:
+            limiter.acquire()
+        except VposConcurrencyLimitError:
+            _rejected(breaker, probe)
+            raise
+    failed = True
+    try:
+        r = send()
+        failed = is_failure(r)
+        return r
+    finally:
+        _done(breaker, limiter, failed, probe)
+
+
+async def acall(send: Callable, tenant: str = None):
+    """Asyncio version of call, send() returns an awaitable"""
+    breaker, limiter = get_breaker(), get_limiter(tenant)
+    probe = _allow(breaker)
+    if limiter is not None:
+        try:
+            await limiter.aacquire()
+        except VposConcurrencyLimitError:
+            _rejected(breaker, probe)
+            raise
+    failed = True
+    try:
+        r = await send()
+        failed = is_failure(r)
+        return r
+    finally:
+        _done(breaker, limiter, failed, probe)
@@ -1,3 +1,92 @@
+import time
+import weakref
+
+from asgiref.sync import async_to_sync, iscoroutinefunction
 from django.dispatch import Signal
 
-transaction_completed = Signal(['transaction'])
+
+class TimedSignal(Signal):
+
+    """
+    Signal timing each of its receivers (see vpos.dispatch.stats).
+    Receivers are wrapped on connect, the wrapper keeps a weak reference
+    to the receiver if weak, and is disconnected when the receiver is collected
+    """
+
+    def connect(self, receiver, sender=None, weak=True, dispatch_uid=None):
+        dispatch_uid = dispatch_uid or get_receiver_id(receiver)
+        super().connect(timed(receiver, weak),
+            sender=sender, weak=False, dispatch_uid=dispatch_uid)
+        if weak:
+            weakref.finalize(getattr(receiver, '__self__', receiver),
+                self.disconnect, None, sender, dispatch_uid)
+
+    def disconnect(self, receiver=None, sender=None, dispatch_uid=None):
+        return super().disconnect(None, sender,
+            dispatch_uid or get_receiver_id(receiver))
+
+
+def get_receiver_id(receiver) -> tuple:
+    """Key of a receiver connected without dispatch_uid, bound methods by instance"""
+    if hasattr(receiver, '__self__') and hasattr(receiver, '__func__'):
+        return ('vpos.receiver', id(receiver.__self__), id(receiver.__func__))
+    return ('vpos.receiver', id(receiver))
+
+
+def get_receiver(wrapper):
+    """The receiver of a wrapper connected by TimedSignal, None if collected"""
+    if (ref := getattr(wrapper, 'receiver', None)) is None:
+        return wrapper
+    return ref()
+
+
+def timed(receiver, weak: bool = True):
+    """
+    Wrapper of a receiver recording its duration. Async receivers stay async
+    where signals support them (asend, django >= 5.0), else run with async_to_sync
+    """
+    if not weak:
+        ref = lambda: receiver
+    elif hasattr(receiver, '__self__') and hasattr(receiver, '__func__'):
+        ref = weakref.WeakMethod(receiver)
+    else:
+        ref = weakref.ref(receiver)
+
+    def done(target, start: float, error: bool) -> None:
+        from vpos.dispatch import record
+        record(target, time.perf_counter() - start, error)
+
+    if iscoroutinefunction(receiver) and hasattr(Signal, 'asend'):
+        async def wrapper(**kwargs):
+            if (target := ref()) is None:
+                return None
+            start = time.perf_counter()
+            try:
+                response = await target(**kwargs)
+            except Exception:
+                done(target, start, True)
+                raise
+            done(target, start, False)
+            return response
+    else:
+        def wrapper(**kwargs):
+            if (target := ref()) is None:
+                return None
+            function = async_to_sync(target) if iscoroutinefunction(target) else target
+            start = time.perf_counter()
+            try:
+                response = function(**kwargs)
+            except Exception:
+                done(target, start, True)
+                raise
+            done(target, start, False)
+            return response
+
+    for attr in ('__module__', '__name__', '__qualname__', '__doc__'):
+        if hasattr(receiver, attr):
+            setattr(wrapper, attr, getattr(receiver, attr))
+    wrapper.receiver = ref
+    return wrapper
+
+
+transaction_completed = TimedSignal(['transaction'])
@@ -0,0 +1,215 @@
+"""
+Local stand-in for the vPOS API, for development, tests and benchmarks.
+
+    POST /transactions      -> 202 + Location: /requests/<id>
+    GET  /requests/<id>     -> 200 {"eta": <seconds>} while running,
+                               303 + Location: /transactions/<id> when completed
+    GET  /transactions/<id> -> 200 transaction data
+
+When a request has a callback_url, the transaction data is POSTed to it once completed.
+Outcomes are set per mobile number (outcomes) or at random (reject_ratio), using
+the status reason codes of vpos.configs.VPOS_STATUS_REASON.
+
+Usage:
+    simulator = Simulator(eta=2, latency=0.05).start()
+    # VPOS_BASE_URL = simulator.base_url
+    simulator.stop()
+
+Or from the command line: python manage.py vpos_simulator --port 8080
+"""
+import json
+import time
+import uuid
+import random
+import logging
+import threading
+import urllib.request
+
+from typing import Dict, Union
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from vpos.configs import VPOS_STATUS_REASON
+
+
+logger = logging.getLogger('vpos.simulator')
+
+
+class SimulatedTransaction:
+
+    """A transaction stored by the simulator"""
+
+    __slots__ = ('id', 'data', 'callback_url', 'created', 'eta', 'delivered')
+
+    def __init__(self, data: dict, eta: float) -> None:
+        self.id = uuid.uuid4().hex
+        self.data = data
+        self.callback_url = data.pop('callback_url', None)
+        self.created = time.monotonic()
+        self.eta = eta
+        self.delivered = False
+
+    @property
+    def remaining(self) -> float:
+        return max(self.created + self.eta - time.monotonic(), 0)
+
+    @property
+    def completed(self) -> bool:
+        return self.remaining <= 0
+
+
+class Simulator:
+
+    """vPOS API simulator running on a background thread"""
+
+    def __init__(self,
+            host: str = '127.0.0.1',
+            port: int = 0,
+            base_path: str = '/api/v1',
+            eta: float = 1.0,
+            latency: float = 0.0,
+            reject_ratio: float = 0.0,
+            reject_code: int = 2001,
+            outcomes: Dict[str, Union[int, None]] = None) -> None:
+        for code in [reject_code] + [c for c in (outcomes or {}).values() if c]:
+            if str(code) not in VPOS_STATUS_REASON:
+                raise ValueError('Unknown vPOS status reason code: %s' % code)
+        self.host = host
+        self.port = port
+        self.base_path = base_path.rstrip('/')
+        self.eta = eta
+        self.latency = latency
+        self.reject_ratio = reject_ratio
+        self.reject_code = reject_code
+        # mobile -> status reason code, None to accept
+        self.outcomes = dict(outcomes or {})
+        self.transactions: Dict[str, SimulatedTransaction] = {}
+        self.idempotency_keys: Dict[str, str] = {}
+        self.lock = threading.Lock()
+        self.server = None
+
+    @property
+    def base_url(self) -> str:
+        return 'http://%s:%d%s' % (self.host, self.server.server_address[1], self.base_path)
+
+    def start(self) -> 'Simulator':
+        self.server = ThreadingHTTPServer((self.host, self.port), self.__get_handler())
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever,
+            name='vpos-simulator', daemon=True).start()
+        return self
+
+    def serve_forever(self) -> None:
+        self.server = ThreadingHTTPServer((self.host, self.port), self.__get_handler())
+        self.server.daemon_threads = True
+        self.server.serve_forever()
+
+    def stop(self) -> None:
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+
+    # -------------------------------------------------------------------------------------------
+    # behaviour
+
+    def create(self, body: dict, idempotency_key: str = None) -> SimulatedTransaction:
+        with self.lock:
+            if idempotency_key and idempotency_key in self.idempotency_keys:
+                return self.transactions[self.idempotency_keys[idempotency_key]]
+            transaction = SimulatedTransaction(body, self.eta)
+            transaction.data.update({
+                'id': transaction.id,
+                **self.get_outcome(body)})
+            self.transactions[transaction.id] = transaction
+            if idempotency_key:
+                self.idempotency_keys[idempotency_key] = transaction.id
+        if transaction.callback_url:
+            timer = threading.Timer(transaction.eta, self.deliver, args=(transaction,))
+            timer.daemon = True
+            timer.start()
+        return transaction
+
+    def get_outcome(self, body: dict) -> dict:
+        if body.get('mobile') in self.outcomes:
+            code = self.outcomes[body['mobile']]
+        elif self.reject_ratio and random.random() < self.reject_ratio:
+            code = self.reject_code
+        else:
+            code = None
+        return {
+            'status': 'rejected' if code else 'accepted',
+            'status_reason': code}
+
+    def deliver(self, transaction: SimulatedTransaction) -> None:
+        """POSTs the transaction data to its callback url"""
+        request = urllib.request.Request(transaction.callback_url,
+            data=json.dumps(transaction.data).encode(),
+            headers={'Content-Type': 'application/json'},
+            method='POST')
+        try:
+            with urllib.request.urlopen(request, timeout=30) as r:
+                transaction.delivered = r.status == 200
+        except Exception:
+            logger.warning('Callback to %s failed', transaction.callback_url, exc_info=True)
+
+    def __get_handler(self):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                self.wait()
+                if self.path != simulator.base_path + '/transactions':
+                    return self.respond(404)
+                if not self.headers.get('Authorization', '').startswith('Bearer '):
+                    return self.respond(401)
+                try:
+                    data: dict = json.loads(body or b'{}')
+                except ValueError:
+                    return self.respond(400)
+                required = (('parent_transaction_id', 'supervisor_card')
+                    if data.get('type') == 'refund' else ('pos_id', 'mobile', 'amount'))
+                if any(not data.get(field) for field in required):
+                    return self.respond(400, {'errors': {f: ['required'] for f in required}})
+                transaction = simulator.create(data, self.headers.get('Idempotency-Key'))
+                self.respond(202, headers={
+                    'Location': '%s/requests/%s' % (simulator.base_path, transaction.id)})
+
+            def do_GET(self):
+                self.wait()
+                prefix, _, id = self.path.rpartition('/')
+                if (transaction := simulator.transactions.get(id)) is None:
+                    return self.respond(404)
+                if prefix == simulator.base_path + '/requests':
+                    if not transaction.completed:
+                        return self.respond(200, {'eta': round(transaction.remaining, 3)})
+                    return self.respond(303, headers={
+                        'Location': '%s/transactions/%s' % (simulator.base_path, id)})
+                if prefix == simulator.base_path + '/transactions':
+                    if not transaction.completed:
+                        return self.respond(404)
+                    return self.respond(200, transaction.data)
+                self.respond(404)
+
+            def wait(self):
+                if simulator.latency:
+                    time.sleep(simulator.latency)
+
+            def respond(self, status: int, data: dict = None, headers: dict = None):
+                body = json.dumps(data).encode() if data is not None else b''
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                if data is not None:
+                    self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -3,14 +3,26 @@ from vpos.models import Transaction
 
 def create(mobile: str,
         amount: str,
-        parent: Transaction = None) -> Transaction:
+        parent: Transaction = None,
+        tenant: str = None) -> Transaction:
     """
     Creates new Payment or Refund Transaction
-    If parent is set creates a Refund Transaction
+    If parent is set creates a Refund Transaction, of the tenant of its parent
     """
     if not parent:
         return Transaction.objects.create_payment(
-            mobile=mobile, amount=amount)
+            mobile=mobile, amount=amount, tenant=tenant)
     return Transaction.objects.create_refund(
         parent=parent)
-    
\ No newline at end of file
+
+
+async def acreate(mobile: str,
+        amount: str,
+        parent: Transaction = None,
+        tenant: str = None) -> Transaction:
+    """Asyncio version of create"""
+    if not parent:
+        return await Transaction.objects.acreate_payment(
+            mobile=mobile, amount=amount, tenant=tenant)
+    return await Transaction.objects.acreate_refund(
+        parent=parent)
@@ -1,5 +1,5 @@
 from django.urls import path
-from vpos.views import watch_transaction_confirmation
+from vpos.views import watch_transaction_confirmation, watch_transaction_status
 
 
 app_name = 'vpos'
@@ -7,4 +7,6 @@ app_name = 'vpos'
 urlpatterns: list = [
     path('<uuid:transaction_id>',
         watch_transaction_confirmation, name='confirmation'),
+    path('<uuid:transaction_id>/status',
+        watch_transaction_status, name='status'),
 ]
@@ -1,23 +1,54 @@
 import re
+import functools
+from typing import Iterable, List, Union
 from django.core import validators
 from django.utils.deconstruct import deconstructible
 from django.utils.translation import gettext_lazy as _
 
 
+# distinct numbers kept by the phone normalisation cache
+PHONE_CACHE_SIZE: int = 8192
+
+
+@functools.lru_cache(maxsize=None)
+def get_pattern(regex: str) -> re.Pattern:
+    return re.compile(regex)
+
+
+@functools.lru_cache(maxsize=PHONE_CACHE_SIZE)
+def normalize_phone(regex: str, replace: str, phone: str) -> Union[str, None]:
+    """Returns the national number or None if it does not match regex"""
+    if (match := get_pattern(regex).match(phone)):
+        return match.expand(replace)
+    return None
+
+
 @deconstructible
 class PhoneAOValidator(validators.RegexValidator):
-    
+
     regex = r'^(?:(\+244|00244))?(9)(1|2|3|4|9)([\d]{7,7})$'
     default_replace = r'\2\3\4'
     message =  _('Invalid national phone number of angola')
 
     @classmethod
     def match(cls, string):
-        return re.match(cls.regex, string)
-    
+        return get_pattern(cls.regex).match(string)
+
     @classmethod
     def clean_number(cls, phone: str):
-        return re.sub(cls.regex, cls.default_replace, phone)
+        normalized = normalize_phone(cls.regex, cls.default_replace, phone)
+        return phone if normalized is None else normalized
+
+    @classmethod
+    def clean_numbers(cls, phones: Iterable[str]) -> List[Union[str, None]]:
+        """
+        Validates and cleans many numbers in one pass,
+        invalid numbers (or not strings) are returned as None
+        """
+        regex, replace = cls.regex, cls.default_replace
+        return [
+            normalize_phone(regex, replace, phone) if isinstance(phone, str) else None
+            for phone in phones]
 
 
 # default
@@ -1,23 +1,88 @@
 import json
+import time
 
-from django.http import HttpResponse, HttpRequest
+from typing import AsyncIterator
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse, HttpRequest, JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.shortcuts import get_object_or_404
 
+from vpos import pubsub, webhooks
+from vpos.configs import conf
+from vpos.exceptions import VposWebhookError
+from vpos.instrumentation import get_instrument
 from vpos.models import Transaction
 
 @csrf_exempt
 def watch_transaction_confirmation(request: HttpRequest, transaction_id: str) -> HttpResponse:
     """View to watch vPOS API Webhook with Transaction Confirmation"""
     if request.method == 'POST':
-        # TODO: (security) check api signature (vPOS dependency)
-        # ...
-        transaction: Transaction = get_object_or_404(Transaction,
-            id=transaction_id)
-        data: dict = json.loads(request.body)
-        if not transaction.payment and data.get('id') == transaction.key:
-            if transaction.confirm(data):
-                return HttpResponse(status=200)
-            return HttpResponse(status=409)
-        return HttpResponse(status=403)
+        instrument = get_instrument()
+        start = time.perf_counter()
+        with instrument.span('vpos.webhook', transaction_id=str(transaction_id)):
+            response = confirm_transaction(request, transaction_id)
+        instrument.webhook(response.status_code, time.perf_counter() - start)
+        return response
     return HttpResponse(status=405)
+
+
+def confirm_transaction(request: HttpRequest, transaction_id: str) -> HttpResponse:
+    # size, signature (WEBHOOK_VERIFIER) and payload checks, before any query
+    try:
+        data: dict = webhooks.parse(request)
+    except VposWebhookError as e:
+        return HttpResponse(status=e.status)
+    # cheap lookup first, retries of confirmed transactions
+    # never load the whole row and its json data
+    row = Transaction.objects.filter(id=transaction_id).values_list(
+        'key', 'completed_at').first()
+    if row is None:
+        return HttpResponse(status=404)
+    key, completed_at = row
+    if completed_at is None and data['id'] == key:
+        transaction: Transaction = Transaction.objects.get(id=transaction_id)
+        if transaction.confirm(data):
+            return HttpResponse(status=200)
+        return HttpResponse(status=409)
+    return HttpResponse(status=403)
+
+
+# seconds between SSE comments, proxies close idle connections
+SSE_KEEPALIVE: float = 15
+
+
+async def watch_transaction_status(request: HttpRequest, transaction_id: str) -> HttpResponse:
+    """
+    Waits for the transaction to complete, woken by transaction_completed
+    (see vpos.pubsub), vPOS is never called.
+    Long-poll JSON, or server-sent events with Accept: text/event-stream.
+    Pending after PUBSUB_TIMEOUT: long-poll returns with a null status, the
+    event stream ends with it (EventSource reconnects)
+    """
+    if request.method != 'GET':
+        return HttpResponse(status=405)
+    message = await sync_to_async(pubsub.get_status)(transaction_id)
+    if message is None:
+        return HttpResponse(status=404)
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        return StreamingHttpResponse(stream_status(transaction_id, message),
+            content_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    if message['status'] is None:
+        message = await pubsub.get_broker().wait(
+            transaction_id, conf.PUBSUB_TIMEOUT) or message
+    return JsonResponse(message, headers={'Cache-Control': 'no-cache'})
+
+
+async def stream_status(transaction_id: str, message: dict) -> AsyncIterator[str]:
+    broker = pubsub.get_broker()
+    remaining: float = conf.PUBSUB_TIMEOUT
+    while message['status'] is None and remaining > 0:
+        wait = min(remaining, SSE_KEEPALIVE)
+        if (completed := await broker.wait(transaction_id, wait)) is not None:
+            message = completed
+            break
+        remaining -= wait
+        yield ': keepalive\n\n'
+    yield 'event: status\ndata: %s\n\n' % json.dumps(message, cls=DjangoJSONEncoder)
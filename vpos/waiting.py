@@ -0,0 +1,153 @@
+"""
+Waiting for running vPOS requests (see VposAPI.check with wait=True).
+
+The strategy (WAIT_STRATEGY setting) decides how long to sleep before looking
+again at a running request:
+    - while vPOS gives an ETA, until the ETA (never earlier, plus some jitter)
+    - once the ETA is due, exponential backoff with jitter from WAIT_MIN_DELAY
+      to WAIT_MAX_DELAY
+    - never past WAIT_DEADLINE seconds from the first look
+
+The waiter sleeps, and wakes up early when the transaction is confirmed by
+another path (the webhook), once the confirmation is committed: right away
+inside the process, or by looking every WAIT_POLL_INTERVAL seconds at
+WAIT_CACHE, or the database if not set.
+"""
+import time
+import random
+import asyncio
+import threading
+
+from typing import Dict, Set, Union
+
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.utils.module_loading import import_string
+
+from vpos.configs import conf
+
+
+class WaitStrategy:
+
+    """ETA-aware exponential backoff with jitter and an overall deadline"""
+
+    deadline: float
+    min_delay: float
+    max_delay: float
+    backoff: float
+    jitter: float
+
+    def __init__(self,
+            deadline: float = None,
+            min_delay: float = None,
+            max_delay: float = None,
+            backoff: float = None,
+            jitter: float = None) -> None:
+        self.deadline = conf.WAIT_DEADLINE if deadline is None else deadline
+        self.min_delay = conf.WAIT_MIN_DELAY if min_delay is None else min_delay
+        self.max_delay = conf.WAIT_MAX_DELAY if max_delay is None else max_delay
+        self.backoff = conf.WAIT_BACKOFF if backoff is None else backoff
+        self.jitter = conf.WAIT_JITTER if jitter is None else jitter
+
+    def get_delay(self, attempt: int, eta: Union[float, None], elapsed: float) -> Union[float, None]:
+        """
+        Seconds to sleep before the next look, attempt is the number of looks
+        since the ETA was due. None if the deadline is reached
+        """
+        remaining = self.deadline - elapsed
+        if remaining <= 0:
+            return None
+        if eta is not None and eta >= self.min_delay:
+            # waking up before the ETA is a wasted round trip
+            delay = eta * (1 + random.uniform(0, self.jitter))
+        else:
+            delay = min(self.min_delay * self.backoff ** attempt, self.max_delay)
+            # equal jitter, checks of many transactions do not line up
+            delay = delay * (1 - self.jitter) + random.uniform(0, delay * self.jitter)
+        return min(delay, remaining)
+
+
+def get_strategy() -> WaitStrategy:
+    """A new strategy of the WAIT_STRATEGY setting"""
+    return import_string(conf.WAIT_STRATEGY)()
+
+
+# transaction pk -> events of the threads waiting for it in this process
+_events: Dict[str, Set[threading.Event]] = {}
+_events_lock = threading.Lock()
+
+
+def get_cache_key(pk) -> str:
+    return 'vpos:completed:%s' % pk
+
+
+def notify(*pks) -> None:
+    """Wakes up the waiters of confirmed transactions"""
+    with _events_lock:
+        for pk in pks:
+            for event in _events.get(str(pk), ()):
+                event.set()
+    if conf.WAIT_CACHE and pks:
+        caches[conf.WAIT_CACHE].set_many(
+            {get_cache_key(pk): 1 for pk in pks}, conf.WAIT_DEADLINE)
+
+
+class Waiter:
+
+    """Sleeps between looks, without early wake up"""
+
+    notified: bool = False
+
+    def sleep(self, seconds: float) -> bool:
+        """Sleeps, returns True if woken up early because the transaction completed"""
+        time.sleep(seconds)
+        return False
+
+    async def asleep(self, seconds: float) -> bool:
+        await asyncio.sleep(seconds)
+        return False
+
+
+class TransactionWaiter(Waiter):
+
+    """Sleeps until the transaction pk is confirmed, see the module docstring"""
+
+    def __init__(self, pk, poll_interval: float = None) -> None:
+        self.pk = str(pk)
+        self.poll_interval = poll_interval or conf.WAIT_POLL_INTERVAL
+        self.notified = False
+
+    def completed(self) -> bool:
+        if conf.WAIT_CACHE:
+            return caches[conf.WAIT_CACHE].get(get_cache_key(self.pk)) is not None
+        from vpos.models import Transaction
+        return Transaction.objects.filter(
+            pk=self.pk, completed_at__isnull=False).exists()
+
+    def sleep(self, seconds: float) -> bool:
+        event = threading.Event()
+        with _events_lock:
+            _events.setdefault(self.pk, set()).add(event)
+        try:
+            deadline = time.monotonic() + seconds
+            while (remaining := deadline - time.monotonic()) > 0:
+                if event.wait(min(remaining, self.poll_interval)) or self.completed():
+                    self.notified = True
+                    return True
+            return False
+        finally:
+            with _events_lock:
+                if (events := _events.get(self.pk)) is not None:
+                    events.discard(event)
+                    if not events:
+                        del _events[self.pk]
+
+    async def asleep(self, seconds: float) -> bool:
+        completed = sync_to_async(self.completed)
+        deadline = time.monotonic() + seconds
+        while (remaining := deadline - time.monotonic()) > 0:
+            await asyncio.sleep(min(remaining, self.poll_interval))
+            if await completed():
+                self.notified = True
+                return True
+        return False
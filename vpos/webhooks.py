@@ -0,0 +1,151 @@
+"""
+Parsing of the vPOS webhook calls (see watch_transaction_confirmation).
+
+Every check runs before any DB query, from the cheapest:
+    - the body is never read past WEBHOOK_MAX_BODY_SIZE bytes (413)
+    - the WEBHOOK_VERIFIER checks the signature of the raw body (403)
+    - the body is parsed with orjson if installed (pip install django-vpos[webhooks]),
+      else the json module, and validated by PAYMENT_SCHEMA (400).
+      Only the fields of the schema are kept
+"""
+import hmac
+import json
+import hashlib
+
+from typing import Callable, Iterable, Tuple, Union
+
+from django.http import HttpRequest
+from django.utils.module_loading import import_string
+
+from vpos.configs import conf
+from vpos.exceptions import VposConfigurationError, VposWebhookError
+
+try:
+    import orjson
+except ImportError:  # orjson is optional
+    orjson = None
+
+
+loads: Callable[[bytes], object] = orjson.loads if orjson is not None else json.loads
+
+
+class Field:
+
+    """A field of a Schema, None values are only allowed if not required"""
+
+    __slots__ = ('name', 'types', 'required', 'choices')
+
+    def __init__(self, name: str, types: tuple,
+            required: bool = False, choices: Iterable = None) -> None:
+        self.name = name
+        self.types = types
+        self.required = required
+        self.choices = frozenset(choices) if choices else None
+
+
+class Schema:
+
+    """Fields expected in a JSON object, extract keeps only them"""
+
+    fields: Tuple[Field, ...]
+
+    def __init__(self, *fields: Field) -> None:
+        self.fields = fields
+
+    def extract(self, data) -> dict:
+        """Valid fields of data, raises ValueError if data does not match"""
+        if not isinstance(data, dict):
+            raise ValueError('a JSON object is expected')
+        extracted: dict = {}
+        for field in self.fields:
+            if (value := data.get(field.name)) is None:
+                if field.required:
+                    raise ValueError("'%s' is required" % field.name)
+                if field.name in data:
+                    extracted[field.name] = None
+                continue
+            if not isinstance(value, field.types) or isinstance(value, bool):
+                raise ValueError("'%s' has an invalid type" % field.name)
+            if field.choices is not None and value not in field.choices:
+                raise ValueError("'%s' has an invalid value" % field.name)
+            extracted[field.name] = value
+        return extracted
+
+
+# vPOS transaction fields stored by confirm, type, mobile and amount are columns
+PAYMENT_SCHEMA = Schema(
+    Field('id', (str,), required=True),
+    Field('status', (str,), required=True, choices=('accepted', 'rejected')),
+    Field('status_reason', (str, int)),
+    Field('status_datetime', (str,)),
+    Field('clearing_period', (str,)))
+
+
+class SignatureVerifier:
+
+    """Base of the WEBHOOK_VERIFIER, verify must be cheap, it runs for every call"""
+
+    def verify(self, request: HttpRequest, body: bytes) -> bool:
+        raise NotImplementedError
+
+
+class HmacVerifier(SignatureVerifier):
+
+    """Hex HMAC-SHA256 of the body with WEBHOOK_SECRET, sent in the header attribute"""
+
+    header: str = 'X-Vpos-Signature'
+    digestmod = hashlib.sha256
+
+    def __init__(self, secret: str = None) -> None:
+        secret = secret or conf.WEBHOOK_SECRET
+        if not secret:
+            raise VposConfigurationError('HmacVerifier requires WEBHOOK_SECRET')
+        self.secret = secret.encode() if isinstance(secret, str) else secret
+
+    def verify(self, request: HttpRequest, body: bytes) -> bool:
+        signature: str = request.headers.get(self.header, '')
+        expected = hmac.new(self.secret, body, self.digestmod).hexdigest()
+        return hmac.compare_digest(expected, signature.lower())
+
+
+_verifier: Union[SignatureVerifier, None] = None
+_loaded: bool = False
+
+
+def get_verifier() -> Union[SignatureVerifier, None]:
+    """The verifier of the WEBHOOK_VERIFIER setting, None if not set"""
+    global _verifier, _loaded
+    if not _loaded:
+        _verifier = import_string(conf.WEBHOOK_VERIFIER)() if conf.WEBHOOK_VERIFIER else None
+        _loaded = True
+    return _verifier
+
+
+def reset() -> None:
+    global _verifier, _loaded
+    _verifier, _loaded = None, False
+
+
+def read_body(request: HttpRequest, limit: int) -> bytes:
+    """Request body, raises VposWebhookError (413) past limit bytes"""
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        raise VposWebhookError(400, 'invalid Content-Length')
+    if length > limit:
+        raise VposWebhookError(413, 'body larger than %d bytes' % limit)
+    body: bytes = request.read(limit + 1)
+    if len(body) > limit:
+        raise VposWebhookError(413, 'body larger than %d bytes' % limit)
+    return body
+
+
+def parse(request: HttpRequest, schema: Schema = PAYMENT_SCHEMA) -> dict:
+    """Verified and validated vPOS transaction data of a webhook call"""
+    body = read_body(request, conf.WEBHOOK_MAX_BODY_SIZE)
+    if (verifier := get_verifier()) is not None and not verifier.verify(request, body):
+        raise VposWebhookError(403, 'invalid signature')
+    try:
+        return schema.extract(loads(body))
+    except ValueError as e:
+        raise VposWebhookError(400, str(e))